@@ -6,6 +6,7 @@ import math
 import os
 import sys
 
+import Ckmeans
 import Keys
 import SensorAnalyzer
 
@@ -13,13 +14,14 @@ import SensorAnalyzer
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 libmathdir = os.path.join(currentdir, 'LibMath', 'python')
 sys.path.insert(0, libmathdir)
-import kmeans
 import peaks
 import signals
 
 class AccelerometerAnalyzer(SensorAnalyzer.SensorAnalyzer):
     """Class for performing calculations on accelerometer data."""
 
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, activity_type):
         SensorAnalyzer.SensorAnalyzer.__init__(self, Keys.APP_ACCELEROMETER_KEY, "", activity_type)
         self.x = []
@@ -78,10 +80,10 @@ class AccelerometerAnalyzer(SensorAnalyzer.SensorAnalyzer):
             if area_stddev < 1.0:
                 sets.append(len(peak_list))
 
-            # There's a wide range of variation in the peaks, do a k-means analysis so we can get rid of any outliers.
+            # There's a wide range of variation in the peaks, cluster the areas so we can get rid of any outliers.
             else:
                 significant_peaks = []
-                tags = kmeans.kmeans_equally_space_centroids_1_d(areas, 2, 1, len(areas))
+                tags = Ckmeans.cluster(areas, 2)
                 peak_index = 0
                 for tag in tags:
                     if tag == 1:
@@ -4,36 +4,39 @@
 from __future__ import absolute_import
 from CeleryWorker import celery_worker
 import datetime
-import json
 import logging
-import os
 import sys
 import time
 import traceback
 import ActivityHasher
-import AnalysisScheduler
-import Config
 import DataMgr
 import IntensityCalculator
 import Keys
 import LocationAnalyzer
+import MeanMaximal
 import SensorAnalyzerFactory
+import StreamCodec
+import TrainingLoad
 import Units
-import UserMgr
+import WorkerContext
+
+# Stored with each summary. Bump this whenever a change to the analysis code would change the results, so that existing
+# summaries are recomputed rather than reused.
+ANALYZER_VERSION = 2
+
+# Results that depend on the user's current fitness (FTP, heart rate zones, threshold pace) rather than only on the activity data.
+USER_DEPENDENT_KEYS = [ Keys.INTENSITY_SCORE, Keys.INTENSITY_FACTOR, Keys.POWER_ZONE_DISTRIBUTION, Keys.HEART_RATE_ZONE_DISTRIBUTION ]
 
 class ActivityAnalyzer(object):
     """Class for performing the computationally expensive activity analysis task."""
 
-    def __init__(self, activity, internal_task_id):
+    def __init__(self, activity, internal_task_id, data_mgr, user_mgr):
         self.activity = activity
         self.internal_task_id = internal_task_id # For tracking the status of the analysis
         self.summary_data = {}
         self.speed_graph = None
-        root_dir = os.path.dirname(os.path.abspath(__file__))
-        analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
-        config = Config.Config()
-        self.data_mgr = DataMgr.DataMgr(config=config, root_url="file://" + root_dir, analysis_scheduler=analysis_scheduler, import_scheduler=None)
-        self.user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+        self.data_mgr = data_mgr
+        self.user_mgr = user_mgr
         self.last_yield = time.time()
         super(ActivityAnalyzer, self).__init__()
 
@@ -50,6 +53,96 @@ class ActivityAnalyzer(object):
             time.sleep(0)
             self.last_yield = time.time()
 
+    def is_summary_current(self, summary_data):
+        """Returns True if the existing summary was computed, by this version of the analysis code, from the same data we have now."""
+        if summary_data is None:
+            return False
+        for key in [Keys.ACTIVITY_HASH_KEY, Keys.ACTIVITY_ANALYSIS_INPUTS_HASH_KEY, Keys.ACTIVITY_ANALYZER_VERSION_KEY]:
+            if key not in summary_data or summary_data[key] != self.summary_data[key]:
+                return False
+        return True
+
+    def compute_run_intensity_score(self, activity_user_id, workout_duration_secs, distance_meters, now2):
+        """Computes the intensity score of a run from the user's current threshold pace. Returns None if the threshold pace isn't known."""
+
+        # Compute training paces.
+        print("* (Re)computing the training paces...")
+        _, running_bests, _, _, _, _ = self.data_mgr.retrieve_bounded_activity_bests_for_user(activity_user_id, now2 - DataMgr.FOUR_WEEKS, now2)
+        run_paces = self.data_mgr.compute_run_training_paces(activity_user_id, running_bests)
+
+        # We need to know the user's threshold pace to compute the intensity score.
+        print("* Computing the intensity score...")
+        if Keys.FUNCTIONAL_THRESHOLD_PACE in run_paces:
+            avg_workout_pace_meters_per_sec = distance_meters / workout_duration_secs
+            threshold_pace_meters_per_hour = run_paces[Keys.FUNCTIONAL_THRESHOLD_PACE] * 60.0
+            calc = IntensityCalculator.IntensityCalculator()
+            return calc.estimate_intensity_score(workout_duration_secs, avg_workout_pace_meters_per_sec, threshold_pace_meters_per_hour)
+        return None
+
+    def refresh_user_dependent_results(self, activity_user_id, activity_type, now2):
+        """Recomputes the parts of the summary that depend on the user's current fitness (FTP, heart rate zones, threshold pace) rather"""
+        """than on the activity data. Returns True if anything changed."""
+        old_results = dict((key, self.summary_data.pop(key)) for key in USER_DEPENDENT_KEYS if key in self.summary_data)
+
+        # Power based intensity score and power zones, same as the power analyzer.
+        if Keys.APP_POWER_KEY in self.activity:
+            times, values = StreamCodec.time_value_arrays(self.activity[Keys.APP_POWER_KEY])
+            if len(times) > 0:
+                ftp = self.user_mgr.estimate_ftp(activity_user_id)
+                self.summary_data.update(TrainingLoad.power_results(MeanMaximal.cumulative_seconds(times, values), ftp))
+
+        # Heart rate zones, same as the heart rate analyzer.
+        if Keys.APP_HEART_RATE_KEY in self.activity:
+            times, values = StreamCodec.time_value_arrays(self.activity[Keys.APP_HEART_RATE_KEY])
+            if len(times) > 0:
+                zone_bounds = TrainingLoad.heart_rate_zone_bounds(self.user_mgr, activity_user_id)
+                self.summary_data.update(TrainingLoad.heart_rate_results(MeanMaximal.cumulative_seconds(times, values), zone_bounds))
+
+        # Pace based intensity score. As in the full analysis, this takes precedence over the power based score.
+        if activity_type in Keys.RUNNING_ACTIVITIES and Keys.APP_DURATION_KEY in self.summary_data and Keys.LONGEST_DISTANCE in self.summary_data:
+            intensity_score = self.compute_run_intensity_score(activity_user_id, self.summary_data[Keys.APP_DURATION_KEY], self.summary_data[Keys.LONGEST_DISTANCE], now2)
+            if intensity_score is not None:
+                self.summary_data[Keys.INTENSITY_SCORE] = intensity_score
+
+        new_results = dict((key, self.summary_data[key]) for key in USER_DEPENDENT_KEYS if key in self.summary_data)
+        return new_results != old_results
+
+    def reuse_existing_summary(self, activity_user_id, activity_id, activity_type, existing_summary, now2):
+        """Called instead of the full analysis when the activity hasn't changed since it was last analyzed."""
+        hashes = dict((key, self.summary_data[key]) for key in [Keys.ACTIVITY_HASH_KEY, Keys.ACTIVITY_HASH_STATE_KEY, Keys.ACTIVITY_ANALYSIS_INPUTS_HASH_KEY, Keys.ACTIVITY_ANALYZER_VERSION_KEY])
+        self.summary_data = dict(existing_summary)
+        self.summary_data.update(hashes)
+        if not self.refresh_user_dependent_results(activity_user_id, activity_type, now2):
+            return
+
+        # Only the user dependent results changed, so the bests cache needs the new values but the power and pace curves are still valid.
+        print("Storing the updated activity summary...")
+        if not self.data_mgr.create_activity_summary(activity_id, self.summary_data):
+            self.log_error("Error returned when saving activity summary data: " + str(self.summary_data))
+        if Keys.ACTIVITY_START_TIME_KEY in self.activity:
+            activity_time = self.activity[Keys.ACTIVITY_START_TIME_KEY]
+            if not self.data_mgr.update_activity_bests_and_personal_records_cache(activity_user_id, activity_id, activity_type, activity_time, self.summary_data, False):
+                self.log_error("Error returned when updating personal records.")
+
+    def load_activity(self, activity_id, activity_user_id, analysis_request):
+        """Loads the activity to be analyzed. Returns False if there's nothing to do, either because the activity no longer exists"""
+        """or because it was queued for analysis again after this task was queued, in which case the newer task will do the work."""
+        latest_request = self.data_mgr.retrieve_activity_analysis_request(activity_id)
+        if latest_request is None:
+            self.log_error("The activity " + str(activity_id) + " could not be found.")
+            return False
+        if latest_request > analysis_request:
+            print("A newer analysis of this activity has been queued, skipping.")
+            self.data_mgr.update_deferred_task(activity_user_id, self.internal_task_id, activity_id, Keys.TASK_STATUS_FINISHED)
+            return False
+
+        self.activity = self.data_mgr.retrieve_activity_for_analysis(activity_id)
+        if self.activity is None:
+            self.log_error("The activity " + str(activity_id) + " could not be loaded.")
+            return False
+        self.activity[Keys.ACTIVITY_USER_ID_KEY] = activity_user_id
+        return True
+
     def perform_analysis(self):
         """Main analysis routine."""
 
@@ -89,37 +182,41 @@ class ActivityAnalyzer(object):
             print("Computing the start time...")
             start_time_secs = self.data_mgr.update_activity_start_time(self.activity)
 
-            # Hash the activity.
+            # The results of the last analysis, if any. These were loaded along with the activity.
+            existing_summary = None
+            if Keys.ACTIVITY_ID_KEY in self.activity:
+                activity_id = self.activity[Keys.ACTIVITY_ID_KEY]
+            if Keys.ACTIVITY_SUMMARY_KEY in self.activity:
+                existing_summary = self.activity[Keys.ACTIVITY_SUMMARY_KEY]
+
+            # Hash the activity. If data was only appended since the last time, the saved hash state lets us skip what was already hashed.
             print("Hashing the activity...")
             hasher = ActivityHasher.ActivityHasher(self.activity)
-            hash_str = hasher.hash()
-            self.summary_data[Keys.ACTIVITY_HASH_KEY] = hash_str
+            hash_state = None
+            if existing_summary is not None and Keys.ACTIVITY_HASH_STATE_KEY in existing_summary:
+                hash_state = existing_summary[Keys.ACTIVITY_HASH_STATE_KEY]
+            chained_hasher = hasher.chained_hasher(hash_state)
+            self.summary_data[Keys.ACTIVITY_HASH_KEY] = chained_hasher.hexdigest()
+            self.summary_data[Keys.ACTIVITY_HASH_STATE_KEY] = chained_hasher.state()
+            self.summary_data[Keys.ACTIVITY_ANALYSIS_INPUTS_HASH_KEY] = hasher.hash_analysis_inputs(activity_type, SensorAnalyzerFactory.supported_sensor_types())
+            self.summary_data[Keys.ACTIVITY_ANALYZER_VERSION_KEY] = ANALYZER_VERSION
+
+            # If neither the data nor the analysis code has changed since the last time this activity was analyzed then there's
+            # no need to do it all again. Only the results that depend on the user's current fitness can have changed.
+            if activity_id is not None:
+                if self.is_summary_current(existing_summary):
+                    print("Activity is unchanged since the last analysis, refreshing the user dependent results...")
+                    self.reuse_existing_summary(activity_user_id, activity_id, activity_type, existing_summary, now2)
+                    self.data_mgr.update_deferred_task(activity_user_id, self.internal_task_id, activity_id, Keys.TASK_STATUS_FINISHED)
+                    return
 
             # Do the location analysis.
             print("Performing location analysis...")
             location_analyzer = None
             if Keys.ACTIVITY_LOCATIONS_KEY in self.activity:
                 location_analyzer = LocationAnalyzer.LocationAnalyzer(activity_type)
-                locations = self.activity[Keys.ACTIVITY_LOCATIONS_KEY]
-                for location in locations:
-
-                    # Required elements.
-                    time_ms = location[Keys.LOCATION_TIME_KEY]
-                    latitude = location[Keys.LOCATION_LAT_KEY]
-                    longitude = location[Keys.LOCATION_LON_KEY]
-                    altitude = location[Keys.LOCATION_ALT_KEY]
-
-                    # Optional elements.
-                    horizontal_accuracy = 0.0
-                    vertical_accuracy = 0.0
-                    if Keys.LOCATION_HORIZONTAL_ACCURACY_KEY in location:
-                        horizontal_accuracy = location[Keys.LOCATION_HORIZONTAL_ACCURACY_KEY]
-                    if Keys.LOCATION_VERTICAL_ACCURACY_KEY in location:
-                        vertical_accuracy = location[Keys.LOCATION_VERTICAL_ACCURACY_KEY]
-
-                    # Update the analyzer.
-                    location_analyzer.append_location(time_ms, latitude, longitude, altitude, horizontal_accuracy, vertical_accuracy)
-                    location_analyzer.update_speeds()
+                location_analyzer.append_locations(self.activity[Keys.ACTIVITY_LOCATIONS_KEY])
+                location_analyzer.update_speeds()
 
                 self.summary_data.update(location_analyzer.analyze())
 
@@ -198,28 +295,17 @@ class ActivityAnalyzer(object):
 
                 # If activity duration and distance have been calculated.
                 print("Computing the intensity score and training paces...")
-                if start_time_secs > 0 and end_time_secs > 0 and end_time_secs > start_time_secs and len(location_analyzer.distance_buf) > 0:
+                if start_time_secs > 0 and end_time_secs > 0 and end_time_secs > start_time_secs and location_analyzer is not None and len(location_analyzer.distance_buf) > 0:
 
                     # These are used by both cycling and running intensity calculations.
                     distance_entry = location_analyzer.distance_buf[-1]
                     workout_duration_secs = end_time_secs - start_time_secs
-                    avg_workout_pace_meters_per_sec =  distance_entry[1] / workout_duration_secs
                     self.summary_data[Keys.APP_DURATION_KEY] = workout_duration_secs
 
                     # Running activity.
                     if activity_type in Keys.RUNNING_ACTIVITIES:
-
-                        # Compute training paces.
-                        print("* (Re)computing the training paces...")
-                        _, running_bests, _, _, _, _ = self.data_mgr.retrieve_bounded_activity_bests_for_user(activity_user_id, now2 - DataMgr.FOUR_WEEKS, now2)
-                        run_paces = self.data_mgr.compute_run_training_paces(activity_user_id, running_bests)
-
-                        # We need to know the user's threshold pace to compute the intensity score.
-                        print("* Computing the intensity score...")
-                        if Keys.FUNCTIONAL_THRESHOLD_PACE in run_paces:
-                            threshold_pace_meters_per_hour = run_paces[Keys.FUNCTIONAL_THRESHOLD_PACE] * 60.0
-                            calc = IntensityCalculator.IntensityCalculator()
-                            stress = calc.estimate_intensity_score(workout_duration_secs, avg_workout_pace_meters_per_sec, threshold_pace_meters_per_hour)
+                        stress = self.compute_run_intensity_score(activity_user_id, workout_duration_secs, distance_entry[1], now2)
+                        if stress is not None:
                             self.summary_data[Keys.INTENSITY_SCORE] = stress
 
                     # Cycling activity.
@@ -230,6 +316,11 @@ class ActivityAnalyzer(object):
                 print("Storing the activity summary...")
                 if not self.data_mgr.create_activity_summary(activity_id, self.summary_data):
                     self.log_error("Error returned when saving activity summary data: " + str(self.summary_data))
+
+                # The raw data isn't going to change now, so it can be stored in the compact format.
+                print("Compacting the activity data...")
+                if not self.data_mgr.compact_activity_streams(activity_id):
+                    self.log_error("Error returned when compacting activity data.")
             else:
                 self.log_error("Activity ID not provided. Cannot create activity summary.")
 
@@ -247,6 +338,12 @@ class ActivityAnalyzer(object):
 
                 if not self.data_mgr.update_activity_bests_and_personal_records_cache(activity_user_id, activity_id, activity_type, activity_time, self.summary_data, prune_activity_summary_cache):
                     self.log_error("Error returned when updating personal records.")
+
+                # Update the power and pace curves. These are built from the activity bests, so this has to come second.
+                if activity_id is not None:
+                    print("Updating the power and pace curves...")
+                    if not self.data_mgr.update_duration_curves(activity_user_id, activity_id, activity_type, activity_time, self.summary_data):
+                        self.log_error("Error returned when updating the power and pace curves.")
             else:
                 self.log_error("Activity time not provided. Cannot update personal records.")
 
@@ -258,20 +355,18 @@ class ActivityAnalyzer(object):
             self.log_error(sys.exc_info()[0])
 
 @celery_worker.task(ignore_result=True)
-def analyze_activity(activity_str, internal_task_id):
+def analyze_activity(activity_id, activity_user_id, analysis_request, internal_task_id):
     print("Starting activity analysis...")
-    activity_obj = json.loads(activity_str)
-    analyzer = ActivityAnalyzer(activity_obj, internal_task_id)
-    analyzer.perform_analysis()
+    context = WorkerContext.get_worker_context()
+    analyzer = ActivityAnalyzer(None, internal_task_id, context.data_mgr, context.user_mgr)
+    if analyzer.load_activity(activity_id, activity_user_id, analysis_request):
+        analyzer.perform_analysis()
     print("Activity analysis finished")
 
 @celery_worker.task(ignore_result=True)
 def analyze_personal_records(user_str, internal_task_id):
     print("Starting personal record analysis...")
-    root_dir = os.path.dirname(os.path.abspath(__file__))
-    analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
-    config = Config.Config()
-    data_mgr = DataMgr.DataMgr(config=config, root_url="file://" + root_dir, analysis_scheduler=analysis_scheduler, import_scheduler=None)
+    data_mgr = WorkerContext.get_worker_context().data_mgr
     data_mgr.refresh_personal_records_cache(user_str)
     print("Personal record analysis finished")
 
@@ -2,7 +2,85 @@
 """Computes the hash of an activity. Used to determine uniqueness."""
 
 import hashlib
+import numpy as np
 import Keys
+import StreamCodec
+
+# Hash formats. The original format is SHA-512 over the text form of each location. The current format is BLAKE2b over
+# packed, fixed-point location rows, chained one chunk at a time so that appended data can be hashed without starting over.
+HASH_FORMAT_SHA512_TEXT = "sha512_text"
+HASH_FORMAT_BLAKE2B_CHAINED = "blake2b_chained"
+DEFAULT_HASH_FORMAT = HASH_FORMAT_BLAKE2B_CHAINED
+
+BLAKE2B_DIGEST_SIZE = 32 # Bytes. Makes the hex digest 64 characters, so it can't be confused with a SHA-512 digest (128 characters).
+BLAKE2B_PERSON = b'OWW locations 1' # Domain separation, so the digests can't collide with those of any other use of BLAKE2b.
+CHUNK_ROWS = 1024 # Number of location rows fed to the hash at a time, i.e. 32 KB per update.
+FIXED_POINT_SCALE = 1000000.0 # Same precision as the six decimal places of the text format.
+ROW_DTYPE = '<i8'
+
+def hash_format(hash_str):
+    """Returns the format of the given hash string, or None if it isn't a hash we know how to compute."""
+    if hash_str is None:
+        return None
+    if len(hash_str) == 2 * hashlib.sha512().digest_size:
+        return HASH_FORMAT_SHA512_TEXT
+    if len(hash_str) == 2 * BLAKE2B_DIGEST_SIZE:
+        return HASH_FORMAT_BLAKE2B_CHAINED
+    return None
+
+def pack_location_rows(times, latitudes, longitudes, altitudes):
+    """Packs locations into an (n, 4) array of little-endian int64 rows: time (ms), then latitude, longitude and altitude in millionths."""
+    rows = np.empty((len(times), 4), dtype=ROW_DTYPE)
+    rows[:, 0] = np.asarray(times, dtype=np.float64)
+    rows[:, 1] = np.rint(np.asarray(latitudes, dtype=np.float64) * FIXED_POINT_SCALE)
+    rows[:, 2] = np.rint(np.asarray(longitudes, dtype=np.float64) * FIXED_POINT_SCALE)
+    rows[:, 3] = np.rint(np.asarray(altitudes, dtype=np.float64) * FIXED_POINT_SCALE)
+    return rows
+
+class ChainedHasher(object):
+    """Incremental BLAKE2b hash of packed location rows. Each complete chunk of CHUNK_ROWS rows is folded into the chain value,"""
+    """chain = BLAKE2b(chain || chunk), so the result doesn't depend on how the rows were split up when they were appended."""
+    """The state (the chain value and the number of rows it covers) is small enough to be stored and resumed from later."""
+
+    def __init__(self, chain=None, num_chained_rows=0, last_chained_time=None):
+        if chain is None:
+            chain = hashlib.blake2b(digest_size=BLAKE2B_DIGEST_SIZE, person=BLAKE2B_PERSON).digest()
+        self.chain = chain
+        self.num_chained_rows = num_chained_rows
+        self.last_chained_time = last_chained_time # Time of the last row in the chain, for checking that a saved state still applies
+        self.pending = np.empty((0, 4), dtype=ROW_DTYPE)
+        super(ChainedHasher, self).__init__()
+
+    @staticmethod
+    def from_state(state):
+        """Resumes from a state returned by 'state'. The caller is then expected to append the rows after state[Keys.HASH_STATE_NUM_ROWS_KEY]."""
+        return ChainedHasher(bytes.fromhex(state[Keys.HASH_STATE_CHAIN_KEY]), state[Keys.HASH_STATE_NUM_ROWS_KEY], state[Keys.HASH_STATE_LAST_TIME_KEY])
+
+    def state(self):
+        """Returns the part of the hash that covers complete chunks. Rows in the current, partial, chunk must be appended again when resuming."""
+        return { Keys.HASH_STATE_CHAIN_KEY: self.chain.hex(), Keys.HASH_STATE_NUM_ROWS_KEY: self.num_chained_rows, Keys.HASH_STATE_LAST_TIME_KEY: self.last_chained_time }
+
+    def update(self, rows):
+        """Appends location rows, as returned by pack_location_rows."""
+        if len(self.pending) > 0:
+            rows = np.concatenate((self.pending, rows))
+        rows = np.ascontiguousarray(rows, dtype=ROW_DTYPE)
+        num_complete_rows = (len(rows) // CHUNK_ROWS) * CHUNK_ROWS
+        for start in range(0, num_complete_rows, CHUNK_ROWS):
+            h = hashlib.blake2b(self.chain, digest_size=BLAKE2B_DIGEST_SIZE, person=BLAKE2B_PERSON)
+            h.update(rows[start:start + CHUNK_ROWS].data)
+            self.chain = h.digest()
+        if num_complete_rows > 0:
+            self.last_chained_time = int(rows[num_complete_rows - 1][0])
+        self.num_chained_rows = self.num_chained_rows + num_complete_rows
+        self.pending = rows[num_complete_rows:]
+
+    def hexdigest(self):
+        """Returns the hash of everything appended so far. Doesn't change the state, so more rows can still be appended."""
+        h = hashlib.blake2b(self.chain, digest_size=BLAKE2B_DIGEST_SIZE, person=BLAKE2B_PERSON)
+        h.update(self.pending.data)
+        h.update(np.array([self.num_chained_rows + len(self.pending)], dtype=ROW_DTYPE).data)
+        return h.hexdigest()
 
 class ActivityHasher(object):
     """Computes the hash of an activity. Used to determine uniqueness."""
@@ -19,8 +97,58 @@ class ActivityHasher(object):
         formatted_str = str(int(float(str_num)))
         return formatted_str
 
-    def hash(self):
-        """Main analysis routine."""
+    def location_rows(self, first_row=0):
+        """Returns the activity's locations, from the given index on, packed for hashing."""
+        if Keys.ACTIVITY_LOCATIONS_KEY not in self.activity:
+            return pack_location_rows([], [], [], [])
+        locations = self.activity[Keys.ACTIVITY_LOCATIONS_KEY]
+        if first_row > 0:
+            locations = locations[first_row:]
+        stream_data = StreamCodec.from_values(Keys.APP_LOCATIONS_KEY, locations)
+        if len(stream_data) == 0:
+            return pack_location_rows([], [], [], [])
+        return pack_location_rows(stream_data.times, stream_data.column(Keys.LOCATION_LAT_KEY), stream_data.column(Keys.LOCATION_LON_KEY), stream_data.column(Keys.LOCATION_ALT_KEY))
+
+    def chained_hasher(self, state=None):
+        """Returns a ChainedHasher that has consumed all of the activity's locations. If a previously saved state is provided, and still"""
+        """agrees with the data, only the rows after it are hashed, i.e. appending to a live activity doesn't mean rehashing everything."""
+        """The hasher's state can then be saved for next time."""
+        num_locations = len(self.activity.get(Keys.ACTIVITY_LOCATIONS_KEY, []))
+        if state is not None and 0 < state[Keys.HASH_STATE_NUM_ROWS_KEY] <= num_locations:
+            num_rows = state[Keys.HASH_STATE_NUM_ROWS_KEY]
+
+            # Cheap check that the rows we're skipping are the ones the state was computed from.
+            rows = self.location_rows(num_rows - 1)
+            if rows[0][0] == state[Keys.HASH_STATE_LAST_TIME_KEY]:
+                hasher = ChainedHasher.from_state(state)
+                hasher.update(rows[1:])
+                return hasher
+        hasher = ChainedHasher()
+        hasher.update(self.location_rows())
+        return hasher
+
+    def hash(self, hash_format=DEFAULT_HASH_FORMAT):
+        """Computes the hash of the activity's locations in the requested format."""
+
+        # Sanity check.
+        if self.activity is None:
+            return
+
+        if hash_format == HASH_FORMAT_SHA512_TEXT:
+            return self.hash_sha512_text()
+        print("Hashing locations...")
+        return self.chained_hasher().hexdigest()
+
+    def verify(self, hash_str):
+        """Returns True if the hash string matches this activity. Works with hashes in any of the supported formats."""
+        """Returns False for malformed or unrecognized hashes."""
+        fmt = hash_format(hash_str)
+        if fmt is None:
+            return False
+        return self.hash(fmt) == hash_str.lower()
+
+    def hash_sha512_text(self):
+        """Computes the hash in the original format, SHA-512 over the text form of each location."""
 
         # Sanity check.
         if self.activity is None:
@@ -47,3 +175,28 @@ class ActivityHasher(object):
         # Finalize the hash digest.
         hash_str = h.hexdigest()
         return hash_str
+
+    def hash_analysis_inputs(self, activity_type, sensor_types):
+        """Hashes the things, other than the locations, that the analysis depends on: the activity type and the sensor data."""
+        """Combined with the location hash, this tells us whether an existing analysis is still valid."""
+
+        # Sanity check.
+        if self.activity is None:
+            return
+
+        h = hashlib.blake2b(digest_size=BLAKE2B_DIGEST_SIZE)
+        h.update(str(activity_type).encode('utf-8'))
+
+        # Hash the raw sensor arrays. This is only compared against our own earlier result, so it doesn't need to be portable.
+        for sensor_type in sorted(sensor_types):
+            if sensor_type in self.activity:
+                stream_data = StreamCodec.from_values(sensor_type, self.activity[sensor_type])
+                h.update(sensor_type.encode('utf-8'))
+                h.update(stream_data.times.tobytes())
+                for name in sorted(stream_data.columns.keys()):
+                    h.update(name.encode('utf-8'))
+                    h.update(stream_data.columns[name].astype('<f8').tobytes())
+
+        # Finalize the hash digest.
+        hash_str = h.hexdigest()
+        return hash_str
@@ -27,6 +27,7 @@ import logging
 import sys
 import traceback
 import uuid
+import Keys
 
 class AnalysisScheduler(object):
     """Class for scheduling computationally expensive analysis tasks."""
@@ -39,16 +40,20 @@ class AnalysisScheduler(object):
         logger = logging.getLogger()
         logger.error(log_str)
 
-    def add_activity_to_analysis_queue(self, activity):
+    def add_activity_to_analysis_queue(self, activity_id, activity_user_id, analysis_request, user_initiated):
         """Adds the activity ID to the list of activities to be analyzed."""
+        """The message only carries the ID, not the activity, so its size doesn't depend on the size of the activity."""
+        """Analysis that the user asked for (directly, or by uploading the activity) skips ahead of the background analysis."""
         """Returns [celery task id, our task id]."""
-        from bson.json_util import dumps
         from ActivityAnalyzer import analyze_activity
 
         try:
-            activity_str = dumps(activity)
             internal_task_id = uuid.uuid4()
-            analysis_task = analyze_activity.delay(activity_str, internal_task_id)
+            args = (str(activity_id), str(activity_user_id), analysis_request, internal_task_id)
+            if user_initiated:
+                analysis_task = analyze_activity.apply_async(args, queue=Keys.CELERY_INTERACTIVE_QUEUE, priority=Keys.CELERY_USER_PRIORITY)
+            else:
+                analysis_task = analyze_activity.apply_async(args)
             return analysis_task.task_id, internal_task_id
         except:
             self.log_error(traceback.format_exc())
@@ -61,25 +66,24 @@ class AnalysisScheduler(object):
 
         try:
             internal_task_id = uuid.uuid4()
-            analysis_task = analyze_personal_records.delay(user_id, internal_task_id)
+            analysis_task = analyze_personal_records.apply_async((user_id, internal_task_id), priority=Keys.CELERY_USER_PRIORITY) # Always follows something the user did
             return analysis_task.task_id, internal_task_id
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return None, None
 
-    def add_user_to_workout_plan_queue(self, user_id, data_mgr):
+    def add_user_to_workout_plan_queue(self, user_id, user_initiated, data_mgr):
         """Adds the user to the list of workout plans to be generated."""
         from bson.json_util import dumps
         from WorkoutPlanGenerator import generate_workout_plan_for_user
 
-        import Keys
-
         user_obj = {}
         user_obj[Keys.USER_ID_KEY] = user_id
 
         internal_task_id = uuid.uuid4()
-        plan_task = generate_workout_plan_for_user.delay(dumps(user_obj), internal_task_id)
+        priority = Keys.CELERY_USER_PRIORITY if user_initiated else 0
+        plan_task = generate_workout_plan_for_user.apply_async((dumps(user_obj), internal_task_id), priority=priority)
         data_mgr.create_deferred_task(user_id, Keys.WORKOUT_PLAN_TASK_KEY, plan_task.task_id, internal_task_id, None)
 
     def add_inputs_to_workout_plan_queue(self, user_id, inputs, data_mgr):
@@ -87,11 +91,9 @@ class AnalysisScheduler(object):
         from bson.json_util import dumps
         from WorkoutPlanGenerator import generate_workout_plan_from_inputs
 
-        import Keys
-
         user_obj = {}
         user_obj[Keys.USER_ID_KEY] = user_id
 
         internal_task_id = uuid.uuid4()
-        plan_task = generate_workout_plan_from_inputs.delay(dumps(user_obj), internal_task_id)
+        plan_task = generate_workout_plan_from_inputs.apply_async((dumps(user_obj), internal_task_id), priority=Keys.CELERY_USER_PRIORITY) # Only ever requested by the user
         data_mgr.create_deferred_task(user_id, Keys.WORKOUT_PLAN_TASK_KEY, plan_task.task_id, internal_task_id, None)
@@ -28,7 +28,9 @@ import datetime
 import json
 import logging
 import time
+import ActivityHasher
 import ApiException
+import DurationCurves
 import Exporter
 import InputChecker
 import Keys
@@ -162,6 +164,7 @@ class Api(object):
         locations = []
         sensor_readings_dict = {}
         metadata_list_dict = {}
+        stored = True
 
         # Parse required identifiers.
         device_str = values[Keys.APP_DEVICE_ID_KEY]
@@ -186,7 +189,7 @@ class Api(object):
 
             # Update the activity.
             if locations:
-                self.data_mgr.update_moving_activity(device_str, activity_id, locations, sensor_readings_dict, metadata_list_dict)
+                stored = self.data_mgr.update_moving_activity(device_str, activity_id, locations, sensor_readings_dict, metadata_list_dict)
 
         if Keys.APP_ACCELEROMETER_KEY in values:
 
@@ -222,8 +225,13 @@ class Api(object):
                 if activity_type_updated:
                     self.data_mgr.create_default_tags_on_activity(self.user_id, activity_type, activity_id)
 
-        # Analysis is now obsolete, so delete it.
-        self.data_mgr.delete_activity_summary(activity_id)
+        # Bring the running analysis up to date. The summary is what live pages and API consumers see until the activity is fully analyzed.
+        # If the batch couldn't be stored then the running analysis can't include it either, so stop it rather than let the summary show
+        # data that the activity doesn't have.
+        if stored:
+            self.data_mgr.update_live_activity_analysis(activity_id, activity_type, locations, sensor_readings_dict)
+        else:
+            self.data_mgr.invalidate_live_activity_analysis(activity_id, activity_type)
 
         return True, ""
 
@@ -376,8 +384,8 @@ class Api(object):
         if not InputChecker.is_uuid(activity_id):
             raise ApiException.ApiMalformedRequestException("Invalid activity ID.")
 
-        # Get the activity from the database.
-        activity = self.data_mgr.retrieve_activity(activity_id)
+        # Get the activity from the database. Raw data streams are read separately, and only if requested.
+        activity = self.data_mgr.retrieve_activity_small(activity_id)
         if activity is None:
             raise ApiException.ApiMalformedRequestException("Activity not found.")
 
@@ -388,7 +396,11 @@ class Api(object):
         response = {}
 
         for sensor_name in values[Keys.SENSOR_LIST_KEY].split(','):
-            if sensor_name in activity:
+            if sensor_name in Keys.ACTIVITY_STREAM_KEYS:
+                stream = self.data_mgr.retrieve_activity_stream(activity_id, sensor_name, None, None)
+                if stream:
+                    response[sensor_name] = stream
+            elif sensor_name in activity:
 
                 # Need to fix up the datetime item for each event.
                 if sensor_name == 'Events':
@@ -471,6 +483,10 @@ class Api(object):
         if Keys.ACTIVITY_TYPE_KEY in values:
             if not self.data_mgr.create_activity_metadata(activity_id, 0, Keys.ACTIVITY_TYPE_KEY, values[Keys.ACTIVITY_TYPE_KEY], False):
                 raise Exception("Failed to update activity type.")
+
+            # The bests, and the power and pace curves they feed, are filed by activity type, so they need to be redone.
+            if activity.get(Keys.ACTIVITY_TYPE_KEY) != values[Keys.ACTIVITY_TYPE_KEY]:
+                self.data_mgr.schedule_activity_analysis(activity_id, self.user_id, False)
         if Keys.ACTIVITY_DESCRIPTION_KEY in values:
             if not self.data_mgr.create_activity_metadata(activity_id, 0, Keys.ACTIVITY_DESCRIPTION_KEY, values[Keys.ACTIVITY_DESCRIPTION_KEY], False):
                 raise Exception("Failed to update activity description.")
@@ -1896,12 +1912,12 @@ class Api(object):
         if not InputChecker.is_uuid(activity_id):
             raise ApiException.ApiMalformedRequestException("Invalid activity ID.")
 
-        activity = self.data_mgr.retrieve_activity(activity_id)
+        activity = self.data_mgr.retrieve_activity_small(activity_id)
         if not activity:
             raise ApiException.ApiMalformedRequestException("Invalid activity.")
 
         activity_user_id, _, _ = self.data_mgr.get_activity_user(activity)
-        self.data_mgr.schedule_activity_analysis(activity, activity_user_id)
+        self.data_mgr.schedule_activity_analysis(activity_id, activity_user_id, True)
         return True, ""
 
     def handle_refresh_personal_records(self, values):
@@ -1917,7 +1933,7 @@ class Api(object):
         if self.user_id is None:
             raise ApiException.ApiNotLoggedInException()
 
-        self.data_mgr.generate_workout_plan_for_user(self.user_id)
+        self.data_mgr.generate_workout_plan_for_user(self.user_id, True)
         return True, ""
 
     def handle_generate_workout_plan_from_inputs(self, values):
@@ -2298,12 +2314,20 @@ class Api(object):
         if not InputChecker.is_uuid(activity_id):
             raise ApiException.ApiMalformedRequestException("Invalid activity ID.")
 
+        # Hash format. Clients that don't say which format they want are using the original one.
+        hash_format = ActivityHasher.HASH_FORMAT_SHA512_TEXT
+        if Keys.ACTIVITY_HASH_FORMAT_KEY in values:
+            hash_format = values[Keys.ACTIVITY_HASH_FORMAT_KEY]
+            if hash_format not in [ ActivityHasher.HASH_FORMAT_SHA512_TEXT, ActivityHasher.HASH_FORMAT_BLAKE2B_CHAINED ]:
+                raise ApiException.ApiMalformedRequestException("Invalid hash format.")
+
         # Hash from database.
         summary_data = self.data_mgr.retrieve_activity_summary(activity_id)
-        if Keys.ACTIVITY_HASH_KEY not in summary_data:
+        activity_hash = self.data_mgr.retrieve_activity_hash(activity_id, summary_data, hash_format)
+        if activity_hash is None:
             raise ApiException.ApiMalformedRequestException("Hash not found.")
 
-        return True, str(summary_data[Keys.ACTIVITY_HASH_KEY])
+        return True, str(activity_hash)
 
     def handle_has_activity(self, values):
         """Given the activity hash, return sthe activity ID, or an error if not found. Only looks at the logged in user's activities."""
@@ -2338,8 +2362,13 @@ class Api(object):
         if activity_hash is not None:
             if Keys.ACTIVITY_HASH_KEY not in summary_data:
                 return True, json.dumps( { Keys.CODE_KEY: Keys.ACTIVITY_MATCH_CODE_HASH_NOT_COMPUTED, Keys.ACTIVITY_ID_KEY: activity_id } ) # Activity exists, hash not computed
-            hash_from_db = summary_data[Keys.ACTIVITY_HASH_KEY]
-            if hash_from_db != activity_hash:
+
+            # Compare against the stored hash in the same format as the client's.
+            hash_format = ActivityHasher.hash_format(activity_hash)
+            hash_from_db = None
+            if hash_format is not None:
+                hash_from_db = self.data_mgr.retrieve_activity_hash(activity_id, summary_data, hash_format)
+            if hash_from_db is None or hash_from_db != activity_hash.lower():
                 return True, json.dumps( { Keys.CODE_KEY: Keys.ACTIVITY_MATCH_CODE_HASH_DOES_NOT_MATCH, Keys.ACTIVITY_ID_KEY: activity_id } ) # Activity exists, has does not match
         else:
             return True, json.dumps( { Keys.CODE_KEY: Keys.ACTIVITY_MATCH_CODE_HASH_NOT_PROVIDED, Keys.ACTIVITY_ID_KEY: activity_id } ) # Activity exists, hash not provided
@@ -2492,6 +2521,43 @@ class Api(object):
         result = self.data_mgr.compute_training_intensity_for_timeframe(self.user_id, start_time, end_time)
         return True, str(result)
 
+    def handle_get_duration_curve(self, values):
+        """Returns the user's power-duration or pace-duration curve, i.e., the best effort for each duration, as a JSON list of [seconds, value]."""
+        """Power is in watts and pace is in meters per second. Defaults to all cycling or running activities and all time."""
+        if self.user_id is None:
+            raise ApiException.ApiNotLoggedInException()
+
+        # Required parameters.
+        if Keys.DURATION_CURVE_KEY not in values:
+            raise ApiException.ApiMalformedRequestException("Curve not specified.")
+
+        # Decode and validate the required parameters.
+        curve_type = values[Keys.DURATION_CURVE_KEY]
+        if curve_type not in DurationCurves.CURVE_TYPES:
+            raise ApiException.ApiMalformedRequestException("Invalid curve.")
+        curve_name = DurationCurves.CURVE_TYPES[curve_type]
+
+        # Optional parameters.
+        activity_types = DurationCurves.DEFAULT_ACTIVITY_TYPES[curve_name]
+        if Keys.ACTIVITY_TYPE_KEY in values:
+            activity_type = values[Keys.ACTIVITY_TYPE_KEY]
+            if not InputChecker.is_valid_decoded_str(activity_type):
+                raise ApiException.ApiMalformedRequestException("Invalid activity type.")
+            activity_types = [ activity_type ]
+        start_time = 0
+        if Keys.START_TIME_KEY in values:
+            if not InputChecker.is_unsigned_integer(values[Keys.START_TIME_KEY]):
+                raise ApiException.ApiMalformedRequestException("Invalid start time.")
+            start_time = int(values[Keys.START_TIME_KEY])
+        end_time = int(time.time()) + 1
+        if Keys.END_TIME_KEY in values:
+            if not InputChecker.is_unsigned_integer(values[Keys.END_TIME_KEY]):
+                raise ApiException.ApiMalformedRequestException("Invalid ending time.")
+            end_time = int(values[Keys.END_TIME_KEY])
+
+        curve = self.data_mgr.retrieve_duration_curve(self.user_id, curve_name, activity_types, start_time, end_time)
+        return True, json.dumps(curve)
+
     def handle_get_user_setting(self, values):
         """Returns the value associated with the specified user setting."""
         if self.user_id is None:
@@ -2729,6 +2795,8 @@ class Api(object):
             return self.handle_get_record_progression(values)
         elif request == 'get_training_intensity_for_timeframe':
             return self.handle_get_training_intensity_for_timeframe(values)
+        elif request == 'get_duration_curve':
+            return self.handle_get_duration_curve(values)
         elif request == 'get_user_setting':
             return self.handle_get_user_setting(values)
         elif request == 'get_user_settings':
@@ -295,7 +295,19 @@ class App(object):
         exports_str += "<td><button type=\"button\" onclick=\"return export_activity()\">Export</button></td><tr>\n"
         return exports_str
 
-    def render_page_for_unmapped_activity(self, user_realname, activity_id, activity, activity_user_id, activity_user_max_hr, logged_in_username, belongs_to_current_user, is_live):
+    def render_zone_fallback_settings(self, activity_user_id, summary_data, include_power):
+        """Returns the max heart rate and FTP the page needs to compute the time in zones itself. The analysis stores the time in zones"""
+        """in the summary, so these are only looked up for activities that haven't been analyzed by the current version of the analysis code."""
+        max_hr = 0.0
+        ftp = 0.0
+        if activity_user_id is not None:
+            if Keys.HEART_RATE_ZONE_DISTRIBUTION not in summary_data:
+                max_hr = self.user_mgr.retrieve_user_setting(activity_user_id, Keys.ESTIMATED_MAX_HEART_RATE_KEY) or 0.0
+            if include_power and Keys.POWER_ZONE_DISTRIBUTION not in summary_data:
+                ftp = self.user_mgr.estimate_ftp(activity_user_id) or 0.0
+        return max_hr, ftp
+
+    def render_page_for_unmapped_activity(self, user_realname, activity_id, activity, activity_user_id, logged_in_username, belongs_to_current_user, is_live):
         """Helper function for rendering the page corresonding to a specific un-mapped activity."""
 
         # Is the user logged in?
@@ -372,8 +384,11 @@ class App(object):
         else:
             page_title = "Activity"
 
+        # Only needed if the summary doesn't have the heart rate zones.
+        max_hr, _ = self.render_zone_fallback_settings(activity_user_id, summary_data, False)
+
         my_template = Template(filename=self.unmapped_activity_html_file, module_directory=self.tempmod_dir)
-        return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, description=description_str, details=details, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=activity_user_max_hr, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
+        return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, description=description_str, details=details, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
 
     def render_description_for_page(self, activity):
         """Helper function for processing the activity description and formatting it for display."""
@@ -484,7 +499,7 @@ class App(object):
         my_template = Template(filename=self.error_activity_html_file, module_directory=self.tempmod_dir)
         return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, error="There is no data for the specified activity.", activityId=activity_id, delete=delete_str)
 
-    def render_page_for_mapped_activity(self, user_realname, activity_id, activity, activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, is_live):
+    def render_page_for_mapped_activity(self, user_realname, activity_id, activity, activity_user_id, logged_in_user_id, belongs_to_current_user, is_live):
         """Helper function for rendering the map corresonding to a specific activity."""
 
         # Is the user logged in?
@@ -500,10 +515,6 @@ class App(object):
         description_str = self.render_description_for_page(activity)
         name = App.render_activity_name(activity)
         activity_type = App.render_activity_type(activity)
-        if activity_user_id is not None:
-            ftp = self.user_mgr.estimate_ftp(activity_user_id)
-        else:
-            ftp = 0.0
         is_foot_based_activity = activity_type in Keys.FOOT_BASED_ACTIVITIES
         is_foot_based_activity_str = "false"
         if is_foot_based_activity:
@@ -601,33 +612,36 @@ class App(object):
             is_in_crit_city = App.is_activity_in_zwift_crit_city(activity_type, last_lat, last_lon)
             is_in_makuri_islands = App.is_activity_in_zwift_makuri_islands(activity_type, last_lat, last_lon)
 
+        # Only needed if the summary doesn't have the time in zones.
+        max_hr, ftp = self.render_zone_fallback_settings(activity_user_id, summary_data, not is_foot_based_activity)
+
         # If a google maps key was provided then use google maps, otherwise use open street map.
         if is_in_watopia and os.path.isfile(self.zwift_watopia_map_file) > 0:
             my_template = Template(filename=self.zwift_html_file, module_directory=self.tempmod_dir)
-            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, ftp=ftp, max_hr=activity_user_max_hr, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_WATOPIA_MAP_FILE_NAME)
+            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, ftp=ftp, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_WATOPIA_MAP_FILE_NAME)
         elif is_in_crit_city and os.path.isfile(self.zwift_crit_city_map_file) > 0:
             my_template = Template(filename=self.zwift_html_file, module_directory=self.tempmod_dir)
-            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, ftp=ftp, max_hr=activity_user_max_hr, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_CRIT_CITY_MAP_FILE_NAME)
+            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, ftp=ftp, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_CRIT_CITY_MAP_FILE_NAME)
         elif is_in_makuri_islands and os.path.isfile(self.zwift_makuri_islands_map_file) > 0:
             my_template = Template(filename=self.zwift_html_file, module_directory=self.tempmod_dir)
-            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, ftp=ftp, max_hr=activity_user_max_hr, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_MAKURI_ISLANDS_MAP_FILE_NAME)
+            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, ftp=ftp, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str, map_file_name=ZWIFT_MAKURI_ISLANDS_MAP_FILE_NAME)
         elif self.google_maps_key:
             my_template = Template(filename=self.map_single_google_html_file, module_directory=self.tempmod_dir)
-            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, ftp=ftp, max_hr=activity_user_max_hr, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
+            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, ftp=ftp, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
         else:
             my_template = Template(filename=self.map_single_osm_html_file, module_directory=self.tempmod_dir)
-            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, ftp=ftp, max_hr=activity_user_max_hr, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
+            return my_template.render(nav=self.create_navbar(logged_in), product=PRODUCT_NAME, root_url=self.root_url, name=user_realname, pagetitle=page_title, unit_system=unit_system, is_foot_based_activity=is_foot_based_activity_str, summary=summary, activityId=activity_id, userId=activity_user_id, max_hr=max_hr, ftp=ftp, description=description_str, details=details_str, tags=tags_str, comments=comments_str, exports=exports_str, visibility=visibility_str)
 
-    def render_page_for_activity(self, activity, user_realname, activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, is_live):
+    def render_page_for_activity(self, activity, user_realname, activity_user_id, logged_in_user_id, belongs_to_current_user, is_live):
         """Helper function for rendering the page corresonding to a specific activity."""
 
         try:
             # Does the activity contain accelerometer data, as with lifting activities recorded from the companion app?
             if activity[Keys.ACTIVITY_TYPE_KEY] in Keys.STRENGTH_ACTIVITIES or activity[Keys.ACTIVITY_TYPE_KEY] in Keys.SWIM_WORKOUTS:
-                return self.render_page_for_unmapped_activity(user_realname, activity[Keys.ACTIVITY_ID_KEY], activity, activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, is_live)
+                return self.render_page_for_unmapped_activity(user_realname, activity[Keys.ACTIVITY_ID_KEY], activity, activity_user_id, logged_in_user_id, belongs_to_current_user, is_live)
 
             # Assume it's a location based activity.
-            return self.render_page_for_mapped_activity(user_realname, activity[Keys.ACTIVITY_ID_KEY], activity, activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, is_live)
+            return self.render_page_for_mapped_activity(user_realname, activity[Keys.ACTIVITY_ID_KEY], activity, activity_user_id, logged_in_user_id, belongs_to_current_user, is_live)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -728,11 +742,8 @@ class App(object):
         if not (self.data_mgr.is_activity_public(activity) or belongs_to_current_user):
             return self.render_error("The requested activity is not public.")
 
-        # Determine the activity user's max heart rate.
-        activity_user_max_hr = self.user_mgr.retrieve_user_setting(activity_user_id, Keys.ESTIMATED_MAX_HEART_RATE_KEY)
-
         # Render from template.
-        return self.render_page_for_activity(activity, activity_user[Keys.REALNAME_KEY], activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, True)
+        return self.render_page_for_activity(activity, activity_user[Keys.REALNAME_KEY], activity_user_id, logged_in_user_id, belongs_to_current_user, True)
 
     @Perf.statistics
     def live_device(self, device_str):
@@ -808,11 +819,8 @@ class App(object):
         if not (self.data_mgr.is_activity_public(activity) or belongs_to_current_user):
             return self.render_error("The requested activity is not public.")
 
-        # Determine the activity user's max heart rate.
-        activity_user_max_hr = self.user_mgr.retrieve_user_setting(activity_user_id, Keys.ESTIMATED_MAX_HEART_RATE_KEY)
-
         # Render from template.
-        return self.render_page_for_activity(activity, activity_user_realname, activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, False)
+        return self.render_page_for_activity(activity, activity_user_realname, activity_user_id, logged_in_user_id, belongs_to_current_user, False)
 
     @Perf.statistics
     def edit_activity(self, activity_id):
@@ -946,11 +954,8 @@ class App(object):
         if not (self.data_mgr.is_activity_public(activity) or belongs_to_current_user):
             return self.render_error("The requested activity is not public.")
 
-        # Determine the activity user's max heart rate.
-        activity_user_max_hr = self.user_mgr.retrieve_user_setting(activity_user_id, Keys.ESTIMATED_MAX_HEART_RATE_KEY)
-
         # Render from template.
-        return self.render_page_for_activity(activity, device_user[Keys.REALNAME_KEY], activity_user_id, activity_user_max_hr, logged_in_user_id, belongs_to_current_user, False)
+        return self.render_page_for_activity(activity, device_user[Keys.REALNAME_KEY], activity_user_id, logged_in_user_id, belongs_to_current_user, False)
 
     @Perf.statistics
     def my_activities(self):
@@ -23,8 +23,9 @@
 # SOFTWARE.
 """Database implementation"""
 
+import datetime
+import heapq
 import json
-import re
 import sys
 import traceback
 import uuid
@@ -33,9 +34,12 @@ import pymongo
 import time
 import Database
 import DatabaseException
+import DatabaseIndexes
 import InputChecker
 import Keys
+import LruCache
 import Perf
+import StreamCodec
 import Workout
 
 def insert_into_collection(collection, doc):
@@ -62,6 +66,16 @@ def update_activities_collection(self, activity):
     activity[Keys.ACTIVITY_LAST_UPDATED_KEY] = time.time()
     return update_collection(self.activities_collection, activity)
 
+# API key lookups happen on every API call, so keep recently used keys in memory. Revoking a key in this process removes
+# it immediately, other processes will notice once the entry expires.
+API_KEY_CACHE_SIZE = 1000
+API_KEY_CACHE_MAX_AGE = 60.0
+g_api_key_cache = LruCache.LruCache(API_KEY_CACHE_SIZE)
+
+def normalize_activity_id(activity_id):
+    """Activity IDs are stored, and looked up, in lower case so that lookups can be exact matches against the index."""
+    return str(activity_id).lower()
+
 def retrieve_time_from_location(location):
     """Used with the sort function."""
     return location['time']
@@ -70,6 +84,63 @@ def retrieve_time_from_time_value_pair(value):
     """Used with the sort function."""
     return list(value.keys())[0]
 
+STREAM_CHUNK_DURATION_MS = 10 * 60 * 1000 # Span of time covered by each chunk in the stream store
+MIGRATION_CLAIM_DURATION = 3600 # Seconds a process has to finish a migration before another may take it over
+MAX_LATE_BATCH_ATTEMPTS = 5 # Times to retry merging an out of order live batch that keeps losing the race with other updates
+
+def parse_stream_time(time_str):
+    """Time/value pairs are keyed by a string representation of the timestamp."""
+    try:
+        return int(time_str)
+    except ValueError:
+        return float(time_str)
+
+def retrieve_time_from_stream_value(stream_name, value):
+    """Returns the numeric timestamp of a stream value, in the form it is returned to callers."""
+    if StreamCodec.is_time_value_stream(stream_name):
+        return parse_stream_time(retrieve_time_from_time_value_pair(value))
+    return value[Keys.STREAM_SAMPLE_TIME_KEY]
+
+def stream_value_to_sample(stream_name, value):
+    """Converts a value, in the form it is returned to callers, to the form used in the stream store."""
+    if StreamCodec.is_time_value_stream(stream_name):
+        time_str, sample_value = list(value.items())[0]
+        return { Keys.STREAM_SAMPLE_TIME_KEY: parse_stream_time(time_str), Keys.STREAM_SAMPLE_VALUE_KEY: sample_value }
+    return value
+
+def stream_sample_to_value(stream_name, sample):
+    """Converts a sample from the stream store to the form it is returned to callers."""
+    if StreamCodec.is_time_value_stream(stream_name):
+        return { str(sample[Keys.STREAM_SAMPLE_TIME_KEY]): sample[Keys.STREAM_SAMPLE_VALUE_KEY] }
+    return sample
+
+def stream_chunk_to_values(stream_name, chunk):
+    """Returns a chunk's samples, in the form they are returned to callers. A chunk may have packed data as well as samples appended since it was packed."""
+    values = [stream_sample_to_value(stream_name, sample) for sample in chunk[Keys.STREAM_SAMPLES_KEY]] if Keys.STREAM_SAMPLES_KEY in chunk else []
+    if Keys.STREAM_PACKED_KEY in chunk:
+        packed_values = StreamCodec.unpack(stream_name, chunk[Keys.STREAM_PACKED_KEY]).to_values()
+        values = merge_stream_values(stream_name, packed_values, values)
+    return values
+
+def merge_stream_values(stream_name, legacy_values, stream_values):
+    """Activities written before the stream store existed keep their data in the activity document, merge it with anything that is in the stream store."""
+    if not legacy_values:
+        return stream_values
+    if not stream_values:
+        return legacy_values
+    return list(heapq.merge(legacy_values, stream_values, key=lambda value: retrieve_time_from_stream_value(stream_name, value)))
+
+def filter_stream_values(stream_name, values, start_time, end_time):
+    """Returns the values that fall within the (inclusive) time range. Either end of the range may be None."""
+    if start_time is None and end_time is None:
+        return values
+    filtered_values = []
+    for value in values:
+        value_time = retrieve_time_from_stream_value(stream_name, value)
+        if (start_time is None or value_time >= start_time) and (end_time is None or value_time <= end_time):
+            filtered_values.append(value)
+    return filtered_values
+
 
 class Device(object):
     def __init__(self):
@@ -89,6 +160,12 @@ class MongoDatabase(Database.Database):
     tasks_collectoin = None
     uploads_collection = None
     sessoins_collection = None
+    activity_streams_collection = None
+    activity_bests_collection = None
+    rate_limits_collection = None
+    duration_curves_collection = None
+    migrations_collection = None
+    pack_streams = False
 
     def __init__(self):
         Database.Database.__init__(self)
@@ -115,12 +192,75 @@ class MongoDatabase(Database.Database):
             self.tasks_collection = self.database['tasks']
             self.uploads_collection = self.database['uploads']
             self.sessions_collection = self.database['sessions']
+            self.activity_streams_collection = self.database['activity_streams']
+            self.activity_bests_collection = self.database['activity_bests']
+            self.rate_limits_collection = self.database['rate_limits']
+            self.duration_curves_collection = self.database['duration_curves']
+            self.migrations_collection = self.database['migrations']
+            self.pack_streams = config.is_stream_packing_enabled()
+
+            # Create, or update, indexes. Only done by the first process to connect after the declared indexes change.
+            self.run_migration(Keys.MIGRATION_INDEXES, DatabaseIndexes.indexes_version(), lambda: DatabaseIndexes.ensure_indexes(self.database, self.log_error))
 
-            # Create indexes.
-            self.activities_collection.create_index(Keys.ACTIVITY_ID_KEY)
+            # Convert any activity IDs that were stored before IDs were normalized. Only needs to be done once.
+            self.run_migration(Keys.MIGRATION_NORMALIZE_ACTIVITY_IDS, 1, self.normalize_activity_ids)
+
+            # Move any activity bests that are still stored in the records documents.
+            self.migrate_activity_bests()
+
+            # Optionally, make sure the indexes are actually being used.
+            if config.is_index_verification_enabled():
+                self.verify_query_plans()
         except pymongo.errors.ConnectionFailure as e:
             raise DatabaseException.DatabaseException("Could not connect to MongoDB: %s" % e)
 
+    def run_migration(self, name, version, migrate_func):
+        """Runs a one-time database update, unless it has already been completed at this version or another process is running it."""
+        """migrate_func returns True if it succeeded, otherwise it is tried again the next time a process connects."""
+        """Returns True if the migration is complete."""
+        now = time.time()
+        try:
+            # Claim the migration. If it's already done, or claimed, the upsert conflicts with the existing document.
+            query = { Keys.DATABASE_ID_KEY: name, Keys.MIGRATION_VERSION_KEY: { "$ne": version }, "$or": [ { Keys.MIGRATION_CLAIMED_UNTIL_KEY: { "$exists": False } }, { Keys.MIGRATION_CLAIMED_UNTIL_KEY: { "$lt": now } } ] }
+            self.migrations_collection.update_one(query, { "$set": { Keys.MIGRATION_CLAIMED_UNTIL_KEY: now + MIGRATION_CLAIM_DURATION } }, upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            return self.migrations_collection.count_documents({ Keys.DATABASE_ID_KEY: name, Keys.MIGRATION_VERSION_KEY: version }, limit=1) > 0
+        except pymongo.errors.OperationFailure:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+            return False
+
+        success = False
+        try:
+            success = migrate_func()
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+
+        try:
+            if success:
+                update = { "$set": { Keys.MIGRATION_VERSION_KEY: version, Keys.MIGRATION_COMPLETED_KEY: time.time() }, "$unset": { Keys.MIGRATION_CLAIMED_UNTIL_KEY: "" } }
+            else:
+                update = { "$unset": { Keys.MIGRATION_CLAIMED_UNTIL_KEY: "" } }
+            self.migrations_collection.update_one({ Keys.DATABASE_ID_KEY: name }, update)
+        except pymongo.errors.OperationFailure:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return success
+
+    def verify_query_plans(self):
+        """Checks the query plan of each of the queries issued by this class, logging any that would scan an entire collection."""
+        """Returns the list of (collection name, query) for the queries that would."""
+        try:
+            collection_scans = DatabaseIndexes.verify_query_plans(self.database)
+            for collection_name, query in collection_scans:
+                self.log_error(MongoDatabase.verify_query_plans.__name__ + ": Query does not use an index: " + collection_name + " " + str(query))
+            return collection_scans
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
     def total_users_count(self):
         """Returns the number of users in the database."""
         try:
@@ -145,13 +285,11 @@ class MongoDatabase(Database.Database):
 
     def list_excluded_activity_keys(self):
         """This is the list of stuff we don't need to return when we're summarizing activities."""
+        """New activities keep these in the stream store, older activities may still have them embedded in the activity document."""
         exclude_keys = {}
-        exclude_keys[Keys.APP_LOCATIONS_KEY] = False
-        exclude_keys[Keys.APP_ACCELEROMETER_KEY] = False
-        exclude_keys[Keys.APP_CURRENT_SPEED_KEY] = False
-        exclude_keys[Keys.APP_HEART_RATE_KEY] = False
-        exclude_keys[Keys.APP_CADENCE_KEY] = False
-        exclude_keys[Keys.APP_POWER_KEY] = False
+        for stream_name in Keys.ACTIVITY_STREAM_KEYS:
+            exclude_keys[stream_name] = False
+        exclude_keys[Keys.ACTIVITY_LIVE_STATE_KEY] = False
         return exclude_keys
 
     #
@@ -249,21 +387,30 @@ class MongoDatabase(Database.Database):
 
     def retrieve_user_from_api_key(self, api_key):
         """Retrieve method for a user."""
+        """Returns the user ID, password hash, and real name of the key's owner, along with the key's maximum daily rate."""
         if api_key is None:
-            self.log_error(MongoDatabase.retrieve_user_from_id.__name__ + ": Unexpected empty object: api_key")
-            return None, None, None
+            self.log_error(MongoDatabase.retrieve_user_from_api_key.__name__ + ": Unexpected empty object: api_key")
+            return None, None, None, None
 
         try:
-            # Find the user.
-            rate = 100
-            query = { Keys.API_KEYS: { Keys.API_KEY: str(api_key), Keys.API_KEY_RATE : rate } }
-            result_keys = { Keys.DATABASE_ID_KEY: 1, Keys.HASH_KEY: 1, Keys.REALNAME_KEY: 1 }
+            # Recently used?
+            key_str = str(api_key)
+            cached = g_api_key_cache.get(key_str)
+            if cached is not None:
+                return cached
+
+            # Find the user. The positional projection returns only the matching key, which is where the rate comes from.
+            query = { Keys.API_KEYS + "." + Keys.API_KEY: key_str }
+            result_keys = { Keys.DATABASE_ID_KEY: 1, Keys.HASH_KEY: 1, Keys.REALNAME_KEY: 1, Keys.API_KEYS + ".$": 1 }
             user = self.users_collection.find_one(query, result_keys)
 
             # If the user was found.
             if user is not None:
-                return str(user[Keys.DATABASE_ID_KEY]), user[Keys.HASH_KEY], user[Keys.REALNAME_KEY], rate
-            return None, None, None, rate
+                rate = user[Keys.API_KEYS][0][Keys.API_KEY_RATE]
+                result = (str(user[Keys.DATABASE_ID_KEY]), user[Keys.HASH_KEY], user[Keys.REALNAME_KEY], rate)
+                g_api_key_cache.set(key_str, result, time.time() + API_KEY_CACHE_MAX_AGE)
+                return result
+            return None, None, None, None
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -763,7 +910,7 @@ class MongoDatabase(Database.Database):
 
             # If the collection was found.
             if user_records is None:
-                post = { Keys.USER_ID_KEY: user_id_str, Keys.PERSONAL_RECORDS_KEY: records }
+                post = { Keys.USER_ID_KEY: user_id_str, Keys.PERSONAL_RECORDS_KEY: records, Keys.ACTIVITY_BESTS_MIGRATED_KEY: True }
                 return insert_into_collection(self.records_collection, post)
         except:
             self.log_error(traceback.format_exc())
@@ -825,6 +972,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_bests.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if activity_type is None:
             self.log_error(MongoDatabase.create_activity_bests.__name__ + ": Unexpected empty object: activity_type")
             return False
@@ -836,42 +984,45 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
-            # Find the user's records collection.
-            user_records = self.records_collection.find_one({ Keys.USER_ID_KEY: user_id })
-            if user_records is not None:
-                bests[Keys.ACTIVITY_TYPE_KEY] = activity_type
-                bests[Keys.ACTIVITY_START_TIME_KEY] = activity_time
-                user_records[activity_id] = bests
-                return update_collection(self.records_collection, user_records)
+            # One document per activity, so this only ever writes the bests for the activity in question.
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.ACTIVITY_ID_KEY: activity_id }
+            post = { Keys.ACTIVITY_TYPE_KEY: activity_type, Keys.ACTIVITY_START_TIME_KEY: activity_time, Keys.ACTIVITY_BESTS_KEY: bests }
+            result = self.activity_bests_collection.update_one(query, { "$set": post }, upsert=True)
+            return result is not None and result.acknowledged
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return False
 
+    def activity_bests_from_doc(self, doc):
+        """Converts an activity bests document to the form returned by the retrieve methods, i.e., the bests along with the activity type and start time."""
+        bests = doc[Keys.ACTIVITY_BESTS_KEY]
+        bests[Keys.ACTIVITY_TYPE_KEY] = doc[Keys.ACTIVITY_TYPE_KEY]
+        bests[Keys.ACTIVITY_START_TIME_KEY] = doc[Keys.ACTIVITY_START_TIME_KEY]
+        return bests
+
+    @Perf.statistics
     def retrieve_activity_bests_for_user(self, user_id):
         """Retrieve method for a user's activity records."""
+        """Returns a dictionary of the bests, keyed by activity ID."""
         if user_id is None:
             self.log_error(MongoDatabase.retrieve_activity_bests_for_user.__name__ + ": Unexpected empty object: user_id")
             return {}
 
         try:
-            user_records = self.records_collection.find_one({ Keys.USER_ID_KEY: user_id })
-            if user_records is not None:
-                bests = {}
-
-                # Each record is named using the activity ID of the corresponding activity.
-                for activity_id in user_records:
-                    if InputChecker.is_uuid(activity_id):
-                        activity_bests = user_records[activity_id]
-                        bests[activity_id] = activity_bests
-                return bests
+            bests = {}
+            for doc in self.activity_bests_collection.find({ Keys.USER_ID_KEY: str(user_id) }, { Keys.DATABASE_ID_KEY: 0 }):
+                bests[doc[Keys.ACTIVITY_ID_KEY]] = self.activity_bests_from_doc(doc)
+            return bests
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return {}
 
-    def retrieve_bounded_activity_bests_for_user(self, user_id, cutoff_time_lower, cutoff_time_higher):
+    @Perf.statistics
+    def retrieve_bounded_activity_bests_for_user(self, user_id, cutoff_time_lower, cutoff_time_higher, activity_types=None):
         """Retrieve method for a user's activity records. Only activities more recent than the specified cutoff time will be returned."""
+        """If a list of activity types is given then only activities of those types will be returned."""
         if user_id is None:
             self.log_error(MongoDatabase.retrieve_bounded_activity_bests_for_user.__name__ + ": Unexpected empty object: user_id")
             return {}
@@ -883,19 +1034,14 @@ class MongoDatabase(Database.Database):
             return {}
 
         try:
-            user_records = self.records_collection.find_one({ Keys.USER_ID_KEY: user_id })
-            if user_records is not None:
-                bests = {}
-
-                # Each record is named using the activity ID of the corresponding activity.
-                for activity_id in user_records:
-                    if InputChecker.is_uuid(activity_id):
-                        activity_bests = user_records[activity_id]
-                        if Keys.ACTIVITY_START_TIME_KEY in activity_bests:
-                            activity_time = activity_bests[Keys.ACTIVITY_START_TIME_KEY]
-                            if activity_time >= cutoff_time_lower and activity_time < cutoff_time_higher:
-                                bests[activity_id] = activity_bests
-                return bests
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.ACTIVITY_START_TIME_KEY: { "$gte": cutoff_time_lower, "$lt": cutoff_time_higher } }
+            if activity_types is not None:
+                query[Keys.ACTIVITY_TYPE_KEY] = { "$in": list(activity_types) }
+
+            bests = {}
+            for doc in self.activity_bests_collection.find(query, { Keys.DATABASE_ID_KEY: 0 }):
+                bests[doc[Keys.ACTIVITY_ID_KEY]] = self.activity_bests_from_doc(doc)
+            return bests
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -912,12 +1058,248 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.delete_activity_best_for_user.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
-            user_records = self.records_collection.find_one({ Keys.USER_ID_KEY: user_id })
-            if user_records is not None:
-                user_records[activity_id] = {}
-                return update_collection(self.records_collection, user_records)
+            deleted_result = self.activity_bests_collection.delete_one({ Keys.USER_ID_KEY: str(user_id), Keys.ACTIVITY_ID_KEY: activity_id })
+            if deleted_result is not None:
+                return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def migrate_activity_bests(self):
+        """Activity bests used to be stored in the user's records document, keyed by activity ID. Moves them to the activity bests collection."""
+        """Safe to run repeatedly, each records document is only migrated once. Returns the number of activities that were moved."""
+        num_moved = 0
+        try:
+            for user_records in self.records_collection.find({ Keys.ACTIVITY_BESTS_MIGRATED_KEY: { "$exists": False } }):
+                user_id = user_records[Keys.USER_ID_KEY]
+                requests = []
+                legacy_keys = {}
+
+                for key in user_records:
+                    if not InputChecker.is_uuid(key):
+                        continue
+                    legacy_keys[key] = ""
+
+                    # Deleted activities were left behind as empty dictionaries.
+                    bests = user_records[key]
+                    if not bests or Keys.ACTIVITY_TYPE_KEY not in bests or Keys.ACTIVITY_START_TIME_KEY not in bests:
+                        continue
+
+                    # Don't overwrite anything that was written since the new collection came into use.
+                    activity_type = bests.pop(Keys.ACTIVITY_TYPE_KEY)
+                    activity_time = bests.pop(Keys.ACTIVITY_START_TIME_KEY)
+                    query = { Keys.USER_ID_KEY: user_id, Keys.ACTIVITY_ID_KEY: normalize_activity_id(key) }
+                    post = { Keys.ACTIVITY_TYPE_KEY: activity_type, Keys.ACTIVITY_START_TIME_KEY: activity_time, Keys.ACTIVITY_BESTS_KEY: bests }
+                    requests.append(pymongo.UpdateOne(query, { "$setOnInsert": post }, upsert=True))
+
+                if requests:
+                    self.activity_bests_collection.bulk_write(requests, ordered=False)
+                    num_moved = num_moved + len(requests)
+
+                # Only remove the old data once it has been copied.
+                update = { "$set": { Keys.ACTIVITY_BESTS_MIGRATED_KEY: True } }
+                if legacy_keys:
+                    update["$unset"] = legacy_keys
+                self.records_collection.update_one({ Keys.DATABASE_ID_KEY: user_records[Keys.DATABASE_ID_KEY] }, update)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return num_moved
+
+    #
+    # Duration curve management methods
+    #
+
+    def merge_duration_curve_bucket(self, user_id, curve_name, activity_type, bucket, activity_id, points):
+        """Folds an activity's curve into the user's curve for the given time bucket, keeping the best value for each duration."""
+        """points is a dictionary of values keyed by the duration (in seconds) as a string."""
+        """Returns the IDs of the activities that were already part of the bucket, or None on error."""
+        if user_id is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: user_id")
+            return None
+        if curve_name is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: curve_name")
+            return None
+        if activity_type is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: activity_type")
+            return None
+        if bucket is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: bucket")
+            return None
+        if activity_id is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+        if points is None:
+            self.log_error(MongoDatabase.merge_duration_curve_bucket.__name__ + ": Unexpected empty object: points")
+            return None
+
+        try:
+            # A single atomic update, so that activities being analyzed at the same time can't undo each other's work.
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.DURATION_CURVE_KEY: curve_name, Keys.ACTIVITY_TYPE_KEY: activity_type, Keys.DURATION_CURVE_BUCKET_KEY: bucket }
+            update = { "$addToSet": { Keys.DURATION_CURVE_ACTIVITIES_KEY: activity_id }, "$inc": { Keys.DURATION_CURVE_REVISION_KEY: 1 } }
+            if points:
+                update["$max"] = dict((Keys.DURATION_CURVE_POINTS_KEY + "." + duration, value) for duration, value in points.items())
+            old_doc = self.duration_curves_collection.find_one_and_update(query, update, projection={ Keys.DATABASE_ID_KEY: 0, Keys.DURATION_CURVE_ACTIVITIES_KEY: 1 }, upsert=True, return_document=pymongo.ReturnDocument.BEFORE)
+            if old_doc is not None and Keys.DURATION_CURVE_ACTIVITIES_KEY in old_doc:
+                return old_doc[Keys.DURATION_CURVE_ACTIVITIES_KEY]
+            return []
+        except pymongo.errors.DuplicateKeyError:
+            # Two processes tried to create the same bucket at the same time, the loser can just update the winner's.
+            return self.merge_duration_curve_bucket(user_id, curve_name, activity_type, bucket, activity_id, points)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def retrieve_duration_curve_bucket_revision(self, user_id, curve_name, activity_type, bucket):
+        """Retrieve method for the revision of the user's curve for the given time bucket. Returns 0 if the bucket doesn't exist, or None on error."""
+        if user_id is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_bucket_revision.__name__ + ": Unexpected empty object: user_id")
+            return None
+        if curve_name is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_bucket_revision.__name__ + ": Unexpected empty object: curve_name")
+            return None
+        if activity_type is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_bucket_revision.__name__ + ": Unexpected empty object: activity_type")
+            return None
+        if bucket is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_bucket_revision.__name__ + ": Unexpected empty object: bucket")
+            return None
+
+        try:
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.DURATION_CURVE_KEY: curve_name, Keys.ACTIVITY_TYPE_KEY: activity_type, Keys.DURATION_CURVE_BUCKET_KEY: bucket }
+            doc = self.duration_curves_collection.find_one(query, { Keys.DATABASE_ID_KEY: 0, Keys.DURATION_CURVE_REVISION_KEY: 1 })
+            if doc is not None and Keys.DURATION_CURVE_REVISION_KEY in doc:
+                return doc[Keys.DURATION_CURVE_REVISION_KEY]
+            return 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def replace_duration_curve_bucket(self, user_id, curve_name, activity_type, bucket, activity_ids, points, expected_revision=None):
+        """Overwrites the user's curve for the given time bucket. The bucket is deleted if there are no activities in it."""
+        """If expected_revision is given, the write only happens if the bucket is still at that revision (0 meaning that it didn't exist),"""
+        """i.e. if no activity has been merged into it since the revision was read. Returns False if it wasn't written."""
+        if user_id is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: user_id")
+            return False
+        if curve_name is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: curve_name")
+            return False
+        if activity_type is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: activity_type")
+            return False
+        if bucket is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: bucket")
+            return False
+        if activity_ids is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: activity_ids")
+            return False
+        if points is None:
+            self.log_error(MongoDatabase.replace_duration_curve_bucket.__name__ + ": Unexpected empty object: points")
+            return False
+
+        try:
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.DURATION_CURVE_KEY: curve_name, Keys.ACTIVITY_TYPE_KEY: activity_type, Keys.DURATION_CURVE_BUCKET_KEY: bucket }
+            if expected_revision is not None:
+                if expected_revision == 0:
+                    query[Keys.DURATION_CURVE_REVISION_KEY] = { "$in": [ 0, None ] } # Buckets written before revisions were added don't have one
+                else:
+                    query[Keys.DURATION_CURVE_REVISION_KEY] = expected_revision
+
+            if len(activity_ids) == 0:
+                result = self.duration_curves_collection.delete_one(query)
+                return result is not None and result.acknowledged and (expected_revision is None or expected_revision == 0 or result.deleted_count > 0)
+
+            post = { Keys.DURATION_CURVE_ACTIVITIES_KEY: [normalize_activity_id(activity_id) for activity_id in activity_ids], Keys.DURATION_CURVE_POINTS_KEY: points }
+            if expected_revision is None:
+                update = { "$set": post, "$inc": { Keys.DURATION_CURVE_REVISION_KEY: 1 } }
+            else:
+                post[Keys.DURATION_CURVE_REVISION_KEY] = expected_revision + 1
+                update = { "$set": post }
+            result = self.duration_curves_collection.update_one(query, update, upsert=True)
+            return result is not None and result.acknowledged
+        except pymongo.errors.DuplicateKeyError:
+            # The bucket's revision changed, so the upsert tried to create a second copy of it.
+            return False
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_duration_curve_buckets_for_activity(self, user_id, activity_id):
+        """Retrieve method for the user's curve buckets that the activity has been folded into. Returns a list of (curve name, activity type, bucket)."""
+        if user_id is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets_for_activity.__name__ + ": Unexpected empty object: user_id")
+            return None
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets_for_activity.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets_for_activity.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.DURATION_CURVE_ACTIVITIES_KEY: activity_id }
+            projection = { Keys.DATABASE_ID_KEY: 0, Keys.DURATION_CURVE_KEY: 1, Keys.ACTIVITY_TYPE_KEY: 1, Keys.DURATION_CURVE_BUCKET_KEY: 1 }
+            return [(doc[Keys.DURATION_CURVE_KEY], doc[Keys.ACTIVITY_TYPE_KEY], doc[Keys.DURATION_CURVE_BUCKET_KEY]) for doc in self.duration_curves_collection.find(query, projection)]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    @Perf.statistics
+    def retrieve_duration_curve_buckets(self, user_id, curve_name, activity_types, first_bucket, end_bucket):
+        """Retrieve method for the user's curves for the time buckets that start within [first_bucket, end_bucket)."""
+        """Returns a list of dictionaries of values keyed by the duration (in seconds) as a string."""
+        if user_id is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets.__name__ + ": Unexpected empty object: user_id")
+            return []
+        if curve_name is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets.__name__ + ": Unexpected empty object: curve_name")
+            return []
+        if activity_types is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets.__name__ + ": Unexpected empty object: activity_types")
+            return []
+        if first_bucket is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets.__name__ + ": Unexpected empty object: first_bucket")
+            return []
+        if end_bucket is None:
+            self.log_error(MongoDatabase.retrieve_duration_curve_buckets.__name__ + ": Unexpected empty object: end_bucket")
+            return []
+
+        try:
+            query = { Keys.USER_ID_KEY: str(user_id), Keys.DURATION_CURVE_KEY: curve_name, Keys.ACTIVITY_TYPE_KEY: { "$in": list(activity_types) }, Keys.DURATION_CURVE_BUCKET_KEY: { "$gte": first_bucket, "$lt": end_bucket } }
+            buckets = []
+            for doc in self.duration_curves_collection.find(query, { Keys.DATABASE_ID_KEY: 0, Keys.DURATION_CURVE_POINTS_KEY: 1 }):
+                if Keys.DURATION_CURVE_POINTS_KEY in doc:
+                    buckets.append(doc[Keys.DURATION_CURVE_POINTS_KEY])
+            return buckets
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def delete_duration_curves_for_user(self, user_id):
+        """Delete method for all of the user's curves."""
+        if user_id is None:
+            self.log_error(MongoDatabase.delete_duration_curves_for_user.__name__ + ": Unexpected empty object: user_id")
+            return False
+
+        try:
+            deleted_result = self.duration_curves_collection.delete_many({ Keys.USER_ID_KEY: str(user_id) })
+            if deleted_result is not None:
+                return True
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -943,8 +1325,13 @@ class MongoDatabase(Database.Database):
                 exclude_keys = self.list_excluded_activity_keys()
 
             if start_time is None or end_time is None:
-                return list(self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': user_id } } ]}, exclude_keys))
-            return list(self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': user_id }}, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys))
+                activities = list(self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': user_id } } ]}, exclude_keys))
+            else:
+                activities = list(self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': user_id }}, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys))
+            if return_all_data:
+                for activity in activities:
+                    self.load_activity_streams(activity)
+            return activities
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -972,13 +1359,16 @@ class MongoDatabase(Database.Database):
             # Get an iterator to the activities.
             if start_time is None or end_time is None:
                 activities_cursor = self.activities_collection.find({ Keys.ACTIVITY_USER_ID_KEY: user_id }, exclude_keys)
-            activities_cursor = self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys)
+            else:
+                activities_cursor = self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': user_id } }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys)
 
             # Iterate over the results, triggering the callback for each.
             if activities_cursor is not None:
                 try:
                     while activities_cursor.alive:
                         activity = activities_cursor.next()
+                        if return_all_data:
+                            self.load_activity_streams(activity)
                         callback_func(context, activity, user_id)
                 except StopIteration:
                     pass
@@ -1013,8 +1403,13 @@ class MongoDatabase(Database.Database):
                 return []
 
             if start_time is None or end_time is None:
-                return list(self.activities_collection.find({ "$or": device_list }, exclude_keys))
-            return list(self.activities_collection.find({ "$and": [ { "$or": device_list }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ] }, exclude_keys))
+                activities = list(self.activities_collection.find({ "$or": device_list }, exclude_keys))
+            else:
+                activities = list(self.activities_collection.find({ "$and": [ { "$or": device_list }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ] }, exclude_keys))
+            if return_all_data:
+                for activity in activities:
+                    self.load_activity_streams(activity)
+            return activities
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1044,13 +1439,16 @@ class MongoDatabase(Database.Database):
             # Get an iterator to the activities.
             if start_time is None or end_time is None:
                 activities_cursor = self.activities_collection.find({ Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, exclude_keys)
-            activities_cursor = self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_DEVICE_STR_KEY: { '$eq': device_str } }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys)
+            else:
+                activities_cursor = self.activities_collection.find({ "$and": [ { Keys.ACTIVITY_DEVICE_STR_KEY: { '$eq': device_str } }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': end_time } } ]}, exclude_keys)
 
             # Iterate over the results, triggering the callback for each.
             if activities_cursor is not None:
                 try:
                     while activities_cursor.alive:
                         activity = activities_cursor.next()
+                        if return_all_data:
+                            self.load_activity_streams(activity)
                         callback_func(context, activity, user_id)
                 except StopIteration:
                     pass
@@ -1074,7 +1472,10 @@ class MongoDatabase(Database.Database):
                 exclude_keys = self.list_excluded_activity_keys()
 
             # Find the activity.
-            return self.activities_collection.find_one({ Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, exclude_keys, sort=[( '_id', pymongo.DESCENDING )])
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, exclude_keys, sort=[( '_id', pymongo.DESCENDING )])
+            if activity is not None and return_all_data:
+                self.load_activity_streams(activity)
+            return activity
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1088,6 +1489,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if activity_name is None:
             self.log_error(MongoDatabase.create_activity.__name__ + ": Unexpected empty object: activity_name")
             return False
@@ -1103,7 +1505,8 @@ class MongoDatabase(Database.Database):
             activity_name = str(activity_name)
 
             # Create the activity.
-            post = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_NAME_KEY: activity_name, Keys.ACTIVITY_START_TIME_KEY: date_time, Keys.ACTIVITY_DEVICE_STR_KEY: device_str, Keys.ACTIVITY_VISIBILITY_KEY: "public", Keys.ACTIVITY_LOCATIONS_KEY: [] }
+            # The end time starts out the same as the start time and is moved forward as data is added, so that it is always present for duplicate detection.
+            post = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_NAME_KEY: activity_name, Keys.ACTIVITY_START_TIME_KEY: date_time, Keys.ACTIVITY_END_TIME_KEY: int(date_time), Keys.ACTIVITY_DEVICE_STR_KEY: device_str, Keys.ACTIVITY_VISIBILITY_KEY: "public", Keys.ACTIVITY_LOCATIONS_KEY: [] }
             return insert_into_collection(self.activities_collection, post)
         except:
             self.log_error(traceback.format_exc())
@@ -1117,10 +1520,24 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
-            deleted_result = self.activities_collection.delete_one({ Keys.ACTIVITY_ID_KEY: activity[Keys.ACTIVITY_ID_KEY] })
+            activity_id = activity[Keys.ACTIVITY_ID_KEY]
+            deleted_result = self.activities_collection.delete_one({ Keys.ACTIVITY_ID_KEY: activity_id })
             if deleted_result is not None:
                 activity.pop(Keys.DATABASE_ID_KEY)
-                return insert_into_collection(self.activities_collection, activity)
+
+                # The raw data goes back into the stream store, not the activity document.
+                self.activity_streams_collection.delete_many({ Keys.ACTIVITY_ID_KEY: activity_id })
+                streams = {}
+                for stream_name in Keys.ACTIVITY_STREAM_KEYS:
+                    if stream_name in activity:
+                        streams[stream_name] = activity.pop(stream_name)
+
+                if not insert_into_collection(self.activities_collection, activity):
+                    return False
+                for stream_name in streams:
+                    samples = [stream_value_to_sample(stream_name, value) for value in streams[stream_name]]
+                    self.create_activity_stream_samples(activity_id, stream_name, samples)
+                return True
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1135,10 +1552,14 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.retrieve_activity.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return None
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             # Find the activity.
-            return self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: re.compile(activity_id, re.IGNORECASE) })
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
+            if activity is not None:
+                self.load_activity_streams(activity)
+            return activity
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1153,20 +1574,89 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.retrieve_activity_small.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return None
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             # Things we don't need.
             exclude_keys = self.list_excluded_activity_keys()
 
             # Find the activity.
-            return self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: re.compile(activity_id, re.IGNORECASE) }, exclude_keys)
+            return self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, exclude_keys)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    @Perf.statistics
+    def retrieve_activity_for_analysis(self, activity_id):
+        """Retrieve method for the parts of an activity that the analysis needs: the metadata, the previous summary, and the raw data."""
+        """Leaves out the live state, which only matters while the activity is being recorded."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_for_analysis.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_activity_for_analysis.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            # Find the activity.
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_LIVE_STATE_KEY: 0 })
+            if activity is not None:
+                self.load_activity_streams(activity)
+            return activity
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def request_activity_analysis(self, activity_id):
+        """Increments the activity's analysis request counter and returns the new value, or None if the activity does not exist."""
+        """Analysis tasks carry the value they were queued with, so a task can tell when a newer one has been queued for the same activity."""
+        """This is not a change to the activity itself, so the last updated time is left alone."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.request_activity_analysis.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.request_activity_analysis.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            query = { Keys.ACTIVITY_ID_KEY: activity_id }
+            update = { "$inc": { Keys.ACTIVITY_ANALYSIS_REQUEST_KEY: 1 } }
+            activity = self.activities_collection.find_one_and_update(query, update, projection={ Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ANALYSIS_REQUEST_KEY: 1 }, return_document=pymongo.ReturnDocument.AFTER)
+            if activity is not None:
+                return activity[Keys.ACTIVITY_ANALYSIS_REQUEST_KEY]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def retrieve_activity_analysis_request(self, activity_id):
+        """Returns the current value of the activity's analysis request counter (zero if it has never been queued), or None if the activity does not exist."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_analysis_request.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_activity_analysis_request.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ANALYSIS_REQUEST_KEY: 1 })
+            if activity is not None:
+                if Keys.ACTIVITY_ANALYSIS_REQUEST_KEY in activity:
+                    return activity[Keys.ACTIVITY_ANALYSIS_REQUEST_KEY]
+                return 0
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return None
 
     def update_activity(self, device_str, activity_id, locations, sensor_readings_dict, metadata_list_dict):
-        """Updates locations, sensor readings, and metadata associated with a moving activity. Provided as a performance improvement over making several database updates."""
+        """Updates locations, sensor readings, and metadata associated with a moving activity. Provided as a performance improvement over making several database updates.
+        Only the new data is sent to the database, so the cost of an update does not grow with the length of the activity."""
         if device_str is None:
             self.log_error(MongoDatabase.update_activity.__name__ + ": Unexpected empty object: device_str")
             return False
@@ -1176,86 +1666,106 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.update_activity.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if not locations:
             self.log_error(MongoDatabase.update_activity.__name__ + ": Unexpected empty object: locations")
             return False
 
         try:
-            # Find the activity.
-            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
-            # If the activity was not found then create it.
-            if activity is None:
-                first_location = locations[0]
-                if self.create_activity(activity_id, "", first_location[0] / 1000, device_str):
-                    activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
-            # If the activity was found.
-            if activity is not None:
-
-                # Update the locations. Location data is an array, the order is defined in Api.parse_json_loc_obj.
-                if len(locations) > 0:
-
-                    # Find any existing location data.
-                    old_locations = []
-                    if Keys.ACTIVITY_LOCATIONS_KEY in activity:
-                        old_locations = activity[Keys.ACTIVITY_LOCATIONS_KEY]
-
-                    # Append the new locations.
-                    for location in locations:
-                        value = { Keys.LOCATION_TIME_KEY: location[0], Keys.LOCATION_LAT_KEY: location[1], Keys.LOCATION_LON_KEY: location[2], Keys.LOCATION_ALT_KEY: location[3], Keys.LOCATION_HORIZONTAL_ACCURACY_KEY: location[4], Keys.LOCATION_VERTICAL_ACCURACY_KEY: location[5] }
-                        old_locations.append(value)
-
-                    # Make sure everything is in the right order, no guarantee we got the updates in the correct order.
-                    old_locations.sort(key=retrieve_time_from_location)
-
-                    # Update the database.
-                    activity[Keys.ACTIVITY_LOCATIONS_KEY] = old_locations
-
-                # Update the sensor readings.
-                if sensor_readings_dict:
-                    for sensor_type in sensor_readings_dict:
-
-                        # Existing sensor values.
-                        old_value_list = []
-                        if sensor_type in activity:
-                            old_value_list = activity[sensor_type]
-
-                        # Append new values.
-                        for value in sensor_readings_dict[sensor_type]:
-                            time_value_pair = { str(value[0]): float(value[1]) }
-                            old_value_list.append(time_value_pair)
-
-                        # Sort and update.
-                        old_value_list.sort(key=retrieve_time_from_time_value_pair)
-                        activity[sensor_type] = old_value_list
-
-                # Update the metadata readings.
-                if metadata_list_dict:
-                    for metadata_type in metadata_list_dict:
-
-                        # Existing metadata values.
-                        old_value_list = []
-                        if metadata_type in activity:
-                            old_value_list = activity[metadata_type]
-
-                        # Append new values.
-                        for value in metadata_list_dict[metadata_type]:
-                            time_value_pair = { str(value[0]): float(value[1]) }
-                            old_value_list.append(time_value_pair)
-
-                        # Sort and update.
-                        old_value_list.sort(key=retrieve_time_from_time_value_pair)
-                        activity[metadata_type] = old_value_list
+            # Location data is an array, the order is defined in Api.parse_json_loc_obj.
+            new_locations = []
+            for location in locations:
+                value = { Keys.LOCATION_TIME_KEY: location[0], Keys.LOCATION_LAT_KEY: location[1], Keys.LOCATION_LON_KEY: location[2], Keys.LOCATION_ALT_KEY: location[3], Keys.LOCATION_HORIZONTAL_ACCURACY_KEY: location[4], Keys.LOCATION_VERTICAL_ACCURACY_KEY: location[5] }
+                new_locations.append(value)
+
+            # Sensor readings and metadata are stored as lists of time/value pairs. Those that have a stream go to the stream store,
+            # the rest are kept in the activity document.
+            new_samples = {}
+            new_value_lists = {}
+            for value_list_dict in [ sensor_readings_dict, metadata_list_dict ]:
+                if value_list_dict:
+                    for value_type in value_list_dict:
+                        if value_type in Keys.ACTIVITY_STREAM_KEYS:
+                            sample_list = new_samples.setdefault(value_type, [])
+                            for value in value_list_dict[value_type]:
+                                sample_list.append({ Keys.STREAM_SAMPLE_TIME_KEY: value[0], Keys.STREAM_SAMPLE_VALUE_KEY: float(value[1]) })
+                        else:
+                            value_list = new_value_lists.setdefault(value_type, [])
+                            for value in value_list_dict[value_type]:
+                                value_list.append({ str(value[0]): float(value[1]) })
+            for value_type in new_value_lists:
+                new_value_lists[value_type].sort(key=retrieve_time_from_time_value_pair)
+
+            # Readings from the same batch share the timestamps of the locations, so the batch bounds are taken from the locations.
+            batch_start_time = min(location[0] for location in locations)
+            batch_end_time = max(location[0] for location in locations)
+
+            # Common case: the batch comes after everything that has already been received, so just append it.
+            # If the activity was not found then create it. Otherwise, the batch arrived out of order.
+            if not self.append_activity_batch(device_str, activity_id, new_value_lists, batch_start_time, batch_end_time):
+                if not self.activities_collection.count_documents({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, limit = 1):
+                    if not self.create_activity(activity_id, "", batch_start_time / 1000, device_str):
+                        return False
+                    if not self.append_activity_batch(device_str, activity_id, new_value_lists, batch_start_time, batch_end_time):
+                        return False
+                elif not self.insert_late_activity_batch(device_str, activity_id, new_value_lists, batch_end_time):
+                    return False
 
-                # Write out the changes.
-                update_activities_collection(self, activity)
-                return True
+            # Raw data goes to the stream store, which keeps each chunk in order regardless of the order in which the batches arrive.
+            self.create_activity_stream_samples(activity_id, Keys.APP_LOCATIONS_KEY, new_locations)
+            for value_type in new_samples:
+                self.create_activity_stream_samples(activity_id, value_type, new_samples[value_type])
+            return True
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return False
 
+    def append_activity_batch(self, device_str, activity_id, new_value_lists, batch_start_time, batch_end_time):
+        """Appends a batch of live data to the end of the activity document's lists. Only succeeds if nothing newer than the batch has already been stored."""
+        query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str, "$or": [ { Keys.ACTIVITY_LAST_LIVE_TIME_KEY: { "$lte": batch_start_time } }, { Keys.ACTIVITY_LAST_LIVE_TIME_KEY: { "$exists": False } } ] }
+        update = { "$max": { Keys.ACTIVITY_LAST_LIVE_TIME_KEY: batch_end_time, Keys.ACTIVITY_END_TIME_KEY: int(batch_end_time / 1000) }, "$set": { Keys.ACTIVITY_LAST_UPDATED_KEY: time.time() } }
+        if new_value_lists:
+            push_values = {}
+            for value_type in new_value_lists:
+                push_values[value_type] = { "$each": new_value_lists[value_type] }
+            update["$push"] = push_values
+            update["$inc"] = { Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY: 1 }
+        result = self.activities_collection.update_one(query, update)
+        return result.matched_count > 0
+
+    def insert_late_activity_batch(self, device_str, activity_id, new_value_lists, batch_end_time):
+        """Inserts a batch of live data that arrived after newer data had already been stored in the activity document."""
+        query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str }
+        update = { "$max": { Keys.ACTIVITY_LAST_LIVE_TIME_KEY: batch_end_time, Keys.ACTIVITY_END_TIME_KEY: int(batch_end_time / 1000) }, "$set": { Keys.ACTIVITY_LAST_UPDATED_KEY: time.time() } }
+        if not new_value_lists:
+            result = self.activities_collection.update_one(query, update)
+            return result.matched_count > 0
+
+        # Time/value pairs can't be sorted by the database, so read only the affected lists and merge the batch in. The merged lists are
+        # only written if no other update changed the lists in the meantime, otherwise the merge starts over, so that no update is lost.
+        result_keys = { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY: 1 }
+        for value_type in new_value_lists:
+            result_keys[value_type] = 1
+        update["$inc"] = { Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY: 1 }
+        for _ in range(MAX_LATE_BATCH_ATTEMPTS):
+            activity = self.activities_collection.find_one(query, result_keys)
+            if activity is None:
+                return False
+            for value_type in new_value_lists:
+                old_value_list = activity[value_type] if value_type in activity else []
+                update["$set"][value_type] = list(heapq.merge(old_value_list, new_value_lists[value_type], key=retrieve_time_from_time_value_pair))
+            revision_query = query.copy()
+            if Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY in activity:
+                revision_query[Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY] = activity[Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY]
+            else:
+                revision_query[Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY] = { "$exists": False }
+            result = self.activities_collection.update_one(revision_query, update)
+            if result.matched_count > 0:
+                return True
+        self.log_error(MongoDatabase.insert_late_activity_batch.__name__ + ": Gave up after " + str(MAX_LATE_BATCH_ATTEMPTS) + " attempts: activity_id " + str(activity_id))
+        return False
+
     def delete_activity(self, activity_id):
         """Delete method for an activity, specified by the activity ID."""
         if activity_id is None:
@@ -1264,10 +1774,12 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.delete_activity.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             deleted_result = self.activities_collection.delete_one({ Keys.ACTIVITY_ID_KEY: activity_id })
             if deleted_result is not None:
+                self.activity_streams_collection.delete_many({ Keys.ACTIVITY_ID_KEY: activity_id })
                 return True
         except:
             self.log_error(traceback.format_exc())
@@ -1282,6 +1794,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.activity_exists.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             return self.activities_collection.count_documents({ Keys.ACTIVITY_ID_KEY: activity_id }, limit = 1) != 0
@@ -1308,9 +1821,54 @@ class MongoDatabase(Database.Database):
             self.log_error(sys.exc_info()[0])
         return []
 
+    def normalize_activity_ids(self):
+        """Converts activity IDs written before IDs were normalized to lower case. Scans each collection that references activity IDs,"""
+        """so it is only run once, as a migration (see run_migration). Returns True on success."""
+        try:
+            # Activities, raw data, activity bests, and uploaded files reference the activity ID in a field.
+            query = { Keys.ACTIVITY_ID_KEY: { "$regex": "[A-F]" } }
+            for collection in [ self.activities_collection, self.activity_streams_collection, self.activity_bests_collection, self.uploads_collection ]:
+                for doc in collection.find(query, { Keys.DATABASE_ID_KEY: 1, Keys.ACTIVITY_ID_KEY: 1 }):
+                    collection.update_one({ Keys.DATABASE_ID_KEY: doc[Keys.DATABASE_ID_KEY] }, { "$set": { Keys.ACTIVITY_ID_KEY: normalize_activity_id(doc[Keys.ACTIVITY_ID_KEY]) } })
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
     def retrieve_unanalyzed_activity_list(self, limit):
         try:
-            results = list(self.activities_collection.find({ Keys.ACTIVITY_SUMMARY_KEY: {'$exists': 0} }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ID_KEY: 1 }, limit = limit))
+            # Analysis always stores the activity hash in the summary, so this can use an index on the hash instead of on the entire summary.
+            results = list(self.activities_collection.find({ Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY: {'$exists': 0} }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ID_KEY: 1 }, limit = limit))
+            results = [x[Keys.ACTIVITY_ID_KEY] for x in results]
+            return results
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def retrieve_stale_analysis_activity_list(self, analyzer_version, limit):
+        """Returns the IDs of analyzed activities whose summary was produced by a different version of the analysis code."""
+        """Summaries from before the version was recorded don't have one, and are also returned."""
+        if analyzer_version is None:
+            self.log_error(MongoDatabase.retrieve_stale_analysis_activity_list.__name__ + ": Unexpected empty object: analyzer_version")
+            return []
+
+        try:
+            query = { Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_ANALYZER_VERSION_KEY: { '$ne': analyzer_version }, Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY: { '$exists': 1 } }
+            results = list(self.activities_collection.find(query, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ID_KEY: 1 }, limit = limit))
+            results = [x[Keys.ACTIVITY_ID_KEY] for x in results]
+            return results
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    def retrieve_activities_without_end_time_list(self, limit):
+        """Returns the IDs of activities that were created before end times were always stored, oldest first. Activities whose end time"""
+        """couldn't be determined are marked with a null end time (see mark_activity_end_time_unknown), and aren't returned."""
+        try:
+            results = list(self.activities_collection.find({ Keys.ACTIVITY_END_TIME_KEY: {'$exists': 0} }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ID_KEY: 1 }, sort = [ (Keys.DATABASE_ID_KEY, pymongo.ASCENDING) ], limit = limit))
             results = [x[Keys.ACTIVITY_ID_KEY] for x in results]
             return results
         except:
@@ -1318,6 +1876,218 @@ class MongoDatabase(Database.Database):
             self.log_error(sys.exc_info()[0])
         return []
 
+    def mark_activity_end_time_unknown(self, activity_id):
+        """Stores a null end time for an activity whose end time couldn't be determined, so that it isn't returned by"""
+        """retrieve_activities_without_end_time_list again. Doesn't replace an end time that has been stored in the meantime."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.mark_activity_end_time_unknown.__name__ + ": Unexpected empty object: activity_id")
+            return False
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.mark_activity_end_time_unknown.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return False
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            result = self.activities_collection.update_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_END_TIME_KEY: { '$exists': False } }, { "$set": { Keys.ACTIVITY_END_TIME_KEY: None } })
+            return result.matched_count > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    @Perf.statistics
+    def retrieve_activity_intervals_for_user(self, user_id, start_time, end_time):
+        """Returns the ID, start time, and end time of each of the user's activities that overlap the given time range (seconds)."""
+        """Only the index is read. The end time will be None for any activity that doesn't have one yet."""
+        if user_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_intervals_for_user.__name__ + ": Unexpected empty object: user_id")
+            return []
+        if start_time is None:
+            self.log_error(MongoDatabase.retrieve_activity_intervals_for_user.__name__ + ": Unexpected empty object: start_time")
+            return []
+        if end_time is None:
+            self.log_error(MongoDatabase.retrieve_activity_intervals_for_user.__name__ + ": Unexpected empty object: end_time")
+            return []
+
+        try:
+            query = { Keys.ACTIVITY_USER_ID_KEY: user_id, Keys.ACTIVITY_START_TIME_KEY: { '$lte': end_time }, "$or": [ { Keys.ACTIVITY_END_TIME_KEY: { '$gt': start_time } }, { Keys.ACTIVITY_END_TIME_KEY: None } ] }
+            result_keys = { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_ID_KEY: 1, Keys.ACTIVITY_START_TIME_KEY: 1, Keys.ACTIVITY_END_TIME_KEY: 1 }
+            intervals = []
+            for activity in self.activities_collection.find(query, result_keys):
+                intervals.append((activity[Keys.ACTIVITY_ID_KEY], activity[Keys.ACTIVITY_START_TIME_KEY], activity.get(Keys.ACTIVITY_END_TIME_KEY)))
+            return intervals
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return []
+
+    #
+    # Activity stream methods
+    #
+
+    def update_activity_last_updated_time(self, activity_id, end_time_ms=None):
+        """Marks the activity as having been updated. Returns False if the activity does not exist."""
+        """If the update added data that has a timestamp then also provide the time of the latest item so the activity's end time can be kept current."""
+        update = { "$set": { Keys.ACTIVITY_LAST_UPDATED_KEY: time.time() } }
+        if end_time_ms is not None:
+            update["$max"] = { Keys.ACTIVITY_END_TIME_KEY: int(end_time_ms / 1000) }
+        result = self.activities_collection.update_one({ Keys.ACTIVITY_ID_KEY: activity_id }, update)
+        return result.matched_count > 0
+
+    def create_activity_stream_samples(self, activity_id, stream_name, samples):
+        """Adds samples to an activity stream. Samples are grouped into fixed-length time buckets, each of which is a document"""
+        """that is appended to, and kept in time order, by the database. 'samples' is a list of dictionaries with a time key."""
+        chunks = {}
+        for sample in samples:
+            sample_time = int(sample[Keys.STREAM_SAMPLE_TIME_KEY])
+            chunk_start = sample_time - (sample_time % STREAM_CHUNK_DURATION_MS)
+            chunks.setdefault(chunk_start, []).append(sample)
+
+        requests = []
+        for chunk_start in chunks:
+            chunk_samples = chunks[chunk_start]
+            chunk_end = max(sample[Keys.STREAM_SAMPLE_TIME_KEY] for sample in chunk_samples)
+            query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.STREAM_NAME_KEY: stream_name, Keys.STREAM_CHUNK_START_KEY: chunk_start }
+            update = { "$push": { Keys.STREAM_SAMPLES_KEY: { "$each": chunk_samples, "$sort": { Keys.STREAM_SAMPLE_TIME_KEY: 1 } } }, "$max": { Keys.STREAM_CHUNK_END_KEY: chunk_end } }
+            requests.append(pymongo.UpdateOne(query, update, upsert=True))
+        if requests:
+            self.activity_streams_collection.bulk_write(requests, ordered=False)
+        return True
+
+    def read_activity_stream_chunks(self, activity_id, stream_name, start_time, end_time):
+        """Reassembles a stream from the stream store. Only the chunks that overlap the time range are loaded. Either end of the range may be None."""
+        query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.STREAM_NAME_KEY: stream_name }
+        if start_time is not None:
+            query[Keys.STREAM_CHUNK_END_KEY] = { "$gte": start_time }
+        if end_time is not None:
+            query[Keys.STREAM_CHUNK_START_KEY] = { "$lte": end_time }
+
+        values = []
+        for chunk in self.activity_streams_collection.find(query, { Keys.DATABASE_ID_KEY: 0, Keys.STREAM_SAMPLES_KEY: 1, Keys.STREAM_PACKED_KEY: 1 }).sort(Keys.STREAM_CHUNK_START_KEY, pymongo.ASCENDING):
+            values.extend(stream_chunk_to_values(stream_name, chunk))
+        return filter_stream_values(stream_name, values, start_time, end_time)
+
+    def load_activity_streams(self, activity):
+        """Fills in the activity's raw data (locations, sensor readings, etc.) from the stream store."""
+        streams = {}
+        cursor = self.activity_streams_collection.find({ Keys.ACTIVITY_ID_KEY: activity[Keys.ACTIVITY_ID_KEY] }, { Keys.DATABASE_ID_KEY: 0, Keys.STREAM_NAME_KEY: 1, Keys.STREAM_SAMPLES_KEY: 1, Keys.STREAM_PACKED_KEY: 1 })
+        for chunk in cursor.sort([ (Keys.STREAM_NAME_KEY, pymongo.ASCENDING), (Keys.STREAM_CHUNK_START_KEY, pymongo.ASCENDING) ]):
+            stream_name = chunk[Keys.STREAM_NAME_KEY]
+            streams.setdefault(stream_name, []).extend(stream_chunk_to_values(stream_name, chunk))
+        for stream_name in streams:
+            legacy_values = activity[stream_name] if stream_name in activity else []
+            activity[stream_name] = merge_stream_values(stream_name, legacy_values, streams[stream_name])
+        return activity
+
+    @Perf.statistics
+    def retrieve_activity_stream(self, activity_id, stream_name, start_time, end_time):
+        """Returns the values of one of the activity's streams (locations, Heart Rate, etc.) that fall within the time range."""
+        """Either end of the range may be None. Returns None if the activity does not exist."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_stream.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_activity_stream.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+        if stream_name not in Keys.ACTIVITY_STREAM_KEYS:
+            self.log_error(MongoDatabase.retrieve_activity_stream.__name__ + ": Invalid object: stream_name " + str(stream_name))
+            return None
+
+        try:
+            # Older activities may still have the data in the activity document.
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { Keys.DATABASE_ID_KEY: 0, stream_name: 1 })
+            if activity is not None:
+                legacy_values = activity[stream_name] if stream_name in activity else []
+                legacy_values = filter_stream_values(stream_name, legacy_values, start_time, end_time)
+                stream_values = self.read_activity_stream_chunks(activity_id, stream_name, start_time, end_time)
+                return merge_stream_values(stream_name, legacy_values, stream_values)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    @Perf.statistics
+    def retrieve_activity_stream_data(self, activity_id, stream_name, start_time, end_time):
+        """Returns one of the activity's streams as a StreamCodec.StreamData object, i.e. as arrays rather than lists of dictionaries."""
+        """Packed chunks are decoded without copying. Either end of the range may be None. Returns None if the activity does not exist."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_stream_data.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_activity_stream_data.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None
+        activity_id = normalize_activity_id(activity_id)
+        if stream_name not in Keys.ACTIVITY_STREAM_KEYS:
+            self.log_error(MongoDatabase.retrieve_activity_stream_data.__name__ + ": Invalid object: stream_name " + str(stream_name))
+            return None
+
+        try:
+            # Older activities may still have the data in the activity document.
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { Keys.DATABASE_ID_KEY: 0, stream_name: 1 })
+            if activity is None:
+                return None
+            parts = []
+            if stream_name in activity:
+                parts.append(StreamCodec.from_values(stream_name, activity[stream_name]))
+
+            query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.STREAM_NAME_KEY: stream_name }
+            if start_time is not None:
+                query[Keys.STREAM_CHUNK_END_KEY] = { "$gte": start_time }
+            if end_time is not None:
+                query[Keys.STREAM_CHUNK_START_KEY] = { "$lte": end_time }
+            for chunk in self.activity_streams_collection.find(query, { Keys.DATABASE_ID_KEY: 0, Keys.STREAM_SAMPLES_KEY: 1, Keys.STREAM_PACKED_KEY: 1 }).sort(Keys.STREAM_CHUNK_START_KEY, pymongo.ASCENDING):
+                if Keys.STREAM_PACKED_KEY in chunk:
+                    parts.append(StreamCodec.unpack(stream_name, chunk[Keys.STREAM_PACKED_KEY]))
+                if Keys.STREAM_SAMPLES_KEY in chunk and chunk[Keys.STREAM_SAMPLES_KEY]:
+                    parts.append(StreamCodec.from_samples(stream_name, chunk[Keys.STREAM_SAMPLES_KEY]))
+            return StreamCodec.concatenate(stream_name, parts).slice(start_time, end_time)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def compact_activity_streams(self, activity_id):
+        """Rewrites the activity's stream chunks in the packed, columnar, encoding. Does nothing unless packing is enabled in the config file."""
+        """Intended to be called once the activity is no longer changing, i.e. after it has been analyzed."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.compact_activity_streams.__name__ + ": Unexpected empty object: activity_id")
+            return False
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.compact_activity_streams.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return False
+        activity_id = normalize_activity_id(activity_id)
+        if not self.pack_streams:
+            return True
+
+        try:
+            query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.STREAM_SAMPLES_KEY: { "$ne": [] } }
+            for chunk in self.activity_streams_collection.find(query):
+                stream_name = chunk[Keys.STREAM_NAME_KEY]
+                samples = chunk[Keys.STREAM_SAMPLES_KEY]
+                if Keys.STREAM_PACKED_KEY in chunk:
+                    samples = StreamCodec.unpack(stream_name, chunk[Keys.STREAM_PACKED_KEY]).to_samples() + samples
+
+                # Leave the chunk alone if it has data that can't be packed exactly.
+                packed = StreamCodec.pack_samples(stream_name, samples)
+                if packed is None:
+                    continue
+
+                # Only replace the samples if nothing was appended since they were read. Anything appended later will be packed next time.
+                chunk_query = { Keys.DATABASE_ID_KEY: chunk[Keys.DATABASE_ID_KEY], Keys.STREAM_SAMPLES_KEY: { "$size": len(chunk[Keys.STREAM_SAMPLES_KEY]) } }
+                self.activity_streams_collection.update_one(chunk_query, { "$set": { Keys.STREAM_PACKED_KEY: packed, Keys.STREAM_SAMPLES_KEY: [] } })
+            return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def delete_activity_stream(self, activity_id, stream_name):
+        """Removes all of the stream's data, including anything left in the activity document."""
+        self.activity_streams_collection.delete_many({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.STREAM_NAME_KEY: stream_name })
+        result = self.activities_collection.update_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { "$unset": { stream_name: "" }, "$set": { Keys.ACTIVITY_LAST_UPDATED_KEY: time.time() } })
+        return result.matched_count > 0
+
     #
     # Activity data methods
     #
@@ -1333,40 +2103,28 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_locations.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if not locations:
             self.log_error(MongoDatabase.create_activity_locations.__name__ + ": Unexpected empty object: locations")
             return False
 
         try:
-            # Find the activity.
-            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
             # If the activity was not found then create it.
-            if activity is None:
+            if not self.activities_collection.count_documents({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, limit = 1):
                 first_location = locations[0]
-                if self.create_activity(activity_id, "", first_location[0] / 1000, device_str):
-                    activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
-            # If the activity was found.
-            if activity is not None:
-                location_list = []
-
-                # Get the existing list.
-                if Keys.ACTIVITY_LOCATIONS_KEY in activity:
-                    location_list = activity[Keys.ACTIVITY_LOCATIONS_KEY]
-
-                # Append the new locations.
-                for location in locations:
-                    value = { Keys.LOCATION_TIME_KEY: location[0], Keys.LOCATION_LAT_KEY: location[1], Keys.LOCATION_LON_KEY: location[2], Keys.LOCATION_ALT_KEY: location[3] }
-                    location_list.append(value)
+                if not self.create_activity(activity_id, "", first_location[0] / 1000, device_str):
+                    return False
 
-                # Make sure everything is in order.
-                location_list.sort(key=retrieve_time_from_location)
+            # Append the new locations.
+            location_list = []
+            for location in locations:
+                value = { Keys.LOCATION_TIME_KEY: location[0], Keys.LOCATION_LAT_KEY: location[1], Keys.LOCATION_LON_KEY: location[2], Keys.LOCATION_ALT_KEY: location[3] }
+                location_list.append(value)
 
-                # Save the changes.
-                activity[Keys.ACTIVITY_LOCATIONS_KEY] = location_list
-                update_activities_collection(self, activity)
-                return True
+            # Save the changes.
+            end_time_ms = max(location[0] for location in locations)
+            if self.update_activity_last_updated_time(activity_id, end_time_ms):
+                return self.create_activity_stream_samples(activity_id, Keys.APP_LOCATIONS_KEY, location_list)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1380,16 +2138,11 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.retrieve_activity_locations.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return None
+        activity_id = normalize_activity_id(activity_id)
 
         try:
-            # Find the activity.
-            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
-
-            # If the activity was found and it has location data.
-            if activity is not None and Keys.ACTIVITY_LOCATIONS_KEY in activity:
-                locations = activity[Keys.ACTIVITY_LOCATIONS_KEY]
-                locations.sort(key=retrieve_time_from_location)
-                return locations
+            # Older activities may still have their locations in the activity document, that's handled when reading the stream.
+            return self.retrieve_activity_stream(activity_id, Keys.APP_LOCATIONS_KEY, None, None)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1403,6 +2156,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_sensor_reading.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if date_time is None:
             self.log_error(MongoDatabase.create_activity_sensor_reading.__name__ + ": Unexpected empty object: date_time")
             return False
@@ -1414,6 +2168,12 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
+            # Sensors with a stream go to the stream store.
+            if sensor_type in Keys.ACTIVITY_STREAM_KEYS:
+                if self.update_activity_last_updated_time(activity_id):
+                    return self.create_activity_stream_samples(activity_id, sensor_type, [ { Keys.STREAM_SAMPLE_TIME_KEY: date_time, Keys.STREAM_SAMPLE_VALUE_KEY: float(value) } ])
+                return False
+
             # Find the activity.
             activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
 
@@ -1446,6 +2206,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_sensor_readings.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if sensor_type is None:
             self.log_error(MongoDatabase.create_activity_sensor_readings.__name__ + ": Unexpected empty object: sensor_type")
             return False
@@ -1454,6 +2215,13 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
+            # Sensors with a stream go to the stream store.
+            if sensor_type in Keys.ACTIVITY_STREAM_KEYS:
+                if self.update_activity_last_updated_time(activity_id):
+                    samples = [{ Keys.STREAM_SAMPLE_TIME_KEY: value[0], Keys.STREAM_SAMPLE_VALUE_KEY: float(value[1]) } for value in values]
+                    return self.create_activity_stream_samples(activity_id, sensor_type, samples)
+                return False
+
             # Find the activity.
             activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
 
@@ -1488,11 +2256,16 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_sensor_readings.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if sensor_type is None:
             self.log_error(MongoDatabase.create_activity_sensor_readings.__name__ + ": Unexpected empty object: sensor_type")
             return False
 
         try:
+            # Sensors with a stream are kept in the stream store.
+            if sensor_type in Keys.ACTIVITY_STREAM_KEYS:
+                return self.delete_activity_stream(activity_id, sensor_type)
+
             # Find the activity.
             activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
 
@@ -1516,6 +2289,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_event.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return None
+        activity_id = normalize_activity_id(activity_id)
         if event is None:
             self.log_error(MongoDatabase.create_activity_event.__name__ + ": Unexpected empty object: event")
             return None
@@ -1552,6 +2326,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_events.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return None
+        activity_id = normalize_activity_id(activity_id)
         if events is None:
             self.log_error(MongoDatabase.create_activity_events.__name__ + ": Unexpected empty object: events")
             return None
@@ -1588,6 +2363,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_or_update_activity_metadata.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if date_time is None and create_list:
             self.log_error(MongoDatabase.create_or_update_activity_metadata.__name__ + ": Unexpected empty object: date_time")
             return False
@@ -1602,19 +2378,25 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
+            # Make sure we're working with a number, if the value is supposed to be a number.
+            try:
+                if not key in [ Keys.ACTIVITY_NAME_KEY, Keys.ACTIVITY_TYPE_KEY, Keys.ACTIVITY_DESCRIPTION_KEY ]:
+                    value = float(value)
+            except ValueError:
+                pass
+
+            # Lists with a stream go to the stream store.
+            if create_list is True and key in Keys.ACTIVITY_STREAM_KEYS:
+                if self.update_activity_last_updated_time(activity_id):
+                    return self.create_activity_stream_samples(activity_id, key, [ { Keys.STREAM_SAMPLE_TIME_KEY: date_time, Keys.STREAM_SAMPLE_VALUE_KEY: value } ])
+                return False
+
             # Find the activity.
             activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
 
             # If the activity was found.
             if activity is not None:
 
-                # Make sure we're working with a number, if the value is supposed to be a number.
-                try:
-                    if not key in [ Keys.ACTIVITY_NAME_KEY, Keys.ACTIVITY_TYPE_KEY, Keys.ACTIVITY_DESCRIPTION_KEY ]:
-                        value = float(value)
-                except ValueError:
-                    pass
-
                 # The metadata is a list.
                 if create_list is True:
                     value_list = []
@@ -1651,6 +2433,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_or_update_activity_metadata_list.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if key is None:
             self.log_error(MongoDatabase.create_or_update_activity_metadata_list.__name__ + ": Unexpected empty object: key")
             return False
@@ -1659,6 +2442,13 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
+            # Lists with a stream go to the stream store, replacing whatever was there.
+            if key in Keys.ACTIVITY_STREAM_KEYS:
+                if self.delete_activity_stream(activity_id, key):
+                    samples = [{ Keys.STREAM_SAMPLE_TIME_KEY: value[0], Keys.STREAM_SAMPLE_VALUE_KEY: float(value[1]) } for value in values]
+                    return self.create_activity_stream_samples(activity_id, key, samples)
+                return False
+
             # Find the activity.
             activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id })
 
@@ -1687,6 +2477,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_sets_and_reps_data.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if sets is None:
             self.log_error(MongoDatabase.create_activity_sets_and_reps_data.__name__ + ": Unexpected empty object: sets")
             return False
@@ -1716,40 +2507,28 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_accelerometer_reading.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if not accels:
             self.log_error(MongoDatabase.create_activity_accelerometer_reading.__name__ + ": Unexpected empty object: accels")
             return False
 
         try:
-            # Find the activity.
-            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
             # If the activity was not found then create it.
-            if activity is None:
+            if not self.activities_collection.count_documents({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str }, limit = 1):
                 first_accel = accels[0]
-                if self.create_activity(activity_id, "", first_accel[0] / 1000, device_str):
-                    activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_DEVICE_STR_KEY: device_str })
-
-            # If the activity was found.
-            if activity is not None:
-                accel_list = []
-
-                # Get the existing list.
-                if Keys.APP_ACCELEROMETER_KEY in activity:
-                    accel_list = activity[Keys.APP_ACCELEROMETER_KEY]
-
-                for accel in accels:
+                if not self.create_activity(activity_id, "", first_accel[0] / 1000, device_str):
+                    return False
 
-                    # Make sure time values are monotonically increasing.
-                    if accel_list and int(accel_list[-1][Keys.ACCELEROMETER_TIME_KEY]) > accel[0]:
-                        self.log_error(MongoDatabase.create_activity_accelerometer_reading.__name__ + ": Received out-of-order time value.")
-                    else:
-                        value = { Keys.ACCELEROMETER_TIME_KEY: accel[0], Keys.ACCELEROMETER_AXIS_NAME_X: accel[1], Keys.ACCELEROMETER_AXIS_NAME_Y: accel[2], Keys.ACCELEROMETER_AXIS_NAME_Z: accel[3] }
-                        accel_list.append(value)
+            # The stream store keeps the readings in time order, even if they arrive out of order.
+            accel_list = []
+            for accel in accels:
+                value = { Keys.ACCELEROMETER_TIME_KEY: accel[0], Keys.ACCELEROMETER_AXIS_NAME_X: accel[1], Keys.ACCELEROMETER_AXIS_NAME_Y: accel[2], Keys.ACCELEROMETER_AXIS_NAME_Z: accel[3] }
+                accel_list.append(value)
 
-                activity[Keys.APP_ACCELEROMETER_KEY] = accel_list
-                update_activities_collection(self, activity)
-                return True
+            # Save the changes.
+            end_time_ms = max(accel[0] for accel in accels)
+            if self.update_activity_last_updated_time(activity_id, end_time_ms):
+                return self.create_activity_stream_samples(activity_id, Keys.APP_ACCELEROMETER_KEY, accel_list)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1767,6 +2546,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_summary.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if summary_data is None:
             self.log_error(MongoDatabase.create_activity_summary.__name__ + ": Unexpected empty object: summary_data")
             return False
@@ -1785,6 +2565,32 @@ class MongoDatabase(Database.Database):
             self.log_error(sys.exc_info()[0])
         return False
 
+    def update_activity_legacy_hash(self, activity_id, activity_hash, legacy_hash):
+        """Stores the activity hash in the original format next to the current one. Only written if the summary still has the given"""
+        """(current format) hash, so it can't be attached to a summary computed from different data. Replaced along with the summary."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.update_activity_legacy_hash.__name__ + ": Unexpected empty object: activity_id")
+            return False
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.update_activity_legacy_hash.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return False
+        activity_id = normalize_activity_id(activity_id)
+        if activity_hash is None:
+            self.log_error(MongoDatabase.update_activity_legacy_hash.__name__ + ": Unexpected empty object: activity_hash")
+            return False
+        if legacy_hash is None:
+            self.log_error(MongoDatabase.update_activity_legacy_hash.__name__ + ": Unexpected empty object: legacy_hash")
+            return False
+
+        try:
+            query = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY: activity_hash }
+            update_result = self.activities_collection.update_one(query, { "$set": { Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_LEGACY_HASH_KEY: legacy_hash } })
+            return update_result.matched_count > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
     def delete_activity_summary(self, activity_id):
         """Delete method for activity summary data. Summary data is data computed from the raw data."""
         if activity_id is None:
@@ -1793,6 +2599,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.delete_activity_summary.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             # Find the activity.
@@ -1808,6 +2615,55 @@ class MongoDatabase(Database.Database):
             self.log_error(sys.exc_info()[0])
         return False
 
+    def retrieve_activity_live_state(self, activity_id):
+        """Retrieve method for the running analysis of a live activity. Returns the state, or None if there isn't one, and the activity's start time."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_activity_live_state.__name__ + ": Unexpected empty object: activity_id")
+            return None, None
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.retrieve_activity_live_state.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return None, None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            activity = self.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: activity_id }, { Keys.DATABASE_ID_KEY: 0, Keys.ACTIVITY_LIVE_STATE_KEY: 1, Keys.ACTIVITY_START_TIME_KEY: 1 })
+            if activity is not None:
+                return activity.get(Keys.ACTIVITY_LIVE_STATE_KEY), activity.get(Keys.ACTIVITY_START_TIME_KEY)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None, None
+
+    def update_activity_live_state(self, activity_id, expected_revision, live_state, summary_data):
+        """Update method for the running analysis of a live activity. Stores the state and the summary in a single write, which only succeeds if the"""
+        """stored state is still at the expected revision (None meaning that there shouldn't be one), so concurrent updates can't overwrite each other."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.update_activity_live_state.__name__ + ": Unexpected empty object: activity_id")
+            return False
+        if not InputChecker.is_uuid(activity_id):
+            self.log_error(MongoDatabase.update_activity_live_state.__name__ + ": Invalid object: activity_id " + str(activity_id))
+            return False
+        activity_id = normalize_activity_id(activity_id)
+        if live_state is None:
+            self.log_error(MongoDatabase.update_activity_live_state.__name__ + ": Unexpected empty object: live_state")
+            return False
+        if summary_data is None:
+            self.log_error(MongoDatabase.update_activity_live_state.__name__ + ": Unexpected empty object: summary_data")
+            return False
+
+        try:
+            query = { Keys.ACTIVITY_ID_KEY: activity_id }
+            if expected_revision is None:
+                query[Keys.ACTIVITY_LIVE_STATE_KEY] = { "$exists": False }
+            else:
+                query[Keys.ACTIVITY_LIVE_STATE_KEY + "." + Keys.LIVE_STATE_REVISION_KEY] = expected_revision
+            result = self.activities_collection.update_one(query, { "$set": { Keys.ACTIVITY_LIVE_STATE_KEY: live_state, Keys.ACTIVITY_SUMMARY_KEY: summary_data } })
+            return result.matched_count > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
     #
     # Tag management methods
     #
@@ -1820,6 +2676,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_tag.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if tag is None:
             self.log_error(MongoDatabase.create_tag.__name__ + ": Unexpected empty object: tag")
             return False
@@ -1852,9 +2709,11 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
+            # Only update the tags, the activity object may have been loaded with its streams.
             activity[Keys.ACTIVITY_TAGS_KEY] = tags
-            update_activities_collection(self, activity)
-            return True
+            activity[Keys.ACTIVITY_LAST_UPDATED_KEY] = time.time()
+            result = self.activities_collection.update_one({ Keys.ACTIVITY_ID_KEY: activity[Keys.ACTIVITY_ID_KEY] }, { "$set": { Keys.ACTIVITY_TAGS_KEY: tags, Keys.ACTIVITY_LAST_UPDATED_KEY: activity[Keys.ACTIVITY_LAST_UPDATED_KEY] } })
+            return result.matched_count > 0
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -1868,6 +2727,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_tags_on_activity_by_id.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if tags is None:
             self.log_error(MongoDatabase.create_tags_on_activity_by_id.__name__ + ": Unexpected empty object: tags")
             return False
@@ -1894,6 +2754,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_tag.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if tag is None:
             self.log_error(MongoDatabase.create_tag.__name__ + ": Unexpected empty object: tag")
             return False
@@ -1926,6 +2787,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_comment.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if commenter_id is None:
             self.log_error(MongoDatabase.create_activity_comment.__name__ + ": Unexpected empty object: commenter_id")
             return False
@@ -1968,6 +2830,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.create_activity_photo.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if photo_hash is None:
             self.log_error(MongoDatabase.create_activity_photo.__name__ + ": Unexpected empty object: photo_hash")
             return False
@@ -2005,6 +2868,7 @@ class MongoDatabase(Database.Database):
         if not InputChecker.is_uuid(activity_id):
             self.log_error(MongoDatabase.delete_activity_photo.__name__ + ": Invalid object: activity_id " + str(activity_id))
             return False
+        activity_id = normalize_activity_id(activity_id)
         if photo_id is None:
             self.log_error(MongoDatabase.delete_activity_photo.__name__ + ": Unexpected empty object: photo_id")
             return False
@@ -2933,28 +3797,104 @@ class MongoDatabase(Database.Database):
             self.log_error(sys.exc_info()[0])
         return False
 
-    def create_uploaded_file(self, activity_id, file_data):
-        """Create method for an uploaded activity file."""
+    def create_pending_uploaded_file(self, import_task_id, store_name, content_hash):
+        """Create method for an uploaded activity file that is waiting to be imported. The file itself stays in the upload store, this records"""
+        """where it is, and keeps it there until the import finishes. The activity ID is filled in by update_uploaded_file_activity."""
+        if import_task_id is None:
+            self.log_error(MongoDatabase.create_pending_uploaded_file.__name__ + ": Unexpected empty object: import_task_id")
+            return False
+        if store_name is None:
+            self.log_error(MongoDatabase.create_pending_uploaded_file.__name__ + ": Unexpected empty object: store_name")
+            return False
+        if content_hash is None:
+            self.log_error(MongoDatabase.create_pending_uploaded_file.__name__ + ": Unexpected empty object: content_hash")
+            return False
+
+        try:
+            post = { Keys.UPLOADED_FILE_IMPORT_TASK_KEY: str(import_task_id), Keys.UPLOADED_FILE_STORE_KEY: store_name, Keys.UPLOADED_FILE_HASH_KEY: content_hash }
+            return insert_into_collection(self.uploads_collection, post)
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def update_uploaded_file_activity(self, import_task_id, activity_id, store_name, content_hash):
+        """Records the activity that the import task created from its uploaded file. Tasks queued before pending uploads were recorded"""
+        """don't have a record to update, so one is created for them."""
+        if import_task_id is None:
+            self.log_error(MongoDatabase.update_uploaded_file_activity.__name__ + ": Unexpected empty object: import_task_id")
+            return False
         if activity_id is None:
-            self.log_error(MongoDatabase.create_uploaded_file.__name__ + ": Unexpected empty object: activity_id")
+            self.log_error(MongoDatabase.update_uploaded_file_activity.__name__ + ": Unexpected empty object: activity_id")
+            return False
+        if store_name is None:
+            self.log_error(MongoDatabase.update_uploaded_file_activity.__name__ + ": Unexpected empty object: store_name")
             return False
-        if file_data is None:
-            self.log_error(MongoDatabase.create_uploaded_file.__name__ + ": Unexpected empty object: file_data")
+        if content_hash is None:
+            self.log_error(MongoDatabase.update_uploaded_file_activity.__name__ + ": Unexpected empty object: content_hash")
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
-            post = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.UPLOADED_FILE_DATA_KEY: bytes(file_data) }
+            update = { "$set": { Keys.ACTIVITY_ID_KEY: activity_id }, "$unset": { Keys.UPLOADED_FILE_IMPORT_TASK_KEY: "" } }
+            result = self.uploads_collection.update_one({ Keys.UPLOADED_FILE_IMPORT_TASK_KEY: str(import_task_id) }, update)
+            if result.matched_count > 0:
+                return True
+            post = { Keys.ACTIVITY_ID_KEY: activity_id, Keys.UPLOADED_FILE_STORE_KEY: store_name, Keys.UPLOADED_FILE_HASH_KEY: content_hash }
             return insert_into_collection(self.uploads_collection, post)
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return False
 
+    def delete_pending_uploaded_file(self, import_task_id):
+        """Delete method for the record of an uploaded file that the import task didn't import."""
+        if import_task_id is None:
+            self.log_error(MongoDatabase.delete_pending_uploaded_file.__name__ + ": Unexpected empty object: import_task_id")
+            return False
+
+        try:
+            deleted_result = self.uploads_collection.delete_one({ Keys.UPLOADED_FILE_IMPORT_TASK_KEY: str(import_task_id) })
+            if deleted_result is not None:
+                return True
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
+
+    def retrieve_uploaded_file(self, activity_id):
+        """Retrieve method for the record of the file an activity was imported from. Older records hold the file data itself, that is left out."""
+        if activity_id is None:
+            self.log_error(MongoDatabase.retrieve_uploaded_file.__name__ + ": Unexpected empty object: activity_id")
+            return None
+        activity_id = normalize_activity_id(activity_id)
+
+        try:
+            return self.uploads_collection.find_one({ Keys.ACTIVITY_ID_KEY: str(activity_id) }, { Keys.DATABASE_ID_KEY: 0, Keys.UPLOADED_FILE_DATA_KEY: 0 })
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def count_uploaded_file_references(self, content_hash):
+        """Returns the number of activities that were imported, or are waiting to be imported, from the uploaded file with the given hash."""
+        if content_hash is None:
+            self.log_error(MongoDatabase.count_uploaded_file_references.__name__ + ": Unexpected empty object: content_hash")
+            return None
+
+        try:
+            return self.uploads_collection.count_documents({ Keys.UPLOADED_FILE_HASH_KEY: content_hash })
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
     def delete_uploaded_file(self, activity_id):
         """Delete method for an uploaded file associated with an activity."""
         if activity_id is None:
             self.log_error(MongoDatabase.delete_uploaded_file.__name__ + ": Unexpected empty object: activity_id")
             return False
+        activity_id = normalize_activity_id(activity_id)
 
         try:
             deleted_result = self.uploads_collection.delete_one({ Keys.ACTIVITY_ID_KEY: str(activity_id) })
@@ -2982,19 +3922,10 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
-            # Find the user.
             user_id_obj = ObjectId(str(user_id))
-            user = self.users_collection.find_one({ Keys.DATABASE_ID_KEY: user_id_obj })
-
-            # If the user was found.
-            if user is not None:
-                key_list = []
-                if Keys.API_KEYS in user:
-                    key_list = user[Keys.API_KEYS]
-                key_dict = { Keys.API_KEY: str(key), Keys.API_KEY_RATE: int(rate) }
-                key_list.append(key_dict)
-                user[Keys.API_KEYS] = key_list
-                return update_collection(self.users_collection, user)
+            key_dict = { Keys.API_KEY: str(key), Keys.API_KEY_RATE: int(rate) }
+            update_result = self.users_collection.update_one({ Keys.DATABASE_ID_KEY: user_id_obj }, { "$push": { Keys.API_KEYS: key_dict } })
+            return update_result is not None and update_result.matched_count > 0
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
@@ -3030,32 +3961,92 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
-            # Find the user.
+            # Make sure we're dealing with a string.
+            key_str = str(key)
+
+            # Revoke it here first, so that it can't be used while the database is being updated.
+            g_api_key_cache.invalidate(key_str)
+
             user_id_obj = ObjectId(str(user_id))
-            user = self.users_collection.find_one({ Keys.DATABASE_ID_KEY: user_id_obj })
+            update_result = self.users_collection.update_one({ Keys.DATABASE_ID_KEY: user_id_obj }, { "$pull": { Keys.API_KEYS: { Keys.API_KEY: key_str } } })
+            return update_result is not None and update_result.modified_count > 0
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return False
 
-            # If the user was found.
-            if user is not None and Keys.API_KEYS in user:
+    #
+    # API rate limit methods
+    #
 
-                # Make sure we're dealing with a string.
-                key_str = str(key)
+    def increment_rate_limit_counter(self, key, window_start, expiry, max_count):
+        """Atomically increments the request counter for the given key and window, unless it has already reached max_count."""
+        """Returns the new count, or None if the counter was full. Counters are deleted by the database once the expiry time (UNIX timestamp) has passed."""
+        if key is None:
+            self.log_error(MongoDatabase.increment_rate_limit_counter.__name__ + ": Unexpected empty object: key")
+            return None
+        if window_start is None:
+            self.log_error(MongoDatabase.increment_rate_limit_counter.__name__ + ": Unexpected empty object: window_start")
+            return None
+        if max_count is None:
+            self.log_error(MongoDatabase.increment_rate_limit_counter.__name__ + ": Unexpected empty object: max_count")
+            return None
+        if max_count <= 0:
+            return None
 
-                # Search the key list and remove the specified key.
-                found = False
-                key_list = user[Keys.API_KEYS]
-                for item in key_list:
-                    if item[Keys.API_KEY] == key_str:
-                        key_list.remove(item)
-                        found = True
-                        break
-                if found:
-                    user[Keys.API_KEYS] = key_list
-                    return update_collection(self.users_collection, user)
+        try:
+            query = { Keys.RATE_LIMIT_KEY: key, Keys.RATE_LIMIT_WINDOW_START_KEY: window_start, Keys.RATE_LIMIT_COUNT_KEY: { "$lt": max_count } }
+            update = { "$inc": { Keys.RATE_LIMIT_COUNT_KEY: 1 }, "$setOnInsert": { Keys.RATE_LIMIT_EXPIRES_AT_KEY: datetime.datetime.utcfromtimestamp(expiry) } }
+            projection = { Keys.DATABASE_ID_KEY: 0, Keys.RATE_LIMIT_COUNT_KEY: 1 }
+            try:
+                counter = self.rate_limits_collection.find_one_and_update(query, update, projection=projection, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+            except pymongo.errors.DuplicateKeyError:
+                # Either the counter is full, so the upsert tried to create a second one, or another process created it at the same time.
+                # Either way it exists now, so only increment it if there's room.
+                counter = self.rate_limits_collection.find_one_and_update(query, update, projection=projection, return_document=pymongo.ReturnDocument.AFTER)
+            if counter is not None:
+                return counter[Keys.RATE_LIMIT_COUNT_KEY]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return None
+
+    def decrement_rate_limit_counter(self, key, window_start):
+        """Takes back a request counted by increment_rate_limit_counter."""
+        if key is None:
+            self.log_error(MongoDatabase.decrement_rate_limit_counter.__name__ + ": Unexpected empty object: key")
+            return False
+        if window_start is None:
+            self.log_error(MongoDatabase.decrement_rate_limit_counter.__name__ + ": Unexpected empty object: window_start")
+            return False
+
+        try:
+            query = { Keys.RATE_LIMIT_KEY: key, Keys.RATE_LIMIT_WINDOW_START_KEY: window_start, Keys.RATE_LIMIT_COUNT_KEY: { "$gt": 0 } }
+            update_result = self.rate_limits_collection.update_one(query, { "$inc": { Keys.RATE_LIMIT_COUNT_KEY: -1 } })
+            return update_result.matched_count > 0
         except:
             self.log_error(traceback.format_exc())
             self.log_error(sys.exc_info()[0])
         return False
 
+    def retrieve_rate_limit_counter(self, key, window_start):
+        """Retrieve method for the request counter for the given key and window."""
+        if key is None:
+            self.log_error(MongoDatabase.retrieve_rate_limit_counter.__name__ + ": Unexpected empty object: key")
+            return 0
+        if window_start is None:
+            self.log_error(MongoDatabase.retrieve_rate_limit_counter.__name__ + ": Unexpected empty object: window_start")
+            return 0
+
+        try:
+            counter = self.rate_limits_collection.find_one({ Keys.RATE_LIMIT_KEY: key, Keys.RATE_LIMIT_WINDOW_START_KEY: window_start }, { Keys.DATABASE_ID_KEY: 0, Keys.RATE_LIMIT_COUNT_KEY: 1 })
+            if counter is not None:
+                return counter[Keys.RATE_LIMIT_COUNT_KEY]
+        except:
+            self.log_error(traceback.format_exc())
+            self.log_error(sys.exc_info()[0])
+        return 0
+
     #
     # Admin methods
     #
@@ -3126,7 +4117,9 @@ class MongoDatabase(Database.Database):
             return False
 
         try:
-            post = { Keys.SESSION_TOKEN_KEY: token, Keys.SESSION_USER_KEY: user, Keys.SESSION_EXPIRY_KEY: expiry }
+            # The TTL index on the expiration date means expired sessions get deleted without us having to do anything.
+            expires_at = datetime.datetime.utcfromtimestamp(expiry)
+            post = { Keys.SESSION_TOKEN_KEY: token, Keys.SESSION_USER_KEY: user, Keys.SESSION_EXPIRY_KEY: expiry, Keys.SESSION_EXPIRES_AT_KEY: expires_at }
             return insert_into_collection(self.sessions_collection, post)
         except:
             self.log_error(traceback.format_exc())
@@ -3140,7 +4133,7 @@ class MongoDatabase(Database.Database):
             return (None, None)
 
         try:
-            session_data = self.sessions_collection.find_one({ Keys.SESSION_TOKEN_KEY: token })
+            session_data = self.sessions_collection.find_one({ Keys.SESSION_TOKEN_KEY: token }, { Keys.DATABASE_ID_KEY: 0, Keys.SESSION_USER_KEY: 1, Keys.SESSION_EXPIRY_KEY: 1 })
             if session_data is not None:
                 return session_data[Keys.SESSION_USER_KEY], session_data[Keys.SESSION_EXPIRY_KEY]
         except:
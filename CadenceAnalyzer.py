@@ -30,6 +30,8 @@ import Units
 class CadenceAnalyzer(SensorAnalyzer.SensorAnalyzer):
     """Class for performing calculations on bicycle cadence."""
 
+    __slots__ = ('is_foot_based_activity', 'key')
+
     def __init__(self, activity_type):
         self.is_foot_based_activity = activity_type in Keys.FOOT_BASED_ACTIVITIES
         if self.is_foot_based_activity:
@@ -43,7 +45,7 @@ class CadenceAnalyzer(SensorAnalyzer.SensorAnalyzer):
     def analyze(self):
         """Called when all sensor readings have been processed."""
         results = SensorAnalyzer.SensorAnalyzer.analyze(self)
-        if len(self.readings) > 0:
+        if self.num_readings > 0:
             if self.is_foot_based_activity:
                 results[Keys.MAX_CADENCE] = self.max * 2.0
                 results[Keys.AVG_CADENCE] = self.avg * 2.0
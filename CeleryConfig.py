@@ -1,10 +1,33 @@
+from kombu import Queue
+import Keys
+
 result_backend = 'mongodb'
 task_serializer = 'json'
 result_serializer = 'json'
 accept_content = ['json']
 enable_utc = True
 broker_pool_limit = 1
-celery_acks_late = True
+task_acks_late = True
 worker_prefetch_multiplier = 1
 worker_concurrency = 1
 broker_transport_options = {'confirm_publish': True}
+
+# Work that a user is waiting on has a queue of its own, so that it doesn't wait behind a backlog of background work.
+# Each queue can be given its own workers, and concurrency, with the -Q and -c worker options. A worker started without -Q
+# takes tasks from all of them. Within a queue, tasks started by the user go first (only with late acks and a prefetch of one,
+# otherwise a worker would already be holding the lower priority tasks).
+task_queues = (
+    Queue(Keys.CELERY_INTERACTIVE_QUEUE, routing_key=Keys.CELERY_INTERACTIVE_QUEUE),
+    Queue(Keys.CELERY_ANALYSIS_QUEUE, routing_key=Keys.CELERY_ANALYSIS_QUEUE),
+    Queue(Keys.CELERY_PLANS_QUEUE, routing_key=Keys.CELERY_PLANS_QUEUE),
+    Queue(Keys.CELERY_MAINTENANCE_QUEUE, routing_key=Keys.CELERY_MAINTENANCE_QUEUE),
+)
+task_queue_max_priority = Keys.CELERY_MAX_PRIORITY
+task_default_priority = 0
+task_default_queue = Keys.CELERY_MAINTENANCE_QUEUE
+task_routes = {
+    'ImportWorker.import_activity': { 'queue': Keys.CELERY_INTERACTIVE_QUEUE },
+    'ActivityAnalyzer.*': { 'queue': Keys.CELERY_ANALYSIS_QUEUE }, # Analysis the user asked for is sent to the interactive queue instead
+    'WorkoutPlanGenerator.*': { 'queue': Keys.CELERY_PLANS_QUEUE },
+    'CeleryWorker.*': { 'queue': Keys.CELERY_MAINTENANCE_QUEUE },
+}
@@ -25,27 +25,34 @@
 
 from __future__ import absolute_import
 import celery
+import celery.signals
 import datetime
 import random
 
-import AnalysisScheduler
-import Config
-import DataMgr
 import Keys
-import UserMgr
 import Units
+import WorkerContext
 
 celery_worker = celery.Celery(Keys.CELERY_PROJECT_NAME, include=['ActivityAnalyzer', 'ImportWorker', 'WorkoutPlanGenerator'])
 celery_worker.config_from_object('CeleryConfig')
 
+@celery.signals.worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Sets up the database connections, etc. that every task in this process will share."""
+    WorkerContext.init_worker_context()
+
+@celery.signals.worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """Closes the database connections."""
+    WorkerContext.shutdown_worker_context()
+
 @celery_worker.task()
 def regenerate_heat_maps():
     print("Regenerating heat maps.")
 
-    analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
-    config = Config.Config()
-    data_mgr = DataMgr.DataMgr(config=config, root_url="", analysis_scheduler=analysis_scheduler, import_scheduler=None)
-    user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+    context = WorkerContext.get_worker_context()
+    data_mgr = context.data_mgr
+    user_mgr = context.user_mgr
 
     # Select a random user.
     user_id, user_realname = user_mgr.retrieve_random_user()
@@ -66,23 +73,22 @@ def check_for_unanalyzed_activities():
     """Check for activities that need to be analyzed. Do one, if any are found."""
     print("Looking for unanalyzed activities.")
 
-    analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
-    config = Config.Config()
-    data_mgr = DataMgr.DataMgr(config=config, root_url="", analysis_scheduler=analysis_scheduler, import_scheduler=None)
-    user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+    context = WorkerContext.get_worker_context()
+    data_mgr = context.data_mgr
+    user_mgr = context.user_mgr
 
     # We need a randomly selected activity that is missing the summary section.
     unanalyzed_activity_list = data_mgr.retrieve_unanalyzed_activity_list(64)
     if len(unanalyzed_activity_list) > 0:
         activity_id = str(random.choice(unanalyzed_activity_list))
         print("Selected " + activity_id + " for analysis.")
-        complete_activity_data = data_mgr.retrieve_activity(activity_id)
-        if complete_activity_data:
+        activity = data_mgr.retrieve_activity_small(activity_id)
+        if activity:
             print("Activity loaded.")
-            activity_user_id = user_mgr.retrieve_user_from_activity(complete_activity_data)
+            activity_user_id = user_mgr.retrieve_user_from_activity(activity)
             if activity_user_id:
                 print("Analyzing....")
-                data_mgr.schedule_activity_analysis(complete_activity_data, activity_user_id)
+                data_mgr.schedule_activity_analysis(activity_id, activity_user_id, False)
             else:
                 print("The activity owner could not be determined.")
         else:
@@ -90,16 +96,36 @@ def check_for_unanalyzed_activities():
     else:
         print("None found")
 
+@celery_worker.task()
+def check_for_stale_analysis():
+    """Check for activities that were analyzed by an older version of the analysis code and schedule them to be analyzed again."""
+    print("Looking for activities with out of date analysis.")
+
+    # Imported here because ActivityAnalyzer imports this module.
+    import ActivityAnalyzer
+
+    context = WorkerContext.get_worker_context()
+    data_mgr = context.data_mgr
+    user_mgr = context.user_mgr
+
+    stale_activity_list = data_mgr.retrieve_stale_analysis_activity_list(ActivityAnalyzer.ANALYZER_VERSION, 16)
+    for activity_id in stale_activity_list:
+        activity = data_mgr.retrieve_activity_small(activity_id)
+        if activity:
+            activity_user_id = user_mgr.retrieve_user_from_activity(activity)
+            if activity_user_id:
+                data_mgr.schedule_activity_analysis(activity_id, activity_user_id, False)
+    print("Scheduled " + str(len(stale_activity_list)) + " activities for re-analysis.")
+
 @celery_worker.task()
 def check_for_ungenerated_workout_plans():
     """Checks for users that need their workout plan regenerated. Generates workout plans for each of those users."""
     print("Looking for users with ungenerated workout plans.")
 
     now = datetime.datetime.utcnow()
-    analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
-    config = Config.Config()
-    data_mgr = DataMgr.DataMgr(config=config, root_url="", analysis_scheduler=analysis_scheduler, import_scheduler=None)
-    user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+    context = WorkerContext.get_worker_context()
+    data_mgr = context.data_mgr
+    user_mgr = context.user_mgr
 
     # These users don't have any pending workouts.
     user_ids = data_mgr.retrieve_users_without_scheduled_workouts()
@@ -110,20 +136,30 @@ def check_for_ungenerated_workout_plans():
         last_gen_time = user_mgr.retrieve_user_setting(user_id, Keys.USER_PLAN_LAST_GENERATED_TIME)
         gen = (now - last_gen_time).total_seconds() > Units.SECS_PER_DAY
         if gen:
-            data_mgr.generate_workout_plan_for_user(user_id)
+            data_mgr.generate_workout_plan_for_user(user_id, False)
             user_mgr.update_user_setting(user_id, Keys.USER_PLAN_LAST_GENERATED_TIME, now, now)
 
 @celery_worker.task()
 def prune_deferred_tasks_list():
     """Checks for users that need their workout plan regenerated."""
     print("Pruning the deferred tasks list.")
-    data_mgr = DataMgr.DataMgr(config=Config.Config(), root_url="", analysis_scheduler=None, import_scheduler=None)
+    data_mgr = WorkerContext.get_worker_context().data_mgr
     data_mgr.prune_deferred_tasks_list()
 
+@celery_worker.task()
+def compute_missing_activity_end_times():
+    """Stores the end time of activities that were created before the end time was always stored. Does nothing once they all have one."""
+    print("Looking for activities without an end time.")
+    data_mgr = WorkerContext.get_worker_context().data_mgr
+    num_updated = data_mgr.compute_missing_activity_end_times(64)
+    print("Updated " + str(num_updated) + " activities.")
+
 @celery_worker.on_after_configure.connect
 def setup_periodic_tasks(**kwargs):
     print("Registering periodic tasks.")
     celery_worker.add_periodic_task(700.0, prune_deferred_tasks_list.s(), name='Removes completed tasks from the deferred tasks list.')
     celery_worker.add_periodic_task(600.0, check_for_ungenerated_workout_plans.s(), name='Check for workout plans that need to be re-generated.')
     celery_worker.add_periodic_task(900.0, check_for_unanalyzed_activities.s(), name='Check for activities that need to be analyzed. Do one, if any are found.')
+    celery_worker.add_periodic_task(950.0, check_for_stale_analysis.s(), name='Check for activities analyzed by an older version of the analysis code and re-analyze them.')
     celery_worker.add_periodic_task(1000.0, regenerate_heat_maps.s(), name='.')
+    celery_worker.add_periodic_task(1100.0, compute_missing_activity_end_times.s(), name='Stores the end time of older activities that do not have one.')
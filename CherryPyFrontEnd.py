@@ -591,6 +591,7 @@ class CherryPyFrontEnd(object):
 
     def api_internal(self, verb, path, params, cookie):
         """Common code for handling API calls."""
+        """Returns the response, the HTTP status, and a list of any additional response headers."""
 
         #
         # Default return values.
@@ -598,6 +599,7 @@ class CherryPyFrontEnd(object):
 
         response = ""
         http_status = 200
+        headers = []
 
         #
         # Who made this request.
@@ -615,11 +617,15 @@ class CherryPyFrontEnd(object):
             if user_id is not None:
 
                 # Make sure the key is not being abused.
-                if not self.backend.data_mgr.check_api_rate(key, max_rate):
-                    user_id = None
+                endpoint = None
+                if len(path) > 1:
+                    endpoint = path[1]
+                rate_limit = self.backend.data_mgr.check_api_rate(key, max_rate, endpoint)
+                headers = rate_limit.headers()
+                if not rate_limit.allowed:
                     response = "Excessive API requests."
-                    http_status = 429
                     self.log_error(response)
+                    return response, 429, headers
 
         # API key not provided, check the web session cookie.
         if user_id == None:
@@ -651,7 +657,7 @@ class CherryPyFrontEnd(object):
         else:
             http_status = 400
 
-        return response, http_status
+        return response, http_status, headers
 
     @cherrypy.expose
     def api(self, *args, **kw):
@@ -676,7 +682,9 @@ class CherryPyFrontEnd(object):
                     params = json.loads(params)
 
             # Pass off to the internal handler, i.e. the method that doesn't use cherrypy objects.
-            response, http_status = self.api_internal(verb, args, params, None)
+            response, http_status, headers = self.api_internal(verb, args, params, None)
+            for name, value in headers:
+                cherrypy.response.headers[name] = value
 
         except ApiException.ApiException as e:
             response = e.message
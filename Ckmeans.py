@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Optimal k-means clustering of one dimensional data, using dynamic programming (the Ckmeans.1d.dp algorithm)."""
+"""Unlike general k-means, which depends on its random starting centroids, this finds the clustering with the smallest"""
+"""sum of squared distances to the cluster means, so the result is always the same for the same data."""
+
+import math
+import numpy as np
+
+def prefix_sums(sorted_values):
+    """Returns the running sums and running sums of squares of the values, each with a leading zero, so the cost of any"""
+    """cluster can be computed in constant time without storing a cost for every possible cluster."""
+
+    # Centering first keeps the prefix sums small, which keeps the subtraction in cluster_costs accurate.
+    centered = sorted_values - np.mean(sorted_values)
+    sums = np.concatenate(([0.0], np.cumsum(centered)))
+    sums_of_squares = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    return sums, sums_of_squares
+
+def cluster_costs(sums, sums_of_squares, starts, end):
+    """Returns the sum of squared distances to the mean of the values starting at each of the starts and ending at end (inclusive)."""
+    counts = end - starts + 1
+    segment_sums = sums[end + 1] - sums[starts]
+    costs = (sums_of_squares[end + 1] - sums_of_squares[starts]) - (segment_sums * segment_sums) / counts
+    return np.maximum(costs, 0.0)
+
+def fill_row(previous, sums, sums_of_squares, best_costs, cluster_starts, first, last, first_start, last_start):
+    """Fills in one row of the tables for the values first through last, whose last clusters start somewhere in first_start through last_start."""
+    """Where the last cluster starts never moves left as more values are added, so each row needs O(n log n) cost evaluations rather than O(n^2)."""
+    pending = [(first, last, first_start, last_start)]
+    while pending:
+        first, last, first_start, last_start = pending.pop()
+        if first > last:
+            continue
+        i = (first + last) // 2
+
+        # The last cluster starts at j, so the first j values make up the other clusters.
+        starts = np.arange(first_start, min(i, last_start) + 1)
+        candidates = previous[starts - 1] + cluster_costs(sums, sums_of_squares, starts, i)
+        best = int(np.argmin(candidates))
+        best_costs[i] = candidates[best]
+        cluster_starts[i] = starts[best]
+        pending.append((first, i - 1, first_start, starts[best]))
+        pending.append((i + 1, last, starts[best], last_start))
+
+def solve(sorted_values, max_k):
+    """Fills in the dynamic programming tables for 1 to max_k clusters. Row k - 1 of the first table is the smallest total cost of"""
+    """putting the first i + 1 values into k clusters, and the same row of the second is where the last of those clusters starts."""
+    """Only these two k by n tables are kept, cluster costs are computed as needed from the prefix sums."""
+    n = len(sorted_values)
+    sums, sums_of_squares = prefix_sums(sorted_values)
+    best_costs = np.full((max_k, n), np.inf)
+    cluster_starts = np.zeros((max_k, n), dtype=np.int64)
+    best_costs[0] = cluster_costs(sums, sums_of_squares, 0, np.arange(n))
+    for k in range(1, max_k):
+
+        # k + 1 clusters need at least k + 1 values, and all but the last cluster need at least one value each.
+        fill_row(best_costs[k - 1], sums, sums_of_squares, best_costs[k], cluster_starts[k], k, n - 1, k, n - 1)
+    return best_costs, cluster_starts
+
+def labels_from_solution(order, cluster_starts, k):
+    """Walks back through the table to label each value, in the original order, with its cluster. Clusters are numbered in increasing order of value."""
+    n = len(order)
+    sorted_labels = np.zeros(n, dtype=np.int64)
+    end = n - 1
+    for cluster in range(k - 1, -1, -1):
+        start = cluster_starts[cluster][end] if cluster > 0 else 0
+        sorted_labels[start:end + 1] = cluster
+        end = start - 1
+    labels = np.empty(n, dtype=np.int64)
+    labels[order] = sorted_labels
+    return labels.tolist()
+
+def cluster(values, k):
+    """Divides the values into k clusters. Returns the cluster number of each value, where cluster 0 has the smallest values."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return []
+    k = max(1, min(k, len(values)))
+    order = np.argsort(values, kind='stable')
+    _, cluster_starts = solve(values[order], k)
+    return labels_from_solution(order, cluster_starts, k)
+
+def bic(variance, num_values, k):
+    """Bayesian information criterion of a clustering, treating the clusters as normal distributions with a shared variance."""
+    """Each cluster costs two parameters, its mean and its share of the values. Lower is better."""
+    return num_values * math.log(variance) + 2 * k * math.log(num_values)
+
+def cluster_with_best_k(values, max_k, min_stddev=0.0):
+    """Divides the values into however many clusters, up to max_k, best explains them, as judged by the BIC."""
+    """min_stddev is the resolution of the data. Without it, a handful of values is always best explained by putting each"""
+    """one in its own cluster, so differences smaller than this are treated as noise rather than as separate clusters."""
+    """Returns the number of clusters and the cluster number of each value, where cluster 0 has the smallest values."""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return 0, []
+    max_k = max(1, min(max_k, n))
+    order = np.argsort(values, kind='stable')
+    best_costs, cluster_starts = solve(values[order], max_k)
+
+    best_k = 1
+    best_score = None
+    for k in range(1, max_k + 1):
+        variance = max(best_costs[k - 1][n - 1] / n, min_stddev * min_stddev)
+
+        # Nothing left to explain, more clusters would just be splitting identical values.
+        if variance <= 0.0:
+            best_k = k
+            break
+
+        score = bic(variance, n, k)
+        if best_score is None or score < best_score:
+            best_k = k
+            best_score = score
+    return best_k, labels_from_solution(order, cluster_starts, best_k)
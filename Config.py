@@ -107,11 +107,26 @@ class Config(object):
     def get_import_max_file_size(self):
         return self.get_int('Import', 'Max File Size')
 
+    def get_import_staging_store(self):
+        return self.get_str('Import', 'Staging Store')
+
     def get_database_url(self):
         database_url = self.get_str('Database', 'Database URL')
         if database_url is None or len(database_url) == 0:
             database_url = 'localhost:27017'
         return database_url
 
+    def is_stream_packing_enabled(self):
+        return self.get_bool('Database', 'Pack Streams')
+
+    def is_index_verification_enabled(self):
+        return self.get_bool('Database', 'Verify Indexes')
+
+    def get_rate_limiter_backend(self):
+        return self.get_str('API', 'Rate Limiter')
+
+    def get_api_burst_rate(self):
+        return self.get_int('API', 'Requests Per Minute')
+
     def get_broker_url(self):
         return self.get_str('Celery', 'Broker URL')
@@ -27,21 +27,26 @@ import base64
 import datetime
 import hashlib
 import os
-import threading
 import time
 import uuid
+import ActivityHasher
 import AppDatabase
 import BmiCalculator
+import Dirs
+import DurationCurves
 import FtpCalculator
 import HeartRateCalculator
 import Importer
 import InputChecker
+import IntervalIndex
 import Keys
+import LiveAnalyzer
 import MapSearch
 import MergeTool
+import RateLimiter
 import Summarizer
 import TrainingPaceCalculator
-import Units
+import UploadStore
 import VO2MaxCalculator
 import celery
 
@@ -51,9 +56,7 @@ ONE_WEEK = (7.0 * 24.0 * 60.0 * 60.0)
 FOUR_WEEKS = (28.0 * 24.0 * 60.0 * 60.0)
 EIGHT_WEEKS = (56.0 * 24.0 * 60.0 * 60.0)
 
-g_api_key_rate_lock = threading.Lock()
-g_api_key_rates = {}
-g_last_api_reset = 0 # Timestamp of when g_api_key_rates was last cleared 
+g_local_rate_limit_backend = RateLimiter.LocalBackend() # Shared by every DataMgr in the process
 
 def get_activities_sort_key(item):
     # Was the start time provided? If not, look at the first location.
@@ -73,7 +76,11 @@ class DataMgr(Importer.ActivityWriter):
         self.import_scheduler = import_scheduler
         self.database = AppDatabase.MongoDatabase()
         self.database.connect(config)
-        self.map_search = None
+        if config.get_rate_limiter_backend() == "database":
+            self.rate_limiter = RateLimiter.RateLimiter(RateLimiter.DatabaseBackend(self.database))
+        else:
+            self.rate_limiter = RateLimiter.RateLimiter(g_local_rate_limit_backend)
+        self.api_burst_rate = config.get_api_burst_rate()
         self.celery_worker = celery.Celery(Keys.CELERY_PROJECT_NAME)
         self.celery_worker.config_from_object('CeleryConfig')
         if config is not None:
@@ -98,10 +105,13 @@ class DataMgr(Importer.ActivityWriter):
         """Generates a new activity ID."""
         return str(uuid.uuid4())
 
-    def schedule_activity_analysis(self, activity, activity_user_id):
-        """Schedules the specified activity for analysis."""
-        if activity is None:
-            raise Exception("No activity object.")
+    def schedule_activity_analysis(self, activity_id, activity_user_id, user_initiated):
+        """Schedules the specified activity for analysis. Set user_initiated when the user is waiting on the result."""
+        """The task only carries the activity ID and the activity's analysis request counter, the worker loads the activity itself."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("No activity ID.")
         if activity_user_id is None:
             raise Exception("No activity user ID.")
         if not InputChecker.is_hex_str(activity_user_id):
@@ -109,8 +119,11 @@ class DataMgr(Importer.ActivityWriter):
         if self.analysis_scheduler is None:
             raise Exception("No analysis scheduler.")
 
-        activity[Keys.ACTIVITY_USER_ID_KEY] = activity_user_id
-        task_id, internal_task_id = self.analysis_scheduler.add_activity_to_analysis_queue(activity)
+        analysis_request = self.database.request_activity_analysis(activity_id)
+        if analysis_request is None:
+            raise Exception("Invalid activity ID.")
+
+        task_id, internal_task_id = self.analysis_scheduler.add_activity_to_analysis_queue(activity_id, activity_user_id, analysis_request, user_initiated)
         if [task_id, internal_task_id].count(None) == 0:
             self.create_deferred_task(activity_user_id, Keys.ANALYSIS_TASK_KEY, task_id, internal_task_id, None)
 
@@ -120,9 +133,23 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("No activity ID.")
         if activity_user_id is None:
             raise Exception("No activity user ID.")
+        self.schedule_activity_analysis(activity_id, activity_user_id, False)
 
-        complete_activity_data = self.retrieve_activity(activity_id)
-        self.schedule_activity_analysis(complete_activity_data, activity_user_id)
+    def retrieve_activity_for_analysis(self, activity_id):
+        """Retrieve method for an activity, specified by the activity ID. Returns everything the analysis needs, which is everything except the live state."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_activity_for_analysis(activity_id)
+
+    def retrieve_activity_analysis_request(self, activity_id):
+        """Returns the number of times the activity has been queued for analysis, or None if the activity does not exist."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_activity_analysis_request(activity_id)
 
     def schedule_personal_records_refresh(self, user_id):
         """Schedules the specified activity for analysis."""
@@ -193,7 +220,7 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("No activity object.")
 
         activity_start_time_sec = activity[Keys.ACTIVITY_START_TIME_KEY]
-        if Keys.ACTIVITY_END_TIME_KEY not in activity:
+        if activity.get(Keys.ACTIVITY_END_TIME_KEY) is None:
             activity_end_time_sec = self.compute_and_store_activity_end_time(activity)
         else:
             activity_end_time_sec = activity[Keys.ACTIVITY_END_TIME_KEY]
@@ -206,23 +233,68 @@ class DataMgr(Importer.ActivityWriter):
 
         # If an activity ID was specified then do any documents already exist with this ID?
         if optional_activity_id is not None:
-            if self.database.retrieve_activity(optional_activity_id) is not None:
+            if self.database.activity_exists(optional_activity_id):
                 return True
 
-        # Look through the user's activities for ones that overlap with the given start time.
-        activities = self.database.retrieve_user_activity_list(user_id, None, None, True)
-        for activity in activities:
+        # We're looking for activities that start within the bounds of another activity.
+        intervals = self.retrieve_activity_intervals_for_user(user_id, start_time_sec, start_time_sec)
+        for _, activity_start_time_sec, activity_end_time_sec in intervals:
+            if start_time_sec >= activity_start_time_sec and start_time_sec < activity_end_time_sec:
+                return True
+        return False
 
-            if Keys.ACTIVITY_START_TIME_KEY in activity:
+    def find_duplicate_activities(self, user_id, start_times_sec):
+        """Batch version of is_duplicate_activity, for checking many imports at once. Returns a list with the ID of the"""
+        """existing activity that each start time falls within, or None if it doesn't fall within any."""
+        if self.database is None:
+            raise Exception("No database.")
+        if user_id is None:
+            raise Exception("Bad parameter.")
+        if start_times_sec is None:
+            raise Exception("Bad parameter.")
+        if len(start_times_sec) == 0:
+            return []
 
-                # Get the activity start and end times.
+        # One query for everything that could overlap the batch, then check each start time in memory.
+        intervals = self.retrieve_activity_intervals_for_user(user_id, min(start_times_sec), max(start_times_sec))
+        index = IntervalIndex.IntervalIndex([(start, end, activity_id) for activity_id, start, end in intervals])
+        return [index.find_containing(start_time_sec) for start_time_sec in start_times_sec]
+
+    def retrieve_activity_intervals_for_user(self, user_id, start_time_sec, end_time_sec):
+        """Returns (activity ID, start time, end time) for each of the user's activities that overlap the time range."""
+        if self.database is None:
+            raise Exception("No database.")
+
+        intervals = []
+        for activity_id, activity_start_time_sec, activity_end_time_sec in self.database.retrieve_activity_intervals_for_user(user_id, start_time_sec, end_time_sec):
+
+            # Activities from before the end time was always stored need to be loaded, once, so it can be computed.
+            if activity_end_time_sec is None:
+                activity = self.database.retrieve_activity(activity_id)
+                if activity is None:
+                    continue
                 activity_start_time_sec, activity_end_time_sec = self.get_activity_start_and_end_times(activity)
+                if activity_end_time_sec <= start_time_sec:
+                    continue
+            intervals.append((activity_id, activity_start_time_sec, activity_end_time_sec))
+        return intervals
 
-                # We're looking for activities that start within the bounds of another activity.
-                if start_time_sec >= activity_start_time_sec and start_time_sec < activity_end_time_sec:
-                    return True
+    def compute_missing_activity_end_times(self, limit):
+        """Computes and stores the end time of activities that were created before end times were always stored."""
+        """Activities for which there's nothing to compute it from are marked, so that they aren't selected again."""
+        """Returns the number of activities that were updated."""
+        if self.database is None:
+            raise Exception("No database.")
 
-        return False
+        num_updated = 0
+        for activity_id in self.database.retrieve_activities_without_end_time_list(limit):
+            activity = self.database.retrieve_activity(activity_id)
+            if activity is not None and Keys.ACTIVITY_START_TIME_KEY in activity:
+                self.compute_and_store_activity_end_time(activity)
+            else:
+                self.database.mark_activity_end_time_unknown(activity_id)
+            num_updated = num_updated + 1
+        return num_updated
 
     def create_activity(self, username, user_id, stream_name, stream_description, activity_type, start_time, desired_activity_id):
         """Inherited from ActivityWriter. Called when we start reading an activity file."""
@@ -392,15 +464,73 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("No database.")
         return self.database.delete_finished_deferred_tasks()
 
-    def create_uploaded_file(self, activity_id, file_data):
-        """Create method for an uploaded activity file."""
+    def get_upload_store(self, store_name):
+        """Returns the store (see UploadStore) in which uploaded files of the given kind are kept."""
+        if store_name == UploadStore.GRIDFS_STORE:
+            if self.database is None:
+                raise Exception("No database.")
+            return UploadStore.GridFsStore(self.database.database)
+        if store_name == UploadStore.FILESYSTEM_STORE:
+            root_dir = os.path.dirname(os.path.abspath(__file__))
+            return UploadStore.FilesystemStore(os.path.join(root_dir, Dirs.UPLOADS_DIR))
+        raise Exception("Unknown upload store.")
+
+    def create_pending_uploaded_file(self, import_task_id, store_name, content_hash):
+        """Create method for an uploaded activity file that is about to be queued for import. Keeps the file in its store until the import"""
+        """finishes, even if an import of the same file fails in the meantime."""
         if self.database is None:
             raise Exception("No database.")
+        if import_task_id is None:
+            raise Exception("No import task ID")
+        if store_name is None:
+            raise Exception("No upload store")
+        if content_hash is None:
+            raise Exception("No content hash")
+        return self.database.create_pending_uploaded_file(import_task_id, store_name, content_hash)
+
+    def update_uploaded_file_activity(self, import_task_id, activity_id, store_name, content_hash):
+        """Records that the activity came from the file the import task was importing."""
+        if self.database is None:
+            raise Exception("No database.")
+        if import_task_id is None:
+            raise Exception("No import task ID")
         if activity_id is None:
             raise Exception("No activity_id")
-        if file_data is None:
-            raise Exception("No file data")
-        return self.database.create_uploaded_file(activity_id, file_data)
+        if store_name is None:
+            raise Exception("No upload store")
+        if content_hash is None:
+            raise Exception("No content hash")
+        return self.database.update_uploaded_file_activity(import_task_id, activity_id, store_name, content_hash)
+
+    def delete_pending_uploaded_file(self, import_task_id, store_name, content_hash):
+        """Removes the import task's reference to its uploaded file, and the file itself if nothing else refers to it."""
+        if self.database is None:
+            raise Exception("No database.")
+        if import_task_id is None:
+            raise Exception("No import task ID")
+        if self.database.delete_pending_uploaded_file(import_task_id):
+            self.delete_unreferenced_upload(store_name, content_hash)
+
+    def delete_unreferenced_upload(self, store_name, content_hash):
+        """Removes an uploaded file from its store, unless an activity was imported, or is waiting to be imported, from it."""
+        if self.database is None:
+            raise Exception("No database.")
+        if self.database.count_uploaded_file_references(content_hash) == 0:
+            self.get_upload_store(store_name).delete(content_hash)
+
+    def delete_uploaded_file(self, activity_id):
+        """Delete method for the file an activity was imported from. The file is kept if another activity was imported from the same file."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("No activity_id")
+
+        upload = self.database.retrieve_uploaded_file(activity_id)
+        if not self.database.delete_uploaded_file(activity_id):
+            return False
+        if upload is not None and Keys.UPLOADED_FILE_STORE_KEY in upload and Keys.UPLOADED_FILE_HASH_KEY in upload:
+            self.delete_unreferenced_upload(upload[Keys.UPLOADED_FILE_STORE_KEY], upload[Keys.UPLOADED_FILE_HASH_KEY])
+        return True
 
     def import_activity_from_file(self, username, user_id, uploaded_file_data, uploaded_file_name, desired_activity_id):
         """Imports the contents of a local file into the database. Desired activity ID is optional."""
@@ -418,10 +548,18 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("No uploaded file name.")
 
         # Check the file size.
-        if len(uploaded_file_data) > self.config.get_import_max_file_size():
+        if UploadStore.decoded_size(uploaded_file_data) > self.config.get_import_max_file_size():
             raise Exception("The file is too large.")
 
-        return self.import_scheduler.add_file_to_queue(username, user_id, uploaded_file_data, uploaded_file_name, desired_activity_id, self)
+        # Decode the file straight into the staging store. The import task only carries the file's hash.
+        if self.config.get_import_staging_store() == UploadStore.GRIDFS_STORE:
+            store_name = UploadStore.GRIDFS_STORE
+        else:
+            store_name = UploadStore.FILESYSTEM_STORE
+        content_hash, _ = self.get_upload_store(store_name).put_chunks(UploadStore.decode_base64_chunks(uploaded_file_data))
+
+        # Files are only imported because the user uploaded them, so the import, and the analysis that follows it, are user initiated.
+        return self.import_scheduler.add_file_to_queue(username, user_id, store_name, content_hash, uploaded_file_name, desired_activity_id, True, self)
 
     def get_user_photos_dir(self, user_id):
         """Calculates the photos dir assigned to the specified user and creates if it does not exist."""
@@ -534,6 +672,55 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("Bad parameter.")
         return self.database.update_activity(device_str, activity_id, locations, sensor_readings_dict, metadata_list_dict)
 
+    def update_live_activity_analysis(self, activity_id, activity_type, locations, sensor_readings_dict):
+        """Adds a batch of live data, which has already been stored, to the activity's running analysis and makes the results the activity summary."""
+        """The running analysis can only be continued if every batch arrives in order, starting with the first one. If it can't be, the summary is"""
+        """cleared instead, and the activity is analyzed from scratch once it's finished."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+
+        live_state, activity_start_time = self.database.retrieve_activity_live_state(activity_id)
+
+        # Nothing to start from, e.g. every location in the batch was too inaccurate to keep. Leave it for a later batch
+        # to start the running analysis, since marking it as invalid now would stop it from ever being started.
+        if live_state is None and not locations:
+            return False
+
+        expected_revision = None
+        if live_state is not None:
+            expected_revision = live_state[Keys.LIVE_STATE_REVISION_KEY]
+        live_analyzer = LiveAnalyzer.LiveAnalyzer(activity_type, live_state)
+
+        # A new running analysis has to start with the activity's first batch, otherwise it would be missing data.
+        if live_state is None:
+            if activity_start_time is None or min(location[0] for location in locations) > activity_start_time * 1000.0 + 1.0:
+                live_analyzer.invalidate()
+
+        live_analyzer.append_batch(locations, sensor_readings_dict)
+        if self.database.update_activity_live_state(activity_id, expected_revision, live_analyzer.state_for_storage(), live_analyzer.summary()):
+            return True
+
+        # Another batch for the same activity was processed at the same time, so neither can be trusted.
+        return self.invalidate_live_activity_analysis(activity_id, activity_type)
+
+    def invalidate_live_activity_analysis(self, activity_id, activity_type):
+        """Stops the activity's running analysis and clears the summary, e.g. because a batch of live data couldn't be stored."""
+        """The activity is analyzed from scratch once it's finished."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+
+        live_state, _ = self.database.retrieve_activity_live_state(activity_id)
+        expected_revision = None
+        if live_state is not None:
+            expected_revision = live_state[Keys.LIVE_STATE_REVISION_KEY]
+        live_analyzer = LiveAnalyzer.LiveAnalyzer(activity_type, live_state)
+        live_analyzer.invalidate()
+        return self.database.update_activity_live_state(activity_id, expected_revision, live_analyzer.state_for_storage(), {})
+
     def is_activity_public(self, activity):
         """Helper function for returning whether or not an activity is publically visible."""
         if Keys.ACTIVITY_VISIBILITY_KEY in activity:
@@ -670,6 +857,14 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("Bad parameter.")
         return self.database.retrieve_activity(activity_id)
 
+    def retrieve_activity_small(self, activity_id):
+        """Retrieve method for an activity, specified by the activity ID. Returns only the metadata, not the location and sensor data."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_activity_small(activity_id)
+
     def delete_activity(self, user_id, activity_id):
         """Delete the activity with the specified object ID."""
         if self.database is None:
@@ -679,6 +874,9 @@ class DataMgr(Importer.ActivityWriter):
         if activity_id is None:
             raise Exception("Bad parameter.")
 
+        # Needed to find the activity's contribution to the user's power and pace curves.
+        activity = self.database.retrieve_activity_small(activity_id)
+
         # Delete the activity as well as the cache of the PRs performed during that activity.
         result = self.database.delete_activity(activity_id)
 
@@ -687,8 +885,16 @@ class DataMgr(Importer.ActivityWriter):
             # Delete the activity bests (there might not be any), so don't bother checking the return code.
             self.database.delete_activity_best_for_user(user_id, activity_id)
 
+            # Remove the activity from the user's power and pace curves.
+            activity_type = None
+            activity_time = None
+            if activity is not None:
+                activity_type = activity.get(Keys.ACTIVITY_TYPE_KEY)
+                activity_time = activity.get(Keys.ACTIVITY_START_TIME_KEY)
+            DurationCurves.update_for_deleted_activity(self.database, user_id, activity_id, activity_type, activity_time)
+
             # Delete the uploaded file (if any).
-            self.database.delete_uploaded_file(activity_id)
+            self.delete_uploaded_file(activity_id)
 
             # Recreate the user's all-time PR list as the previous one could have contained data from the now deleted activity.
             result = self.schedule_personal_records_refresh(user_id)
@@ -705,6 +911,9 @@ class DataMgr(Importer.ActivityWriter):
         if num_seconds is None:
             raise Exception("Bad parameter.")
 
+        # The running analysis of a live activity doesn't apply to the trimmed data.
+        activity.pop(Keys.ACTIVITY_LIVE_STATE_KEY, None)
+
         # Make sure the ending time has been computed, compute it if it has not.
         trim_before_ms = 0
         trim_after_ms = self.compute_activity_end_time_ms(activity)
@@ -802,6 +1011,34 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("Bad parameter.")
         return self.database.retrieve_activity_locations(activity_id)
 
+    def retrieve_activity_stream(self, activity_id, stream_name, start_time, end_time):
+        """Returns the portion of an activity stream (locations, Heart Rate, etc.) that falls within the time range. Either end of the range may be None."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None or len(activity_id) == 0:
+            raise Exception("Bad parameter.")
+        if stream_name is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_activity_stream(activity_id, stream_name, start_time, end_time)
+
+    def retrieve_activity_stream_data(self, activity_id, stream_name, start_time, end_time):
+        """Same as retrieve_activity_stream, but returns a StreamCodec.StreamData object (i.e., arrays) instead of a list of dictionaries."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None or len(activity_id) == 0:
+            raise Exception("Bad parameter.")
+        if stream_name is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_activity_stream_data(activity_id, stream_name, start_time, end_time)
+
+    def compact_activity_streams(self, activity_id):
+        """Converts the activity's stream data to the packed encoding, if enabled."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None or len(activity_id) == 0:
+            raise Exception("Bad parameter.")
+        return self.database.compact_activity_streams(activity_id)
+
     def delete_activity_sensor_readings(self, key, activity_id):
         """Returns all the sensor data for the specified sensor for the given activity."""
         if self.database is None:
@@ -880,6 +1117,32 @@ class DataMgr(Importer.ActivityWriter):
             return activity[Keys.ACTIVITY_SUMMARY_KEY]
         return None
 
+    def retrieve_activity_hash(self, activity_id, summary_data, hash_format):
+        """Returns the activity's hash in the requested format (see ActivityHasher), or None if it hasn't been computed. Hashes in the original"""
+        """SHA-512 format are computed from the activity the first time they're asked for, then stored in the summary for next time."""
+        if self.database is None:
+            raise Exception("No database.")
+        if activity_id is None or len(activity_id) == 0:
+            raise Exception("Bad parameter.")
+
+        if summary_data is None or Keys.ACTIVITY_HASH_KEY not in summary_data:
+            return None
+        activity_hash = summary_data[Keys.ACTIVITY_HASH_KEY]
+        if ActivityHasher.hash_format(activity_hash) == hash_format:
+            return activity_hash
+        if hash_format != ActivityHasher.HASH_FORMAT_SHA512_TEXT:
+            return None
+        if Keys.ACTIVITY_LEGACY_HASH_KEY in summary_data:
+            return summary_data[Keys.ACTIVITY_LEGACY_HASH_KEY]
+
+        activity = self.retrieve_activity(activity_id)
+        if activity is None:
+            return None
+        legacy_hash = ActivityHasher.ActivityHasher(activity).hash(ActivityHasher.HASH_FORMAT_SHA512_TEXT)
+        if legacy_hash is not None:
+            self.database.update_activity_legacy_hash(activity_id, activity_hash, legacy_hash)
+        return legacy_hash
+
     def delete_activity_summary(self, activity_id):
         """Delete method for activity summary data. Summary data is data computed from the raw data."""
         if self.database is None:
@@ -1105,11 +1368,13 @@ class DataMgr(Importer.ActivityWriter):
 
         # Cleanup the activity summary, removing any items that are no longer valid.
         old_activity_bests = {}
+        valid_activity_bests = {}
         for old_activity_id in all_activity_bests:
             if self.activity_exists(old_activity_id):
 
                 # Activity still exists, add its data to the summary.
                 old_activity_bests = all_activity_bests[old_activity_id]
+                valid_activity_bests[old_activity_id] = old_activity_bests
                 if Keys.ACTIVITY_TYPE_KEY in old_activity_bests and Keys.ACTIVITY_START_TIME_KEY in old_activity_bests:
                     old_activity_type = old_activity_bests[Keys.ACTIVITY_TYPE_KEY]
                     old_activity_time = old_activity_bests[Keys.ACTIVITY_START_TIME_KEY]
@@ -1119,6 +1384,9 @@ class DataMgr(Importer.ActivityWriter):
                 # Activity no longer exists, remove it's summary from the database.
                 self.database.delete_activity_best_for_user(user_id, old_activity_id)
 
+        # The power and pace curves are built from the same data, so rebuild those too.
+        DurationCurves.rebuild_all(self.database, user_id, valid_activity_bests)
+
         # Look for activities that haven't been analyzed at all.
         now = time.time()
         _ = self.analyze_unanalyzed_activities(user_id, now - SIX_MONTHS, now)
@@ -1196,13 +1464,53 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("No database.")
         if user_id is None:
             raise Exception("Bad parameter.")
+        self.database.delete_duration_curves_for_user(user_id)
         return self.database.delete_all_user_personal_records(user_id)
 
+    def update_duration_curves(self, user_id, activity_id, activity_type, activity_time, summary_data):
+        """Update method for the user's power and pace curves. Folds in the curves from a newly analyzed activity."""
+        if self.database is None:
+            raise Exception("No database.")
+        if user_id is None:
+            raise Exception("Bad parameter.")
+        if activity_id is None:
+            raise Exception("Bad parameter.")
+        if activity_type is None:
+            raise Exception("Bad parameter.")
+        if activity_time is None:
+            raise Exception("Bad parameter.")
+        if summary_data is None:
+            raise Exception("Bad parameter.")
+        return DurationCurves.update_for_activity(self.database, user_id, activity_id, activity_type, activity_time, summary_data)
+
+    def retrieve_duration_curve(self, user_id, curve_name, activity_types, start_time, end_time):
+        """Retrieve method for one of the user's curves (Keys.POWER_CURVE or Keys.PACE_CURVE), i.e., the best value for each duration"""
+        """across the activities of the given types that started within [start_time, end_time). Returns a list of [seconds, value]."""
+        if self.database is None:
+            raise Exception("No database.")
+        if user_id is None:
+            raise Exception("Bad parameter.")
+        if curve_name not in DurationCurves.CURVE_NAMES:
+            raise Exception("Bad parameter.")
+        if activity_types is None:
+            raise Exception("Bad parameter.")
+        if start_time is None or end_time is None:
+            raise Exception("Bad parameter.")
+        return DurationCurves.retrieve_curve(self.database, user_id, curve_name, activity_types, start_time, end_time)
+
     def retrieve_unanalyzed_activity_list(self, limit):
         if self.database is None:
             raise Exception("No database.")
         return self.database.retrieve_unanalyzed_activity_list(limit)
 
+    def retrieve_stale_analysis_activity_list(self, analyzer_version, limit):
+        """Returns the IDs of activities that were analyzed by a different version of the analysis code."""
+        if self.database is None:
+            raise Exception("No database.")
+        if analyzer_version is None:
+            raise Exception("Bad parameter.")
+        return self.database.retrieve_stale_analysis_activity_list(analyzer_version, limit)
+
     def create_workout(self, user_id, workout_obj):
         """Create method for a workout."""
         if self.database is None:
@@ -1493,13 +1801,13 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("Bad parameter.")
         return self.database.delete_service_record(user_id, gear_id, service_record_id)
 
-    def generate_workout_plan_for_user(self, user_id):
-        """Generates/updates a workout plan for the user with the specified ID."""
+    def generate_workout_plan_for_user(self, user_id, user_initiated):
+        """Generates/updates a workout plan for the user with the specified ID. Set user_initiated when the user asked for it."""
         if self.analysis_scheduler is None:
             raise Exception("No scheduler.")
         if user_id is None:
             raise Exception("Bad parameter.")
-        self.analysis_scheduler.add_user_to_workout_plan_queue(user_id, self)
+        self.analysis_scheduler.add_user_to_workout_plan_queue(user_id, user_initiated, self)
 
     def generate_workout_plan_from_inputs(self, user_id, inputs):
         """Generates a workout plan from the specified inputs."""
@@ -1531,38 +1839,17 @@ class DataMgr(Importer.ActivityWriter):
             raise Exception("Bad parameter.")
         return self.database.delete_api_key(user_id, api_key)
 
-    def check_api_rate(self, api_key, max_rate):
-        """Verifies that the API key is not being overused."""
-        """Returns TRUE if it is fine to process the request, FALSE otherwise."""
-        global g_api_key_rate_lock
-        global g_api_key_rates
-        global g_last_api_reset
-
+    def check_api_rate(self, api_key, max_rate, endpoint):
+        """Verifies that the API key is not being overused, counting this request against the key's limits."""
+        """Returns a RateLimiter.RateLimitResult, the request should only be processed if its allowed flag is set."""
         if self.database is None:
             raise Exception("No database.")
         if api_key is None:
             raise Exception("Bad parameter.")
+        if max_rate is None:
+            raise Exception("Bad parameter.")
 
-        result = True
-        g_api_key_rate_lock.acquire()
-
-        # Once a day we should reset the countesr. This algorithm is overly simplistic and
-        # could almost certainly be improved but is good enough for now.
-        now = time.time()
-        if now - g_last_api_reset > Units.SECS_PER_DAY:
-            g_api_key_rates = {}
-            g_last_api_reset = now
-
-        # Check and increment the request count.
-        try:
-            current_rate = g_api_key_rates[api_key]
-            result = current_rate <= max_rate
-            g_api_key_rates[api_key] = current_rate + 1
-        except:
-            g_api_key_rates[api_key] = 1
-        finally:
-            g_api_key_rate_lock.release()
-        return result
+        return self.rate_limiter.check(str(api_key), max_rate, self.api_burst_rate, endpoint)
 
     def list_unsynched_activities(self, user_id, last_sync_date):
         """Returns a list of activity IDs with last modified times greater than the date provided."""
@@ -1672,16 +1959,11 @@ class DataMgr(Importer.ActivityWriter):
         if activity_id is None:
             raise Exception("Bad parameter.")
 
-        if self.map_search is None:
-            self.map_search = MapSearch.MapSearch(self.root_url + '/data/world.geo.json', self.root_url + '/data/us_states.geo.json', self.root_url + '/data/canada.geo.json')
-        if self.map_search is None:
-            raise Exception("Internal error.")
-
         location_description = []
         locations = self.retrieve_activity_locations(activity_id)
         if locations and len(locations) > 0:
             first_loc = locations[0]
-            location_description = self.map_search.search_map(float(first_loc[Keys.LOCATION_LAT_KEY]), float(first_loc[Keys.LOCATION_LON_KEY]))
+            location_description = MapSearch.get_map_search().search_map(float(first_loc[Keys.LOCATION_LAT_KEY]), float(first_loc[Keys.LOCATION_LON_KEY]))
 
         return location_description
 
@@ -1725,8 +2007,9 @@ class DataMgr(Importer.ActivityWriter):
 
         summarizer = Summarizer.Summarizer()
 
-        # Load cached summary data from all previous activities.
-        all_activity_bests = self.database.retrieve_bounded_activity_bests_for_user(user_id, cutoff_time_lower, cutoff_time_higher)
+        # Load cached summary data from all previous activities. Only the sports that are summarized below are needed.
+        activity_types = [ Keys.TYPE_CYCLING_KEY, Keys.TYPE_RUNNING_KEY, Keys.TYPE_POOL_SWIMMING_KEY ]
+        all_activity_bests = self.database.retrieve_bounded_activity_bests_for_user(user_id, cutoff_time_lower, cutoff_time_higher, activity_types)
         for activity_id in all_activity_bests:
             activity_bests = all_activity_bests[activity_id]
             summarizer.add_activity_data(activity_id, activity_bests[Keys.ACTIVITY_TYPE_KEY], activity_bests[Keys.ACTIVITY_START_TIME_KEY], activity_bests)
@@ -1830,18 +2113,16 @@ class DataMgr(Importer.ActivityWriter):
         return sum(intensities)
 
     def compute_run_training_paces(self, user_id, running_bests):
-        """Computes the user's run training paces by searching the list of running 'bests' for the fastest 5K."""
-        run_paces = {}
+        """Computes the user's run training paces from their pace-duration curve for the last four weeks. Activities analyzed before the"""
+        """curves existed don't contribute to them, so the fastest 5K from the list of running 'bests' is treated as one more effort on the curve."""
+        now = time.time()
+        pace_curve = self.retrieve_duration_curve(user_id, Keys.PACE_CURVE, Keys.RUNNING_ACTIVITIES, now - FOUR_WEEKS, now)
         if Keys.BEST_5K in running_bests:
-            best_time_secs = running_bests[Keys.BEST_5K]
-            calc = TrainingPaceCalculator.TrainingPaceCalculator()
-            run_paces = calc.calc_from_race_distance_in_meters(5000, best_time_secs[0])
-        return run_paces
-
-    def compute_power_zone_distribution(self, ftp, powers):
-        """Takes the list of power readings and determines how many belong in each power zone, based on the user's FTP."""
-        calc = FtpCalculator.FtpCalculator()
-        return calc.compute_power_zone_distribution(ftp, powers)
+            best_time_secs = running_bests[Keys.BEST_5K][0]
+            if best_time_secs > 0:
+                pace_curve.append([best_time_secs, 5000.0 / best_time_secs])
+        calc = TrainingPaceCalculator.TrainingPaceCalculator()
+        return calc.calc_from_pace_curve(pace_curve)
 
     def compute_heart_rate_zones(self, max_hr, resting_hr, age_in_years):
         """Returns an array containing the maximum heart rate for each training zone."""
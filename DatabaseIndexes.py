@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Declares the indexes needed by the application database's queries, and the query shapes used to verify that they are being used."""
+
+import hashlib
+import pymongo
+import Keys
+
+ASC = pymongo.ASCENDING
+DESC = pymongo.DESCENDING
+
+# Indexes, by collection. Each entry is (index name, key pattern, index options).
+# To change an index, change its entry here. The old version is dropped and the new one built by the first process to connect to the database
+# after the change (see indexes_version).
+INDEXES = {}
+INDEXES['users'] = [
+    ('username', [ (Keys.USERNAME_KEY, ASC) ], {}),
+    ('devices', [ (Keys.DEVICES_KEY, ASC) ], {}),
+    ('friends', [ (Keys.FRIENDS_KEY, ASC) ], {}),
+    ('friend_requests', [ (Keys.FRIEND_REQUESTS_KEY, ASC) ], {}),
+    ('api_keys', [ (Keys.API_KEYS + "." + Keys.API_KEY, ASC) ], {}),
+]
+INDEXES['activities'] = [
+    ('activity_id', [ (Keys.ACTIVITY_ID_KEY, ASC) ], {}),
+    ('user_id_start_time_end_time', [ (Keys.ACTIVITY_USER_ID_KEY, ASC), (Keys.ACTIVITY_START_TIME_KEY, ASC), (Keys.ACTIVITY_END_TIME_KEY, ASC) ], {}),
+    ('device_start_time', [ (Keys.ACTIVITY_DEVICE_STR_KEY, ASC), (Keys.ACTIVITY_START_TIME_KEY, ASC) ], {}),
+    ('last_updated', [ (Keys.ACTIVITY_LAST_UPDATED_KEY, ASC) ], {}),
+    ('end_time_id', [ (Keys.ACTIVITY_END_TIME_KEY, ASC), (Keys.DATABASE_ID_KEY, ASC) ], {}),
+    ('summary_hash', [ (Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY, ASC) ], {}),
+    ('summary_analyzer_version', [ (Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_ANALYZER_VERSION_KEY, ASC) ], {}),
+]
+INDEXES['activity_streams'] = [
+    ('activity_id_stream_chunk', [ (Keys.ACTIVITY_ID_KEY, ASC), (Keys.STREAM_NAME_KEY, ASC), (Keys.STREAM_CHUNK_START_KEY, ASC) ], { 'unique': True }),
+]
+INDEXES['records'] = [
+    ('user_id', [ (Keys.USER_ID_KEY, ASC) ], {}),
+]
+INDEXES['activity_bests'] = [
+    ('user_id_activity_id', [ (Keys.USER_ID_KEY, ASC), (Keys.ACTIVITY_ID_KEY, ASC) ], { 'unique': True }),
+    ('user_id_activity_type_start_time', [ (Keys.USER_ID_KEY, ASC), (Keys.ACTIVITY_TYPE_KEY, ASC), (Keys.ACTIVITY_START_TIME_KEY, ASC) ], {}),
+]
+INDEXES['duration_curves'] = [
+    ('user_id_curve_activity_type_bucket', [ (Keys.USER_ID_KEY, ASC), (Keys.DURATION_CURVE_KEY, ASC), (Keys.ACTIVITY_TYPE_KEY, ASC), (Keys.DURATION_CURVE_BUCKET_KEY, ASC) ], { 'unique': True }),
+]
+INDEXES['rate_limits'] = [
+    ('key_window_start', [ (Keys.RATE_LIMIT_KEY, ASC), (Keys.RATE_LIMIT_WINDOW_START_KEY, ASC) ], { 'unique': True }),
+    ('expires_at', [ (Keys.RATE_LIMIT_EXPIRES_AT_KEY, ASC) ], { 'expireAfterSeconds': 0 }),
+]
+INDEXES['workouts'] = [
+    ('user_id', [ (Keys.USER_ID_KEY, ASC) ], {}),
+    ('calendar_id', [ (Keys.WORKOUT_PLAN_CALENDAR_ID_KEY, ASC) ], {}),
+    ('last_scheduled_workout_time', [ (Keys.WORKOUT_LAST_SCHEDULED_WORKOUT_TIME_KEY, ASC) ], {}),
+]
+INDEXES['tasks'] = [
+    ('user_id', [ (Keys.USER_ID_KEY, ASC) ], {}),
+]
+INDEXES['uploads'] = [
+    ('activity_id', [ (Keys.ACTIVITY_ID_KEY, ASC) ], {}),
+    ('uploaded_file_hash', [ (Keys.UPLOADED_FILE_HASH_KEY, ASC) ], {}),
+    ('import_task_id', [ (Keys.UPLOADED_FILE_IMPORT_TASK_KEY, ASC) ], {}),
+]
+INDEXES['sessions'] = [
+    ('token', [ (Keys.SESSION_TOKEN_KEY, ASC) ], { 'unique': True }),
+    ('expires_at', [ (Keys.SESSION_EXPIRES_AT_KEY, ASC) ], { 'expireAfterSeconds': 0 }),
+]
+
+# Indexes that are no longer needed, by collection. Dropped, if present, along with the next index update.
+OBSOLETE_INDEXES = {}
+OBSOLETE_INDEXES['activities'] = [ 'user_id_start_time' ]
+
+# The shape of each query issued by AppDatabase, with placeholder values. Each entry is (collection, filter, sort).
+# Keep this in sync with AppDatabase when adding or changing a query.
+QUERY_SHAPES = [
+    ('users', { Keys.USERNAME_KEY: "" }, None),
+    ('users', { Keys.DEVICES_KEY: "" }, None),
+    ('users', { Keys.FRIENDS_KEY: "" }, None),
+    ('users', { Keys.FRIEND_REQUESTS_KEY: "" }, None),
+    ('users', { Keys.API_KEYS + "." + Keys.API_KEY: "" }, None),
+    ('activities', { Keys.ACTIVITY_ID_KEY: "" }, None),
+    ('activities', { Keys.ACTIVITY_ID_KEY: "", Keys.ACTIVITY_DEVICE_STR_KEY: "" }, None),
+    ('activities', { Keys.ACTIVITY_ID_KEY: "", Keys.ACTIVITY_DEVICE_STR_KEY: "", Keys.ACTIVITY_LIVE_LISTS_REVISION_KEY: 0 }, None),
+    ('activities', { Keys.ACTIVITY_ID_KEY: "", Keys.ACTIVITY_LIVE_STATE_KEY: { "$exists": False } }, None),
+    ('activities', { Keys.ACTIVITY_ID_KEY: "", Keys.ACTIVITY_LIVE_STATE_KEY + "." + Keys.LIVE_STATE_REVISION_KEY: 0 }, None),
+    ('activities', { Keys.ACTIVITY_USER_ID_KEY: "" }, None),
+    ('activities', { "$and": [ { Keys.ACTIVITY_USER_ID_KEY: { '$eq': "" } }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': 0 } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': 0 } } ] }, None),
+    ('activities', { Keys.ACTIVITY_DEVICE_STR_KEY: "" }, [ (Keys.DATABASE_ID_KEY, DESC) ]),
+    ('activities', { "$and": [ { Keys.ACTIVITY_DEVICE_STR_KEY: { '$eq': "" } }, { Keys.ACTIVITY_START_TIME_KEY: { '$gt': 0 } }, { Keys.ACTIVITY_START_TIME_KEY: { '$lt': 0 } } ] }, None),
+    ('activities', { Keys.ACTIVITY_LAST_UPDATED_KEY: { '$gt': 0 } }, None),
+    ('activities', { Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY: { '$exists': 0 } }, None),
+    ('activities', { Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_ANALYZER_VERSION_KEY: { '$ne': 0 }, Keys.ACTIVITY_SUMMARY_KEY + "." + Keys.ACTIVITY_HASH_KEY: { '$exists': 1 } }, None),
+    ('activities', { Keys.ACTIVITY_USER_ID_KEY: "", Keys.ACTIVITY_START_TIME_KEY: { '$lte': 0 }, "$or": [ { Keys.ACTIVITY_END_TIME_KEY: { '$gt': 0 } }, { Keys.ACTIVITY_END_TIME_KEY: None } ] }, None),
+    ('activities', { Keys.ACTIVITY_END_TIME_KEY: { '$exists': 0 } }, [ (Keys.DATABASE_ID_KEY, ASC) ]),
+    ('activity_streams', { Keys.ACTIVITY_ID_KEY: "" }, [ (Keys.STREAM_NAME_KEY, ASC), (Keys.STREAM_CHUNK_START_KEY, ASC) ]),
+    ('activity_streams', { Keys.ACTIVITY_ID_KEY: "", Keys.STREAM_NAME_KEY: "", Keys.STREAM_CHUNK_END_KEY: { "$gte": 0 }, Keys.STREAM_CHUNK_START_KEY: { "$lte": 0 } }, [ (Keys.STREAM_CHUNK_START_KEY, ASC) ]),
+    ('records', { Keys.USER_ID_KEY: "" }, None),
+    ('activity_bests', { Keys.USER_ID_KEY: "", Keys.ACTIVITY_ID_KEY: "" }, None),
+    ('activity_bests', { Keys.USER_ID_KEY: "" }, None),
+    ('activity_bests', { Keys.USER_ID_KEY: "", Keys.ACTIVITY_START_TIME_KEY: { "$gte": 0, "$lt": 0 } }, None),
+    ('activity_bests', { Keys.USER_ID_KEY: "", Keys.ACTIVITY_START_TIME_KEY: { "$gte": 0, "$lt": 0 }, Keys.ACTIVITY_TYPE_KEY: { "$in": [] } }, None),
+    ('duration_curves', { Keys.USER_ID_KEY: "", Keys.DURATION_CURVE_KEY: "", Keys.ACTIVITY_TYPE_KEY: "", Keys.DURATION_CURVE_BUCKET_KEY: 0 }, None),
+    ('duration_curves', { Keys.USER_ID_KEY: "", Keys.DURATION_CURVE_KEY: "", Keys.ACTIVITY_TYPE_KEY: { "$in": [] }, Keys.DURATION_CURVE_BUCKET_KEY: { "$gte": 0, "$lt": 0 } }, None),
+    ('duration_curves', { Keys.USER_ID_KEY: "" }, None),
+    ('duration_curves', { Keys.USER_ID_KEY: "", Keys.DURATION_CURVE_ACTIVITIES_KEY: "" }, None),
+    ('rate_limits', { Keys.RATE_LIMIT_KEY: "", Keys.RATE_LIMIT_WINDOW_START_KEY: 0 }, None),
+    ('workouts', { Keys.USER_ID_KEY: "" }, None),
+    ('workouts', { Keys.WORKOUT_PLAN_CALENDAR_ID_KEY: "" }, None),
+    ('workouts', { Keys.WORKOUT_LAST_SCHEDULED_WORKOUT_TIME_KEY: { "$lt": 0 } }, None),
+    ('tasks', { Keys.USER_ID_KEY: "" }, None),
+    ('uploads', { Keys.ACTIVITY_ID_KEY: "" }, None),
+    ('uploads', { Keys.UPLOADED_FILE_HASH_KEY: "" }, None),
+    ('uploads', { Keys.UPLOADED_FILE_IMPORT_TASK_KEY: "" }, None),
+    ('sessions', { Keys.SESSION_TOKEN_KEY: "" }, None),
+]
+
+def normalize_key_pattern(key_pattern):
+    """index_information() may report directions as floats, so normalize before comparing."""
+    return [(field, int(direction)) for field, direction in key_pattern]
+
+def index_matches(existing, key_pattern, options):
+    """Returns True if an existing index (from index_information()) is the same as the declared one."""
+    if normalize_key_pattern(existing['key']) != normalize_key_pattern(key_pattern):
+        return False
+    for option in options:
+        if option not in existing or existing[option] != options[option]:
+            return False
+    return True
+
+def indexes_version():
+    """Returns a fingerprint of the declared indexes. The database records the version it was last updated to, so the indexes"""
+    """are only checked once per change rather than every time a process connects."""
+    declaration = repr(sorted(INDEXES.items())) + repr(sorted(OBSOLETE_INDEXES.items()))
+    return hashlib.sha256(declaration.encode('utf-8')).hexdigest()
+
+def ensure_indexes(database, log_func):
+    """Creates any missing indexes. Indexes that are declared, but exist with different options or under a different name, are rebuilt."""
+    """Indexes that already match are left alone. Returns False if any index could not be updated, the failures are logged."""
+    success = True
+
+    for collection_name in OBSOLETE_INDEXES:
+        collection = database[collection_name]
+        for name in OBSOLETE_INDEXES[collection_name]:
+            try:
+                if name in collection.index_information():
+                    log_func("Dropping obsolete index " + collection_name + "." + name + ".")
+                    collection.drop_index(name)
+            except pymongo.errors.OperationFailure as e:
+                log_func("Could not drop index " + collection_name + "." + name + ": " + str(e))
+                success = False
+
+    for collection_name in INDEXES:
+        collection = database[collection_name]
+        try:
+            existing_indexes = collection.index_information()
+        except pymongo.errors.OperationFailure as e:
+            log_func("Could not list the indexes of " + collection_name + ": " + str(e))
+            success = False
+            continue
+
+        for name, key_pattern, options in INDEXES[collection_name]:
+
+            # Already up to date?
+            if name in existing_indexes and index_matches(existing_indexes[name], key_pattern, options):
+                continue
+
+            try:
+                # Drop anything that conflicts with the declared index, i.e. an old version of it, or the same keys under another name.
+                for existing_name in list(existing_indexes.keys()):
+                    existing = existing_indexes[existing_name]
+                    if existing_name == name or normalize_key_pattern(existing['key']) == normalize_key_pattern(key_pattern):
+                        log_func("Rebuilding index " + collection_name + "." + existing_name + " as " + name + ".")
+                        collection.drop_index(existing_name)
+                        existing_indexes.pop(existing_name)
+
+                collection.create_index(key_pattern, name=name, background=True, **options)
+            except pymongo.errors.OperationFailure as e:
+                # E.g. another process is building the same index, or a unique index can't be built because of duplicates.
+                log_func("Could not create index " + collection_name + "." + name + ": " + str(e))
+                success = False
+
+    return success
+
+def plan_stages(plan):
+    """Returns the names of all the stages in a query plan."""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in plan:
+            if key in [ 'inputStage', 'queryPlan' ]:
+                stages.extend(plan_stages(plan[key]))
+            elif key == 'inputStages':
+                for input_stage in plan[key]:
+                    stages.extend(plan_stages(input_stage))
+    return stages
+
+def verify_query_plans(database):
+    """Runs explain() on each of the query shapes. Returns a list of (collection name, filter) for each one that would scan the entire collection."""
+    collection_scans = []
+    for collection_name, query, sort in QUERY_SHAPES:
+        cursor = database[collection_name].find(query)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        explanation = cursor.explain()
+        winning_plan = explanation['queryPlanner']['winningPlan']
+        if 'COLLSCAN' in plan_stages(winning_plan):
+            collection_scans.append((collection_name, query))
+    return collection_scans
@@ -30,3 +30,4 @@ JS_DIR = 'js'
 IMAGES_DIR = 'images'
 MEDIA_DIR = 'media'
 PHOTOS_DIR = 'photos'
+UPLOADS_DIR = 'uploads'
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Power-duration and pace-duration curves that span many activities, i.e., the user's best effort for each duration."""
+"""The curves are stored in weekly time buckets, by activity type, and are updated as activities are analyzed and deleted, so"""
+"""the curve for any date range can be assembled without looking at every activity in the range."""
+
+import Keys
+import MeanMaximal
+
+BUCKET_SECS = 7 * 86400 # Curves are stored one document per week, per activity type
+CURVE_NAMES = [ Keys.POWER_CURVE, Keys.PACE_CURVE ] # Summary keys of the per-activity curves that are aggregated
+CURVE_TYPES = { "power": Keys.POWER_CURVE, "pace": Keys.PACE_CURVE } # Names by which the API refers to the curves
+DEFAULT_ACTIVITY_TYPES = { Keys.POWER_CURVE: Keys.CYCLING_ACTIVITIES, Keys.PACE_CURVE: Keys.RUNNING_ACTIVITIES }
+MAX_REBUILD_ATTEMPTS = 5 # Times to retry a bucket rebuild that keeps losing the race with activities being merged into it
+
+def bucket_start(time_secs):
+    """Returns the start time of the bucket that contains the given time."""
+    return int(time_secs // BUCKET_SECS) * BUCKET_SECS
+
+def points_from_curve(curve):
+    """Converts an activity's curve, a list of [seconds, value], to the stored form, a dictionary keyed by the duration as a string."""
+    """Only the grid durations are kept, so the curves from different activities line up."""
+    points = {}
+    for duration, value in curve:
+        if MeanMaximal.is_grid_duration(duration):
+            points[str(duration)] = value
+    return points
+
+def merge_points(envelope, points):
+    """Folds points, in the stored form, into the envelope, a dictionary of the best value for each duration."""
+    for duration_str, value in points.items():
+        duration = int(duration_str)
+        if duration not in envelope or value > envelope[duration]:
+            envelope[duration] = value
+
+def envelope_to_curve(envelope):
+    """Converts an envelope to a list of [seconds, value], sorted by duration."""
+    return [[duration, envelope[duration]] for duration in sorted(envelope)]
+
+def envelope_from_activity_bests(curve_name, all_activity_bests, envelope):
+    """Folds the named curve from each activity's bests (as returned by retrieve_bounded_activity_bests_for_user) into the envelope."""
+    """Returns the IDs of the activities that had the curve."""
+    activity_ids = []
+    for activity_id, activity_bests in all_activity_bests.items():
+        if curve_name in activity_bests:
+            merge_points(envelope, points_from_curve(activity_bests[curve_name]))
+            activity_ids.append(activity_id)
+    return activity_ids
+
+def retrieve_curve(database, user_id, curve_name, activity_types, start_time, end_time):
+    """Returns the user's curve for the activities of the given types that started within [start_time, end_time), as a list of [seconds, value]."""
+    """Whole weeks come from the stored buckets, the partial weeks at either end come from the per-activity bests."""
+    envelope = {}
+    first_bucket = bucket_start(start_time)
+    if first_bucket < start_time:
+        first_bucket = first_bucket + BUCKET_SECS
+    end_bucket = bucket_start(end_time)
+
+    if first_bucket < end_bucket:
+        for points in database.retrieve_duration_curve_buckets(user_id, curve_name, activity_types, first_bucket, end_bucket):
+            merge_points(envelope, points)
+        partial_ranges = [ (start_time, first_bucket), (end_bucket, end_time) ]
+    else:
+        partial_ranges = [ (start_time, end_time) ]
+
+    for range_start, range_end in partial_ranges:
+        if range_start < range_end:
+            all_activity_bests = database.retrieve_bounded_activity_bests_for_user(user_id, range_start, range_end, activity_types)
+            envelope_from_activity_bests(curve_name, all_activity_bests, envelope)
+    return envelope_to_curve(envelope)
+
+def rebuild_bucket(database, user_id, curve_name, activity_type, bucket):
+    """Recomputes one bucket from the per-activity bests. Needed when an activity's values may have gone down, i.e., when it is deleted or reanalyzed."""
+    """The rebuilt bucket is only written if nothing was merged into it in the meantime, otherwise the rebuild starts over, so that it can't"""
+    """undo a merge."""
+    for _ in range(MAX_REBUILD_ATTEMPTS):
+        revision = database.retrieve_duration_curve_bucket_revision(user_id, curve_name, activity_type, bucket)
+        if revision is None:
+            return False
+        envelope = {}
+        all_activity_bests = database.retrieve_bounded_activity_bests_for_user(user_id, bucket, bucket + BUCKET_SECS, [activity_type])
+        activity_ids = envelope_from_activity_bests(curve_name, all_activity_bests, envelope)
+        points = dict((str(duration), value) for duration, value in envelope.items())
+        if database.replace_duration_curve_bucket(user_id, curve_name, activity_type, bucket, activity_ids, points, revision):
+            return True
+    return False
+
+def update_for_activity(database, user_id, activity_id, activity_type, activity_time, summary_data):
+    """Folds a newly analyzed activity's curves into the user's curves. Assumes the activity's bests have already been stored."""
+    result = True
+    bucket = bucket_start(activity_time)
+    merged_buckets = []
+    for curve_name in CURVE_NAMES:
+        if curve_name not in summary_data:
+            continue
+        points = points_from_curve(summary_data[curve_name])
+        previous_activity_ids = database.merge_duration_curve_bucket(user_id, curve_name, activity_type, bucket, activity_id, points)
+        if previous_activity_ids is None:
+            result = False
+            continue
+        merged_buckets.append((curve_name, activity_type, bucket))
+
+        # The activity was analyzed before, and its old values may be the ones that were kept.
+        if str(activity_id).lower() in previous_activity_ids:
+            result = rebuild_bucket(database, user_id, curve_name, activity_type, bucket) and result
+
+    # If the activity's type or start time changed since it was last analyzed, or it no longer has one of the curves, then it's
+    # still part of buckets that it no longer belongs in.
+    result = remove_activity(database, user_id, activity_id, merged_buckets) and result
+    return result
+
+def remove_activity(database, user_id, activity_id, buckets_to_keep=()):
+    """Rebuilds the buckets the activity has been folded into, other than buckets_to_keep, so that they no longer include it."""
+    """Assumes the activity's bests have already been updated or deleted."""
+    bucket_keys = database.retrieve_duration_curve_buckets_for_activity(user_id, activity_id)
+    if bucket_keys is None:
+        return False
+    result = True
+    for curve_name, activity_type, bucket in bucket_keys:
+        if (curve_name, activity_type, bucket) not in buckets_to_keep:
+            result = rebuild_bucket(database, user_id, curve_name, activity_type, bucket) and result
+    return result
+
+def update_for_deleted_activity(database, user_id, activity_id, activity_type, activity_time):
+    """Removes a deleted activity from the user's curves. Assumes the activity's bests have already been deleted."""
+    result = remove_activity(database, user_id, activity_id)
+    if activity_type is not None and activity_time is not None:
+        bucket = bucket_start(activity_time)
+        for curve_name in CURVE_NAMES:
+            result = rebuild_bucket(database, user_id, curve_name, activity_type, bucket) and result
+    return result
+
+def rebuild_all(database, user_id, all_activity_bests):
+    """Recomputes all of the user's curves from the per-activity bests (as returned by retrieve_activity_bests_for_user)."""
+    buckets = {}
+    for activity_id, activity_bests in all_activity_bests.items():
+        if Keys.ACTIVITY_TYPE_KEY not in activity_bests or Keys.ACTIVITY_START_TIME_KEY not in activity_bests:
+            continue
+        for curve_name in CURVE_NAMES:
+            if curve_name in activity_bests:
+                bucket_key = (curve_name, activity_bests[Keys.ACTIVITY_TYPE_KEY], bucket_start(activity_bests[Keys.ACTIVITY_START_TIME_KEY]))
+                if bucket_key not in buckets:
+                    buckets[bucket_key] = ({}, [])
+                envelope, activity_ids = buckets[bucket_key]
+                merge_points(envelope, points_from_curve(activity_bests[curve_name]))
+                activity_ids.append(activity_id)
+
+    result = database.delete_duration_curves_for_user(user_id)
+    for (curve_name, activity_type, bucket), (envelope, activity_ids) in buckets.items():
+        points = dict((str(duration), value) for duration, value in envelope.items())
+        result = database.replace_duration_curve_bucket(user_id, curve_name, activity_type, bucket, activity_ids, points) and result
+    return result
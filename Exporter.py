@@ -29,6 +29,7 @@ import sys
 
 import Keys
 import GpxWriter
+import StreamCodec
 import TcxWriter
 
 # Locate and load the distance module.
@@ -44,14 +45,15 @@ class Exporter(object):
         super(Exporter, self).__init__()
 
     def nearest_sensor_reading(self, time_ms, current_reading, sensor_iter):
+        """Readings are (time, value) tuples, as produced by StreamCodec.time_value_pairs."""
         try:
             if current_reading is None:
                 current_reading = next(sensor_iter)
             else:
-                sensor_time = float(list(current_reading.keys())[0])
+                sensor_time = current_reading[0]
                 while sensor_time < time_ms:
                     current_reading = next(sensor_iter)
-                    sensor_time = float(list(current_reading.keys())[0])
+                    sensor_time = current_reading[0]
         except StopIteration:
             return None
         return current_reading
@@ -93,10 +95,10 @@ class Exporter(object):
 
         accel_iter = iter(accel_readings)
         location_iter = iter(locations)
-        cadence_iter = iter(cadence_readings)
-        hr_iter = iter(hr_readings)
-        temp_iter = iter(temp_readings)
-        power_iter = iter(power_readings)
+        cadence_iter = iter(StreamCodec.time_value_pairs(cadence_readings))
+        hr_iter = iter(StreamCodec.time_value_pairs(hr_readings))
+        temp_iter = iter(StreamCodec.time_value_pairs(temp_readings))
+        power_iter = iter(StreamCodec.time_value_pairs(power_readings))
 
         nearest_accel = None
         nearest_loc = None
@@ -137,16 +139,16 @@ class Exporter(object):
                 else:
                     buf += ",,,"
                 if nearest_cadence:
-                    buf += str(nearest_cadence)
+                    buf += str(nearest_cadence[1])
                 buf += ","
                 if nearest_hr:
-                    buf += str(nearest_hr)
+                    buf += str(nearest_hr[1])
                 buf += ","
                 if nearest_temp:
-                    buf += str(nearest_temp)
+                    buf += str(nearest_temp[1])
                 buf += ","
                 if nearest_power:
-                    buf += str(nearest_power)
+                    buf += str(nearest_power[1])
                 buf += ","
                 if nearest_accel:
                     buf += str(nearest_accel[Keys.APP_AXIS_NAME_X])
@@ -186,10 +188,10 @@ class Exporter(object):
         if len(locations) == 0:
             raise Exception("No locations for this activity.")
 
-        cadence_iter = iter(cadence_readings)
-        hr_iter = iter(hr_readings)
-        temp_iter = iter(temp_readings)
-        power_iter = iter(power_readings)
+        cadence_iter = iter(StreamCodec.time_value_pairs(cadence_readings))
+        hr_iter = iter(StreamCodec.time_value_pairs(hr_readings))
+        temp_iter = iter(StreamCodec.time_value_pairs(temp_readings))
+        power_iter = iter(StreamCodec.time_value_pairs(power_readings))
 
         nearest_cadence = None
         nearest_hr = None
@@ -231,9 +233,9 @@ class Exporter(object):
                     writer.start_trackpoint_extensions()
 
                     if nearest_cadence is not None:
-                        writer.store_cadence_rpm(list(nearest_cadence.values())[0])
+                        writer.store_cadence_rpm(nearest_cadence[1])
                     if nearest_hr is not None:
-                        writer.store_heart_rate_bpm(list(nearest_hr.values())[0])
+                        writer.store_heart_rate_bpm(nearest_hr[1])
 
                     writer.end_trackpoint_extensions()
                     writer.end_extensions()
@@ -273,10 +275,10 @@ class Exporter(object):
         if len(locations) == 0:
             raise Exception("No locations for this activity.")
 
-        cadence_iter = iter(cadence_readings)
-        hr_iter = iter(hr_readings)
-        temp_iter = iter(temp_readings)
-        power_iter = iter(power_readings)
+        cadence_iter = iter(StreamCodec.time_value_pairs(cadence_readings))
+        hr_iter = iter(StreamCodec.time_value_pairs(hr_readings))
+        temp_iter = iter(StreamCodec.time_value_pairs(temp_readings))
+        power_iter = iter(StreamCodec.time_value_pairs(power_readings))
 
         nearest_cadence = None
         nearest_hr = None
@@ -341,16 +343,16 @@ class Exporter(object):
                         writer.store_distance_meters(meters_traveled)
 
                     if nearest_cadence is not None:
-                        writer.store_cadence_rpm(list(nearest_cadence.values())[0])
+                        writer.store_cadence_rpm(nearest_cadence[1])
                     if nearest_hr is not None:
-                        writer.store_heart_rate_bpm(list(nearest_hr.values())[0])
+                        writer.store_heart_rate_bpm(nearest_hr[1])
 
                     if nearest_temp is not None or nearest_power is not None:
                         writer.start_trackpoint_extensions()
                         if nearest_temp is not None:
                             pass
                         if nearest_power is not None:
-                            writer.store_power_in_watts(list(nearest_power.values())[0])
+                            writer.store_power_in_watts(nearest_power[1])
                         writer.end_trackpoint_extensions()
 
                     writer.end_trackpoint()
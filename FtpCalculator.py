@@ -26,6 +26,9 @@
 import time
 import Keys
 
+FTP_20_MIN_SECS = 20 * 60
+FTP_1_HOUR_SECS = 60 * 60
+
 class FtpCalculator(object):
     """Estimates functional threshold power and power training zones"""
 
@@ -52,6 +55,11 @@ class FtpCalculator(object):
             return max_1hr
         return max_20min_adjusted
 
+    def estimate_ftp_from_power_curve(self, power_curve):
+        """Estimates FTP from a power-duration curve, a list of [seconds, watts], such as the user's best efforts over the last year."""
+        self.add_power_curve(power_curve)
+        return self.estimate_ftp()
+
     def power_training_zones(self, ftp):
         """Returns the power training zones as a function of FTP."""
         # Zone 1 - Active Recovery - Less than 55% of FTP
@@ -68,24 +76,6 @@ class FtpCalculator(object):
         zones.append(ftp * 1.20)
         return zones
 
-    def compute_power_zone_distribution(self, ftp, powers):
-        """Takes the list of power readings and determines how many belong in each power zone, based on the user's FTP."""
-        zones = self.power_training_zones(ftp)
-        distribution = [0.0] * (len(zones) + 1)
-        for datum in powers:
-            value = float(list(datum.values())[0])
-            index = 0
-            found = False
-            for zone_cutoff in zones:
-                if value <= zone_cutoff:
-                    distribution[index] = distribution[index] + 1
-                    found = True
-                    break
-                index = index + 1
-            if not found:
-                distribution[index] = distribution[index] + 1
-        return distribution
-
     def add_activity_data(self, activity_type, start_time, summary_data):
         """Looks for data that will help us determine the user's FTP. start_time is unix time (in seconds) and is used to compare against the cutoff time."""
 
@@ -101,3 +91,12 @@ class FtpCalculator(object):
             self.best_20min.append(summary_data[Keys.BEST_20_MIN_POWER])
         if Keys.BEST_1_HOUR_POWER in summary_data:
             self.best_1hr.append(summary_data[Keys.BEST_1_HOUR_POWER])
+
+    def add_power_curve(self, power_curve):
+        """Adds the 20 minute and 1 hour efforts from a power-duration curve, a list of [seconds, watts]. The caller is expected to have"""
+        """selected the curve's time range and activity types."""
+        for duration, watts in power_curve:
+            if duration == FTP_20_MIN_SECS:
+                self.best_20min.append(watts)
+            elif duration == FTP_1_HOUR_SECS:
+                self.best_1hr.append(watts)
@@ -43,6 +43,10 @@ class GeoJsonReader(object):
             response = urllib.urlopen(url)
             self.data = json.loads(response.read())
 
+    def parse(self, data):
+        """Loads the GEO JSON data from a string or bytes that have already been read."""
+        self.data = json.loads(data)
+
     def name_to_coordinate_map(self):
         """Returns a dictionary that maps the name of the geo region to it's coordinates, as an array (or array of arrays) of lat/lon."""
         geomap = {}
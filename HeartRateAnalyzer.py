@@ -24,19 +24,30 @@
 """Performs calculations on heart rate data."""
 
 import Keys
+import MeanMaximal
 import SensorAnalyzer
+import TrainingLoad
 import Units
 
 class HeartRateAnalyzer(SensorAnalyzer.SensorAnalyzer):
     """Class for performing calculations on heart rate data."""
 
-    def __init__(self, activity_type):
+    __slots__ = ('user_mgr', 'activity_user_id')
+
+    def __init__(self, activity_type, activity_user_id=None, user_mgr=None):
         SensorAnalyzer.SensorAnalyzer.__init__(self, Keys.APP_HEART_RATE_KEY, Units.get_heart_rate_units_str(), activity_type)
+        self.user_mgr = user_mgr
+        self.activity_user_id = activity_user_id
 
     def analyze(self):
         """Called when all sensor readings have been processed."""
         results = SensorAnalyzer.SensorAnalyzer.analyze(self)
-        if len(self.readings) > 0:
+        if self.num_readings > 0:
             results[Keys.MAX_HEART_RATE] = self.max
             results[Keys.AVG_HEART_RATE] = self.avg
+
+            # Time spent in each of the user's heart rate zones.
+            if self.activity_user_id and self.user_mgr:
+                zone_bounds = TrainingLoad.heart_rate_zone_bounds(self.user_mgr, self.activity_user_id)
+                results.update(TrainingLoad.heart_rate_results(MeanMaximal.cumulative_seconds(self.times, self.values), zone_bounds))
         return results
@@ -31,11 +31,19 @@ class HeatMap(object):
         self.max_value = 1
         super(HeatMap, self).__init__()
 
-    def append(self, value):
-        try:
-            new_value = self.map[value] + 1
+    def append(self, value, count=1):
+        if value in self.map:
+            new_value = self.map[value] + count
+        else:
+            new_value = count
+        self.map[value] = new_value
+        if new_value > self.max_value:
+            self.max_value = new_value
+
+    def append_counts(self, counts):
+        """Same as calling append for each item in the dictionary of counts."""
+        for value, count in counts.items():
+            new_value = self.map.get(value, 0) + count
             self.map[value] = new_value
             if new_value > self.max_value:
                 self.max_value = new_value
-        except:
-            self.map[value] = 1
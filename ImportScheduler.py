@@ -39,8 +39,11 @@ class ImportScheduler(object):
         logger = logging.getLogger()
         logger.error(log_str)
 
-    def add_file_to_queue(self, username, user_id, uploaded_file_data, uploaded_file_name, desired_activity_id, data_mgr):
-        """Adds the activity ID to the list of activities to be analyzed. Activity ID is optional."""
+    def add_file_to_queue(self, username, user_id, store_name, content_hash, uploaded_file_name, desired_activity_id, user_initiated, data_mgr):
+        """Adds the uploaded file to the list of files to be imported. Activity ID is optional."""
+        """The file has already been staged in the upload store, the message only says where to find it. The import's reference to the file"""
+        """is recorded before the message is sent, so that a failed import of the same file can't remove it from the store first."""
+        """If the import is user initiated then it, and the analysis of the imported activity, go ahead of other work."""
         from bson.json_util import dumps
         from ImportWorker import import_activity
 
@@ -50,12 +53,23 @@ class ImportScheduler(object):
             params = {}
             params['username'] = username
             params['user_id'] = user_id
-            params['uploaded_file_data'] = uploaded_file_data
+            params['staging_store'] = store_name
+            params['content_hash'] = content_hash
             params['uploaded_file_name'] = uploaded_file_name
             params['desired_activity_id'] = desired_activity_id
+            params['user_initiated'] = user_initiated
 
             internal_task_id = uuid.uuid4()
-            import_task = import_activity.delay(dumps(params), internal_task_id)
+            if not data_mgr.create_pending_uploaded_file(internal_task_id, store_name, content_hash):
+                data_mgr.delete_unreferenced_upload(store_name, content_hash)
+                return None
+
+            try:
+                priority = Keys.CELERY_USER_PRIORITY if user_initiated else 0
+                import_task = import_activity.apply_async((dumps(params), internal_task_id), priority=priority)
+            except:
+                data_mgr.delete_pending_uploaded_file(internal_task_id, store_name, content_hash)
+                raise
             data_mgr.create_deferred_task(user_id, Keys.IMPORT_TASK_KEY, import_task.task_id, internal_task_id, uploaded_file_name)
             return internal_task_id
         except:
@@ -25,18 +25,14 @@
 
 from __future__ import absolute_import
 from CeleryWorker import celery_worker
-import base64
 import json
 import logging
 import os
 import sys
 import traceback
-import uuid
-import zlib
-import Config
-import DataMgr
 import Importer
 import Keys
+import WorkerContext
 
 def log_error(log_str):
     """Writes an error message to the log file."""
@@ -47,65 +43,47 @@ def log_error(log_str):
 
 @celery_worker.task(ignore_result=True)
 def import_activity(import_str, internal_task_id):
-    local_file_name = ""
+    data_mgr = None
+    staging_store = None
+    content_hash = None
+    archived = False
 
     try:
         import_obj = json.loads(import_str)
         username = import_obj['username']
         user_id = import_obj['user_id']
-        uploaded_file_data = import_obj['uploaded_file_data']
+        staging_store = import_obj['staging_store']
+        content_hash = import_obj['content_hash']
         uploaded_file_name = import_obj['uploaded_file_name']
         desired_activity_id = import_obj['desired_activity_id']
-        data_mgr = DataMgr.DataMgr(config=Config.Config(), root_url="", analysis_scheduler=None, import_scheduler=None)
+        user_initiated = import_obj.get('user_initiated', False)
+        data_mgr = WorkerContext.get_worker_context().data_mgr
         importer = Importer.Importer(data_mgr)
-
-        # Generate a random name for the local file.
-        print("Generating local file name...")
-        root_dir = os.path.dirname(os.path.abspath(__file__))
-        tempfile_dir = os.path.join(root_dir, 'tempfile')
-        if not os.path.exists(tempfile_dir):
-            os.makedirs(tempfile_dir)
-        upload_path = os.path.normpath(tempfile_dir)
         uploaded_file_name, uploaded_file_ext = os.path.splitext(uploaded_file_name)
-        local_file_name = os.path.join(upload_path, str(uuid.uuid4()))
-        local_file_name = local_file_name + uploaded_file_ext
-
-        # Decode and write the file.
-        print("Writing the data to a local file...")
-        with open(local_file_name, 'wb') as local_file:
-
-            # Data to import is expected to be Base 64 encoded. This is because, at this point, we don't distinguish between
-            # text and binary files.
-            print("Base64 decoding...")
-            uploaded_file_data = uploaded_file_data.replace(" ", "+") # Some JS base64 encoders replace plus with space, so we need to undo that.
-            decoded_file_data = base64.b64decode(uploaded_file_data)
-#            print("zlib decompressing...")
-#            decoded_file_data = zlib.decompress(decoded_file_data)
-            print("Writing...")
-            local_file.write(decoded_file_data)
 
         # Update the status of the analysis in the database.
         print("Updating status...")
         data_mgr.update_deferred_task(user_id, internal_task_id, None, Keys.TASK_STATUS_STARTED)
 
-        # Import the file into the database.
+        # Import the file into the database, reading it from where the upload was staged.
         print("Importing the data to the database...")
-        success, _, activity_id = importer.import_activity_from_file(username, user_id, local_file_name, uploaded_file_name, uploaded_file_ext, desired_activity_id)
+        with data_mgr.get_upload_store(staging_store).local_file(content_hash) as local_file_name:
+            success, _, activity_id = importer.import_activity_from_file(username, user_id, local_file_name, uploaded_file_name, uploaded_file_ext, desired_activity_id)
 
         # The import was successful, do more stuff.
         if success:
 
-            # Save the file to the database.
+            # The staged file is kept as the archived original, the database just records which one it was.
             print("Saving the file to the database...")
-            data_mgr.create_uploaded_file(activity_id, decoded_file_data)
+            archived = data_mgr.update_uploaded_file_activity(internal_task_id, activity_id, staging_store, content_hash)
 
             # Update the status of the analysis in the database.
             print("Updating status...")
             data_mgr.update_deferred_task(user_id, internal_task_id, activity_id, Keys.TASK_STATUS_FINISHED)
 
-            # Schedule the activity for analysis.
-            #print("Importing was successful, performing analysis...")
-            #data_mgr.analyze_activity_by_id(activity_id, user_id)
+            # Schedule the activity for analysis. If the user is waiting on the import then they're also waiting on the analysis.
+            print("Importing was successful, scheduling analysis...")
+            data_mgr.schedule_activity_analysis(activity_id, user_id, user_initiated)
 
         # The import failed.
         else:
@@ -118,10 +96,14 @@ def import_activity(import_str, internal_task_id):
         log_error(traceback.format_exc())
         log_error(sys.exc_info()[0])
     finally:
-        # Remove the local file.
-        if len(local_file_name) > 0:
-            print("Removing local file...")
-            os.remove(local_file_name)
+        # Drop this task's reference to the staged file. The file itself is removed unless it's the archived original of some other
+        # activity, or another upload of the same file is still waiting to be imported.
+        if not archived and data_mgr is not None and content_hash is not None:
+            try:
+                print("Removing staged file...")
+                data_mgr.delete_pending_uploaded_file(internal_task_id, staging_store, content_hash)
+            except:
+                log_error(traceback.format_exc())
 
 def main():
     """Entry point for an import worker."""
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Static index of time intervals, for answering "does any interval contain this time?" in logarithmic time."""
+
+import bisect
+
+class IntervalIndex(object):
+    """Intervals are half open, i.e., [start, end). Built once from a list of intervals, then queried."""
+
+    def __init__(self, intervals):
+        """intervals is a list of (start, end, item) tuples."""
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [interval[0] for interval in self.intervals]
+
+        # For each position in the sorted list, the interval with the latest end time at or before that position.
+        self.max_end_index = []
+        best = None
+        for i, interval in enumerate(self.intervals):
+            if best is None or interval[1] > self.intervals[best][1]:
+                best = i
+            self.max_end_index.append(best)
+        super(IntervalIndex, self).__init__()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def find_containing(self, point):
+        """Returns the item of an interval that contains the point, or None if there isn't one."""
+        """Every interval that starts at or before the point is a candidate, and one of them contains the point if, and"""
+        """only if, the one that ends last does."""
+        position = bisect.bisect_right(self.starts, point)
+        if position == 0:
+            return None
+        candidate = self.intervals[self.max_end_index[position - 1]]
+        if candidate[1] > point:
+            return candidate[2]
+        return None
+
+    def contains(self, point):
+        """Returns True if any interval contains the point."""
+        return self.find_containing(point) is not None
@@ -47,13 +47,33 @@ API_KEYS = "api keys" # List of API keys belonging to the user
 API_KEY = "key" # API key being provided
 API_KEY_RATE = "rate" # The maximum number of requests allowed per day for the provided key
 
+# Keys used by the API rate limiter.
+RATE_LIMIT_KEY = "key" # What is being limited, i.e., the API key, or the API key and endpoint
+RATE_LIMIT_WINDOW_START_KEY = "window_start" # UNIX timestamp at which the counter's window begins
+RATE_LIMIT_COUNT_KEY = "count" # Number of requests made in the window
+RATE_LIMIT_EXPIRES_AT_KEY = "expires_at" # Date after which the counter is no longer needed
+
+# Keys used to record one-time database migrations.
+MIGRATION_VERSION_KEY = "version" # Version the migration was last completed at
+MIGRATION_COMPLETED_KEY = "completed" # UNIX timestamp at which the migration was last completed
+MIGRATION_CLAIMED_UNTIL_KEY = "claimed_until" # UNIX timestamp until which a process is running the migration, and others shouldn't
+MIGRATION_INDEXES = "indexes" # Creates and updates the indexes declared in DatabaseIndexes
+MIGRATION_NORMALIZE_ACTIVITY_IDS = "normalize_activity_ids" # Converts activity IDs stored before IDs were normalized to lower case
+
 # Keys associated with session management.
 SESSION_TOKEN_KEY = "cookie"
 SESSION_USER_KEY = "user"
 SESSION_EXPIRY_KEY = "expiry"
+SESSION_EXPIRES_AT_KEY = "expires_at" # Same as the expiry, but as a date so that the database can delete expired sessions
 
 # Celery.
 CELERY_PROJECT_NAME = "openworkoutweb_worker"
+CELERY_INTERACTIVE_QUEUE = "interactive" # Imports and analysis that a user is waiting on
+CELERY_ANALYSIS_QUEUE = "analysis" # Background analysis (activities found by the periodic checks, personal records)
+CELERY_PLANS_QUEUE = "plans" # Workout plan generation
+CELERY_MAINTENANCE_QUEUE = "maintenance" # Periodic housekeeping
+CELERY_MAX_PRIORITY = 9
+CELERY_USER_PRIORITY = 9 # Priority of tasks that were started by something the user did, within their queue
 
 # Goals.
 GOAL_FITNESS_KEY = "Fitness"
@@ -159,6 +179,15 @@ USER_SETTINGS_LAST_UPDATED_KEY = "last updated" # Time when the user settings wh
 # Personal records.
 RECORD_NAME_KEY = "record_name"
 PERSONAL_RECORDS_KEY = "records"
+ACTIVITY_BESTS_KEY = "bests" # The bests from a single activity, stored one document per activity
+ACTIVITY_BESTS_MIGRATED_KEY = "activity bests migrated" # Set on records documents once their per-activity bests have been moved to their own collection
+
+# Power-duration and pace-duration curves, i.e., the best efforts across many activities.
+DURATION_CURVE_KEY = "curve" # Which curve, i.e., POWER_CURVE or PACE_CURVE. Also the API parameter for selecting the curve.
+DURATION_CURVE_BUCKET_KEY = "bucket" # UNIX timestamp at which the curve's time bucket begins
+DURATION_CURVE_POINTS_KEY = "points" # Best value for each duration, keyed by the duration (in seconds) as a string
+DURATION_CURVE_ACTIVITIES_KEY = "activities" # IDs of the activities that have been folded into the curve
+DURATION_CURVE_REVISION_KEY = "revision" # Incremented by every change to the bucket, so that a rebuild can tell if it raced with a merge
 
 # Workout training intensity distribution.
 TRAINING_PHILOSOPHY_POLARIZED = "polarized"
@@ -231,6 +260,9 @@ UPLOADED_FILE_NAME_KEY = "uploaded_file_name"
 UPLOADED_FILE_DATA_KEY = "uploaded_file_data"
 UPLOADED_FILE1_DATA_KEY = "uploaded_file1_data"
 UPLOADED_FILE2_DATA_KEY = "uploaded_file2_data"
+UPLOADED_FILE_STORE_KEY = "uploaded_file_store" # Where the uploaded file is kept (see UploadStore)
+UPLOADED_FILE_HASH_KEY = "uploaded_file_hash" # Hash of the uploaded file's contents, which is also its name in the store
+UPLOADED_FILE_IMPORT_TASK_KEY = "import_task_id" # Internal ID of the import task that is still importing the uploaded file
 
 # Keys associated with adding a new race.
 RACE_ID_KEY = "Race ID"
@@ -289,6 +321,17 @@ ACCELEROMETER_TIME_KEY = "time" # UNIX timestamp in milliseconds
 # Keys inherited from the web app.
 ACTIVITY_ID_KEY = "activity_id" # Unique identifier for the activity
 ACTIVITY_HASH_KEY = "activity_hash"
+ACTIVITY_ANALYSIS_INPUTS_HASH_KEY = "analysis_inputs_hash" # Hash of the non-location inputs to the analysis (activity type, sensor data)
+ACTIVITY_ANALYZER_VERSION_KEY = "analyzer_version" # Version of the analysis code that produced the summary
+ACTIVITY_HASH_STATE_KEY = "activity_hash_state" # Saved state of the incremental activity hash, so appended data can be hashed without starting over
+ACTIVITY_LEGACY_HASH_KEY = "activity_hash_sha512" # The activity hash in the original (SHA-512) format, stored the first time a client asks for it
+ACTIVITY_HASH_FORMAT_KEY = "hash_format" # Format of the activity hash a client wants, see ActivityHasher
+HASH_STATE_CHAIN_KEY = "chain"
+HASH_STATE_NUM_ROWS_KEY = "num_rows"
+HASH_STATE_LAST_TIME_KEY = "last_time"
+ACTIVITY_LIVE_STATE_KEY = "live_state" # Running analysis of an activity that is still being recorded
+LIVE_STATE_REVISION_KEY = "revision" # Incremented each time the live state is written
+ACTIVITY_ANALYSIS_REQUEST_KEY = "analysis_request" # Incremented each time the activity is queued for analysis, so a queued task can tell if a newer one exists
 ACTIVITY_TYPE_KEY = "activity_type"
 ACTIVITY_DESCRIPTION_KEY = "description"
 ACTIVITY_USER_ID_KEY = "user_id"
@@ -314,6 +357,21 @@ ACTIVITY_PHOTO_ID_KEY = "photo id" # Unique identifier for a specific photo
 ACTIVITY_PHOTO_IDS_KEY = "photo ids" # Unique identifier for activity photos
 ACTIVITY_PHOTOS_KEY = "photos" # List of all photo IDs
 ACTIVITY_LAST_UPDATED_KEY = "last updated" # Time when the activity was last updated
+ACTIVITY_LAST_LIVE_TIME_KEY = "last live time" # Timestamp (ms) of the most recent data appended by a live update
+ACTIVITY_LIVE_LISTS_REVISION_KEY = "live lists revision" # Incremented each time a live update adds to the activity document's lists, so that an out of order batch can tell if it raced with another update
+
+# Keys used by the activity stream store, which holds raw location and sensor data in time-bucketed chunks.
+STREAM_NAME_KEY = "stream" # Name of the stream (i.e., locations, Heart Rate, etc.)
+STREAM_CHUNK_START_KEY = "chunk_start" # UNIX timestamp (ms) at which the chunk's time bucket begins
+STREAM_CHUNK_END_KEY = "chunk_end" # UNIX timestamp (ms) of the last sample in the chunk
+STREAM_SAMPLES_KEY = "samples" # List of samples in the chunk
+STREAM_SAMPLE_TIME_KEY = "time" # UNIX timestamp in milliseconds
+STREAM_SAMPLE_VALUE_KEY = "value"
+STREAM_PACKED_KEY = "packed" # Samples in the packed, columnar, encoding (see StreamCodec)
+STREAM_PACKED_COUNT_KEY = "count" # Number of packed samples
+STREAM_PACKED_TIMES_KEY = "times" # Delta-encoded int64 timestamps
+STREAM_PACKED_COLUMNS_KEY = "columns" # One binary array per column
+STREAM_PACKED_DTYPES_KEY = "dtypes" # Storage type of each packed column
 
 # Keys used to summarize activity data.
 BEST_SPEED = "Best Speed" # Highest speed seen during the activity
@@ -331,6 +389,8 @@ BEST_5_SEC_POWER = "5 Second Power" # Highest average power seen over 5 seconds
 BEST_12_MIN_POWER = "12 Minute Power" # Highest average power seen over 12 minutes
 BEST_20_MIN_POWER = "20 Minute Power" # Highest average power seen over 20 minutes
 BEST_1_HOUR_POWER = "1 Hour Power" # Highest average power seen over 1 hour
+POWER_CURVE = "Power Curve" # Highest average power for each of a range of durations, as a list of [seconds, watts]
+PACE_CURVE = "Pace Curve" # Highest average speed for each of a range of durations, as a list of [seconds, meters per second]
 MAX_POWER = "Maximum Power" # Highest power detected during the activity
 MAX_HEART_RATE = "Maximum Heart Rate" # Highest heart rate detected during the activity
 MAX_CADENCE = "Maximum Cadence" # Highest recorded cadence
@@ -343,6 +403,9 @@ AVG_STEPS_PER_MINUTE = "Average Steps Per Minute" # Average cadence for foot bas
 NORMALIZED_POWER = "Normalized Power"
 THRESHOLD_POWER = "Threshold Power" # Functional Threshold Power (FTP)
 VARIABILITY_INDEX = "Variability Index"
+INTENSITY_FACTOR = "Intensity Factor" # Normalized power as a fraction of the user's FTP
+POWER_ZONE_DISTRIBUTION = "Power Zone Distribution" # Seconds spent in each power training zone
+HEART_RATE_ZONE_DISTRIBUTION = "Heart Rate Zone Distribution" # Seconds spent in each heart rate training zone
 LONGEST_DISTANCE = "Longest Distance" # Longest distance, when summarizing activities
 TOTAL_DISTANCE = "Total Distance" # Distance for an activity
 TOTAL_DURATION = "Total Duration" # Number of seconds for the activity/activities
@@ -484,6 +547,7 @@ ACTIVITY_MATCH_CODE_HASH_MATCHES = 3 # Activity exists, hash matches as well
 ACTIVITY_MATCH_CODE_HASH_NOT_PROVIDED = 4  # Activity exists, hash not provided
 
 SENSOR_KEYS = [ APP_CADENCE_KEY, APP_HEART_RATE_KEY, APP_TEMP_KEY, APP_POWER_KEY ]
+ACTIVITY_STREAM_KEYS = [ APP_LOCATIONS_KEY, APP_ACCELEROMETER_KEY, APP_CURRENT_SPEED_KEY, APP_HEART_RATE_KEY, APP_CADENCE_KEY, APP_POWER_KEY ]
 TIME_KEYS = [ APP_DURATION_KEY, BEST_1K, BEST_MILE, BEST_5K, BEST_10K, BEST_15K, BEST_HALF_MARATHON, BEST_MARATHON, BEST_METRIC_CENTURY, BEST_CENTURY ]
 DISTANCE_KEYS = [ TOTAL_DISTANCE, LONGEST_DISTANCE ]
 SPEED_KEYS = [ APP_CURRENT_SPEED_KEY, APP_AVG_SPEED_KEY, APP_MOVING_SPEED_KEY, APP_SPEED_VARIANCE_KEY, BEST_SPEED ]
@@ -495,6 +559,6 @@ RUNNING_CADENCE_KEYS = [ STEPS_PER_MINUTE, AVG_STEPS_PER_MINUTE ]
 GOALS = [ GOAL_FITNESS_KEY, GOAL_5K_RUN_KEY, GOAL_10K_RUN_KEY, GOAL_15K_RUN_KEY, GOAL_HALF_MARATHON_RUN_KEY, GOAL_MARATHON_RUN_KEY, GOAL_50K_RUN_KEY, GOAL_50_MILE_RUN_KEY, GOAL_SPRINT_TRIATHLON_KEY, GOAL_OLYMPIC_TRIATHLON_KEY, GOAL_HALF_IRON_DISTANCE_TRIATHLON_KEY, GOAL_IRON_DISTANCE_TRIATHLON_KEY ]
 INTENSITY_SCORES = [ INTENSITY_SCORE, ESTIMATED_INTENSITY_SCORE, TOTAL_INTENSITY_SCORE ]
 
-UNSUMMARIZABLE_KEYS = [ APP_SPEED_VARIANCE_KEY, APP_DISTANCES_KEY, APP_LOCATIONS_KEY, ACTIVITY_START_TIME_KEY, ACTIVITY_TYPE_KEY, ACTIVITY_HASH_KEY, ACTIVITY_LOCATION_DESCRIPTION_KEY, ACTIVITY_INTERVALS_KEY, MILE_SPLITS, KM_SPLITS ]
+UNSUMMARIZABLE_KEYS = [ APP_SPEED_VARIANCE_KEY, APP_DISTANCES_KEY, APP_LOCATIONS_KEY, ACTIVITY_START_TIME_KEY, ACTIVITY_TYPE_KEY, ACTIVITY_HASH_KEY, ACTIVITY_HASH_STATE_KEY, ACTIVITY_LEGACY_HASH_KEY, ACTIVITY_ANALYSIS_INPUTS_HASH_KEY, ACTIVITY_ANALYZER_VERSION_KEY, ACTIVITY_LOCATION_DESCRIPTION_KEY, ACTIVITY_INTERVALS_KEY, MILE_SPLITS, KM_SPLITS, POWER_CURVE, PACE_CURVE, POWER_ZONE_DISTRIBUTION, HEART_RATE_ZONE_DISTRIBUTION ]
 
 DAYS_OF_WEEK = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
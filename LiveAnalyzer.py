@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Running analysis of an activity that is still being recorded. The state is small and is stored with the activity, so each batch of"""
+"""live data only costs as much as the batch itself, and the activity summary is up to date as soon as the batch has been stored."""
+
+import numpy as np
+from bson.binary import Binary
+import ActivityHasher
+import Keys
+import LocationAnalyzer
+import MeanMaximal
+import TrainingLoad
+
+# Only the shorter record distances are tracked live. The longer ones would mean keeping most of the track in the state.
+LIVE_RECORD_MAX_METERS = 10000
+
+# Sensors with running aggregates.
+LIVE_SENSOR_TYPES = [ Keys.APP_CADENCE_KEY, Keys.APP_HEART_RATE_KEY, Keys.APP_POWER_KEY ]
+
+# Names of the items in the state.
+STATE_INVALID = "invalid"
+STATE_ACTIVITY_TYPE = "activity_type"
+STATE_HASH = "hash"
+STATE_HASH_PENDING = "pending"
+STATE_LOCATION = "location"
+STATE_START_TIME = "start_time"
+STATE_LAST_TIME = "last_time"
+STATE_LAST_LAT = "last_lat"
+STATE_LAST_LON = "last_lon"
+STATE_LAST_ALT = "last_alt"
+STATE_TOTAL_DISTANCE = "total_distance"
+STATE_TOTAL_VERTICAL = "total_vertical"
+STATE_KM_SPLITS = "km_splits"
+STATE_MILE_SPLITS = "mile_splits"
+STATE_CURRENT_SPEED = "current_speed"
+STATE_LAST_SPEED_TIME = "last_speed_time"
+STATE_BESTS = "bests"
+STATE_TAIL_TIMES = "tail_times"
+STATE_TAIL_DISTANCES = "tail_distances"
+STATE_SPEED_WINDOW_START = "speed_window_start"
+STATE_RECORD_WINDOW_STARTS = "record_window_starts"
+STATE_SENSORS = "sensors"
+STATE_COUNT = "count"
+STATE_SUM = "sum"
+STATE_MAX = "max"
+STATE_MAX_TIME = "max_time"
+STATE_ORIGIN = "origin"
+STATE_PENDING_READINGS = "pending_readings"
+STATE_NUM_SECONDS = "num_seconds"
+STATE_SECONDS_SUM = "seconds_sum"
+STATE_ROLLING_TAIL = "rolling_tail"
+STATE_ROLLING_COUNT = "rolling_count"
+STATE_ROLLING_SUM4 = "rolling_sum4"
+
+def is_valid_state(state):
+    """Returns True if the state can be continued from."""
+    return state is not None and not state.get(STATE_INVALID, False)
+
+class LiveAnalyzer(object):
+    """Updates the running analysis with batches of live data. Batches have to arrive in order, otherwise the state is marked as invalid and"""
+    """the activity will have to be analyzed from scratch once it's finished, which is what happened to every live activity before."""
+
+    def __init__(self, activity_type, state=None):
+        if state is None:
+            state = { Keys.LIVE_STATE_REVISION_KEY: 0 }
+        self.state = state
+        if activity_type:
+            self.state[STATE_ACTIVITY_TYPE] = activity_type
+        super(LiveAnalyzer, self).__init__()
+
+    def is_valid(self):
+        return is_valid_state(self.state)
+
+    def invalidate(self):
+        """Discards the analysis, keeping only what's needed to recognize that it can't be continued."""
+        self.state = { Keys.LIVE_STATE_REVISION_KEY: self.state.get(Keys.LIVE_STATE_REVISION_KEY, 0), STATE_INVALID: True }
+
+    def activity_type(self):
+        return self.state.get(STATE_ACTIVITY_TYPE, Keys.TYPE_UNSPECIFIED_ACTIVITY_KEY)
+
+    def state_for_storage(self):
+        """Returns the state, with the revision incremented. The revision lets the database reject a write that is based on an out of date state."""
+        self.state[Keys.LIVE_STATE_REVISION_KEY] = self.state.get(Keys.LIVE_STATE_REVISION_KEY, 0) + 1
+        return self.state
+
+    def append_batch(self, locations, sensor_readings_dict):
+        """Adds a batch of live data. Locations are in the form built by Api.parse_json_loc_obj and the sensor readings are lists of [time, value]."""
+        if not self.is_valid():
+            return
+        if locations:
+            if not self.append_locations(locations):
+                self.invalidate()
+                return
+        for sensor_type in LIVE_SENSOR_TYPES:
+            if sensor_readings_dict and sensor_type in sensor_readings_dict:
+                if not self.append_sensor_readings(sensor_type, sensor_readings_dict[sensor_type]):
+                    self.invalidate()
+                    return
+
+    #
+    # Locations
+    #
+
+    def append_locations(self, locations):
+        """Returns False if the locations can't be added to the state, i.e. they arrived out of order."""
+        location_state = self.state.get(STATE_LOCATION)
+        if location_state is not None and location_state[STATE_LAST_TIME] is not None and locations[0][0] < location_state[STATE_LAST_TIME]:
+            return False
+
+        # The hash is chained over the locations in the order they were received, which is the same order the stored stream will have.
+        self.update_hash(locations)
+
+        # Restore the location analyzer from the state, add the batch, then take back what the next batch will need.
+        location_analyzer = self.restore_location_analyzer(location_state)
+        for location in locations:
+            location_analyzer.append_location(location[0], location[1], location[2], location[3], location[4], location[5])
+        location_analyzer.update_speeds()
+        if location_analyzer.use_scan:
+            return False
+        self.state[STATE_LOCATION] = self.save_location_analyzer(location_analyzer)
+        return True
+
+    def update_hash(self, locations):
+        """Continues the incremental activity hash. Rows that don't yet make up a whole chunk are kept in the state."""
+        rows = ActivityHasher.pack_location_rows([location[0] for location in locations], [location[1] for location in locations], [location[2] for location in locations], [location[3] for location in locations])
+        hash_state = self.state.get(STATE_HASH)
+        if hash_state is None:
+            hasher = ActivityHasher.ChainedHasher()
+        else:
+            hasher = ActivityHasher.ChainedHasher.from_state(hash_state)
+            hasher.pending = np.frombuffer(hash_state[STATE_HASH_PENDING], dtype=ActivityHasher.ROW_DTYPE).reshape(-1, 4)
+        hasher.update(rows)
+        hash_state = hasher.state()
+        hash_state[STATE_HASH_PENDING] = Binary(hasher.pending.tobytes())
+        self.state[STATE_HASH] = hash_state
+
+    def restore_location_analyzer(self, location_state):
+        """Creates a location analyzer that carries on from where the saved state left off. Its distance buffer holds only the tail"""
+        """of the track that the sliding windows can still reach."""
+        location_analyzer = LocationAnalyzer.LocationAnalyzer(self.activity_type())
+        location_analyzer.record_distances = [record for record in location_analyzer.record_distances if record[1] <= LIVE_RECORD_MAX_METERS]
+        location_analyzer.record_window_starts = [0] * len(location_analyzer.record_distances)
+        if location_state is None:
+            return location_analyzer
+
+        location_analyzer.start_time_ms = location_state[STATE_START_TIME]
+        location_analyzer.last_time_ms = location_state[STATE_LAST_TIME]
+        location_analyzer.last_lat = location_state[STATE_LAST_LAT]
+        location_analyzer.last_lon = location_state[STATE_LAST_LON]
+        location_analyzer.last_alt = location_state[STATE_LAST_ALT]
+        location_analyzer.total_distance = location_state[STATE_TOTAL_DISTANCE]
+        location_analyzer.total_vertical = location_state[STATE_TOTAL_VERTICAL]
+        location_analyzer.km_splits = list(location_state[STATE_KM_SPLITS])
+        location_analyzer.mile_splits = list(location_state[STATE_MILE_SPLITS])
+        location_analyzer.current_speed = location_state[STATE_CURRENT_SPEED]
+        location_analyzer.last_speed_buf_update_time = location_state[STATE_LAST_SPEED_TIME]
+        location_analyzer.bests = dict(location_state[STATE_BESTS])
+
+        tail_times = np.frombuffer(location_state[STATE_TAIL_TIMES], dtype='<i8').tolist()
+        tail_distances = np.frombuffer(location_state[STATE_TAIL_DISTANCES], dtype='<f8').tolist()
+        location_analyzer.distance_buf = [[date_time_ms, total_distance] for date_time_ms, total_distance in zip(tail_times, tail_distances)]
+        location_analyzer.next_window_end = len(location_analyzer.distance_buf)
+        location_analyzer.speed_window_start = location_state[STATE_SPEED_WINDOW_START]
+        location_analyzer.record_window_starts = list(location_state[STATE_RECORD_WINDOW_STARTS])
+        return location_analyzer
+
+    def save_location_analyzer(self, location_analyzer):
+        """Returns the location analyzer's state, trimming the distance buffer to the items that can still start a window."""
+        distance_buf = location_analyzer.distance_buf
+        keep_from = location_analyzer.speed_window_start
+        for num_starts in location_analyzer.record_window_starts:
+            keep_from = min(keep_from, max(0, num_starts - 1))
+
+        # Windows that take no time are skipped by stepping back, so keep any items with the same time as the first one kept.
+        while keep_from > 0 and distance_buf[keep_from - 1][0] >= distance_buf[keep_from][0]:
+            keep_from = keep_from - 1
+        tail = distance_buf[keep_from:]
+
+        location_state = {}
+        location_state[STATE_START_TIME] = location_analyzer.start_time_ms
+        location_state[STATE_LAST_TIME] = location_analyzer.last_time_ms
+        location_state[STATE_LAST_LAT] = location_analyzer.last_lat
+        location_state[STATE_LAST_LON] = location_analyzer.last_lon
+        location_state[STATE_LAST_ALT] = location_analyzer.last_alt
+        location_state[STATE_TOTAL_DISTANCE] = location_analyzer.total_distance
+        location_state[STATE_TOTAL_VERTICAL] = location_analyzer.total_vertical
+        location_state[STATE_KM_SPLITS] = location_analyzer.km_splits
+        location_state[STATE_MILE_SPLITS] = location_analyzer.mile_splits
+        location_state[STATE_CURRENT_SPEED] = location_analyzer.current_speed
+        location_state[STATE_LAST_SPEED_TIME] = location_analyzer.last_speed_buf_update_time
+        location_state[STATE_BESTS] = location_analyzer.bests
+        location_state[STATE_TAIL_TIMES] = Binary(np.array([item[0] for item in tail], dtype='<i8').tobytes())
+        location_state[STATE_TAIL_DISTANCES] = Binary(np.array([item[1] for item in tail], dtype='<f8').tobytes())
+        location_state[STATE_SPEED_WINDOW_START] = location_analyzer.speed_window_start - keep_from
+        location_state[STATE_RECORD_WINDOW_STARTS] = [max(0, num_starts - keep_from) for num_starts in location_analyzer.record_window_starts]
+        return location_state
+
+    #
+    # Sensors
+    #
+
+    def append_sensor_readings(self, sensor_type, readings):
+        """Updates the sensor's running aggregates. Returns False if the readings arrived out of order."""
+        sensors_state = self.state.setdefault(STATE_SENSORS, {})
+        sensor_state = sensors_state.get(sensor_type)
+        if sensor_state is None:
+            sensor_state = { STATE_COUNT: 0, STATE_SUM: 0.0, STATE_MAX: 0.0, STATE_MAX_TIME: 0, STATE_LAST_TIME: None }
+            if sensor_type == Keys.APP_POWER_KEY:
+                sensor_state.update({ STATE_ORIGIN: None, STATE_PENDING_READINGS: [], STATE_NUM_SECONDS: 0, STATE_SECONDS_SUM: 0.0, STATE_ROLLING_TAIL: [], STATE_ROLLING_COUNT: 0, STATE_ROLLING_SUM4: 0.0 })
+            sensors_state[sensor_type] = sensor_state
+        elif sensor_type == Keys.APP_POWER_KEY and STATE_ORIGIN not in sensor_state:
+            return False # State from before normalized power used the rolling average, can't be continued
+
+        for date_time, value in readings:
+            if sensor_state[STATE_LAST_TIME] is not None and date_time < sensor_state[STATE_LAST_TIME]:
+                return False
+            sensor_state[STATE_LAST_TIME] = date_time
+            sensor_state[STATE_COUNT] = sensor_state[STATE_COUNT] + 1
+            sensor_state[STATE_SUM] = sensor_state[STATE_SUM] + value
+            if value > sensor_state[STATE_MAX]:
+                sensor_state[STATE_MAX] = value
+                sensor_state[STATE_MAX_TIME] = date_time
+
+        if sensor_type == Keys.APP_POWER_KEY and len(readings) > 0:
+            if sensor_state[STATE_ORIGIN] is None:
+                sensor_state[STATE_ORIGIN] = readings[0][0]
+            sensor_state[STATE_PENDING_READINGS].extend([date_time, value] for date_time, value in readings)
+            self.advance_power_seconds(sensor_state)
+        return True
+
+    def power_seconds(self, sensor_state, final):
+        """Returns the average power of each second, from the first one that hasn't been counted yet, computed the same way as"""
+        """MeanMaximal.cumulative_seconds. If final is True then only the seconds that later readings can't change are included."""
+        """Also returns the reading times, in seconds."""
+        pending = np.array(sensor_state[STATE_PENDING_READINGS], dtype=np.float64).reshape(-1, 2)
+        offsets = (pending[:, 0] - sensor_state[STATE_ORIGIN]) / 1000.0
+        values = pending[:, 1]
+        holds = MeanMaximal.reading_holds(offsets)
+
+        # Until the next reading arrives, the last one only holds for a second, and how long it really holds isn't known.
+        first_second = sensor_state[STATE_NUM_SECONDS]
+        if final:
+            last_second = int(np.floor(offsets[-1]))
+        else:
+            last_second = int(np.floor(offsets[-1] + holds[-1]))
+        if last_second <= first_second:
+            return np.zeros(0), offsets
+        totals = MeanMaximal.integrate_to_seconds(offsets, values, holds, np.arange(first_second, last_second + 1, dtype=np.float64))
+        return np.diff(totals), offsets
+
+    def rolling_fourth_powers(self, sensor_state, seconds):
+        """Returns the number of 30 second rolling averages that the given seconds complete and the sum of their fourth powers."""
+        window = np.concatenate((np.array(sensor_state[STATE_ROLLING_TAIL], dtype=np.float64), seconds))
+        rolling = TrainingLoad.rolling_averages(np.concatenate(([0.0], np.cumsum(window))))
+        return len(rolling), float(np.sum(rolling ** 4)), window
+
+    def advance_power_seconds(self, sensor_state):
+        """Adds the seconds that are now final to the normalized power sums. Only the last 29 seconds and the readings that the next"""
+        """seconds depend on are kept, so the state doesn't grow with the length of the activity."""
+        seconds, offsets = self.power_seconds(sensor_state, True)
+        if len(seconds) > 0:
+            num_rolling, rolling_sum4, window = self.rolling_fourth_powers(sensor_state, seconds)
+            sensor_state[STATE_ROLLING_COUNT] = sensor_state[STATE_ROLLING_COUNT] + num_rolling
+            sensor_state[STATE_ROLLING_SUM4] = sensor_state[STATE_ROLLING_SUM4] + rolling_sum4
+            sensor_state[STATE_ROLLING_TAIL] = window[-(TrainingLoad.ROLLING_WINDOW_SECS - 1):].tolist()
+            sensor_state[STATE_NUM_SECONDS] = sensor_state[STATE_NUM_SECONDS] + len(seconds)
+            sensor_state[STATE_SECONDS_SUM] = sensor_state[STATE_SECONDS_SUM] + float(np.sum(seconds))
+
+        # Keep from the reading that's in effect at the start of the next second.
+        first_needed = int(np.searchsorted(offsets, sensor_state[STATE_NUM_SECONDS], side='right')) - 1
+        if first_needed > 0:
+            sensor_state[STATE_PENDING_READINGS] = sensor_state[STATE_PENDING_READINGS][first_needed:]
+
+    def normalized_power_results(self, sensor_state):
+        """Normalized power and variability index, as the power analyzer would compute them for the readings so far."""
+        results = {}
+        if sensor_state.get(STATE_ORIGIN) is None:
+            return results
+        seconds, _ = self.power_seconds(sensor_state, False)
+        num_rolling, rolling_sum4, _ = self.rolling_fourth_powers(sensor_state, seconds)
+        num_rolling = num_rolling + sensor_state[STATE_ROLLING_COUNT]
+        if num_rolling > 0:
+            np_value = pow((sensor_state[STATE_ROLLING_SUM4] + rolling_sum4) / num_rolling, 0.25)
+            results[Keys.NORMALIZED_POWER] = np_value
+            ap = (sensor_state[STATE_SECONDS_SUM] + float(np.sum(seconds))) / (sensor_state[STATE_NUM_SECONDS] + len(seconds))
+            if ap > 0.0:
+                results[Keys.VARIABILITY_INDEX] = np_value / ap
+        return results
+
+    #
+    # Results
+    #
+
+    def summary(self):
+        """Returns the results so far, using the same keys as the final analysis. The activity hash is left out, on purpose, so that"""
+        """the activity is still picked up for a full analysis, but the hash state is included so that the full analysis can resume it."""
+        results = {}
+        if not self.is_valid():
+            return results
+
+        hash_state = self.state.get(STATE_HASH)
+        if hash_state is not None:
+            results[Keys.ACTIVITY_HASH_STATE_KEY] = { Keys.HASH_STATE_CHAIN_KEY: hash_state[Keys.HASH_STATE_CHAIN_KEY], Keys.HASH_STATE_NUM_ROWS_KEY: hash_state[Keys.HASH_STATE_NUM_ROWS_KEY], Keys.HASH_STATE_LAST_TIME_KEY: hash_state[Keys.HASH_STATE_LAST_TIME_KEY] }
+
+        location_state = self.state.get(STATE_LOCATION)
+        if location_state is not None:
+            results.update(location_state[STATE_BESTS])
+            results[Keys.LONGEST_DISTANCE] = location_state[STATE_TOTAL_DISTANCE]
+            results[Keys.MILE_SPLITS] = location_state[STATE_MILE_SPLITS]
+            results[Keys.KM_SPLITS] = location_state[STATE_KM_SPLITS]
+            if location_state[STATE_LAST_TIME] is not None and location_state[STATE_LAST_TIME] > location_state[STATE_START_TIME]:
+                results[Keys.APP_DURATION_KEY] = (location_state[STATE_LAST_TIME] - location_state[STATE_START_TIME]) / 1000.0
+
+        sensors_state = self.state.get(STATE_SENSORS, {})
+        for sensor_type in sensors_state:
+            sensor_state = sensors_state[sensor_type]
+            if sensor_state[STATE_COUNT] == 0:
+                continue
+            avg = sensor_state[STATE_SUM] / sensor_state[STATE_COUNT]
+            if sensor_type == Keys.APP_HEART_RATE_KEY:
+                results[Keys.MAX_HEART_RATE] = sensor_state[STATE_MAX]
+                results[Keys.AVG_HEART_RATE] = avg
+            elif sensor_type == Keys.APP_CADENCE_KEY:
+                multiplier = 2.0 if self.activity_type() in Keys.FOOT_BASED_ACTIVITIES else 1.0
+                results[Keys.MAX_CADENCE] = sensor_state[STATE_MAX] * multiplier
+                results[Keys.AVG_CADENCE] = avg * multiplier
+            elif sensor_type == Keys.APP_POWER_KEY:
+                results[Keys.MAX_POWER] = sensor_state[STATE_MAX]
+                results[Keys.AVG_POWER] = avg
+                results.update(self.normalized_power_results(sensor_state))
+        return results
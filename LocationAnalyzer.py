@@ -4,10 +4,13 @@
 import inspect
 import os
 import sys
+import Ckmeans
 import InputChecker
 import Keys
 import LocationHeatMap
+import MeanMaximal
 import SensorAnalyzer
+import StreamCodec
 import Units
 
 # Locate and load the distance module as well as other LibMath modules.
@@ -18,12 +21,30 @@ import distance
 import peaks
 import signals
 import statistics
-
-# Stuff we need for kmeans
-from sklearn.cluster import KMeans
-from scipy.spatial.distance import cdist
 import numpy as np
 
+# GPS devices that record "smartly" can go several seconds between points, so allow for longer gaps than with sensor data.
+PACE_CURVE_MAX_GAP_SECS = 30.0
+
+# Interval detection. Speeds within a few percent of each other are treated as the same effort.
+MAX_INTERVAL_SPEED_CLUSTERS = 9
+INTERVAL_SPEED_RESOLUTION = 0.05
+
+EARTH_RADIUS_METERS = 6372797.560856 # Same as LibMath's haversine_distance
+
+def haversine_distances(latitudes, longitudes, altitudes):
+    """Vectorized form of distance.haversine_distance. Returns the distance between each point and the one before it."""
+    lat_radians = np.radians(latitudes)
+    lat_h = np.sin(np.radians(np.diff(latitudes)) * 0.5) ** 2
+    lon_h = np.sin(np.radians(np.diff(longitudes)) * 0.5) ** 2
+    tmp = np.cos(lat_radians[1:]) * np.cos(lat_radians[:-1])
+    rad = 2.0 * np.arcsin(np.sqrt(lat_h + tmp * lon_h))
+    return rad * (EARTH_RADIUS_METERS + altitudes[:-1] - altitudes[1:])
+
+def valid_location_mask(latitudes, longitudes, horizontal_accuracies):
+    """Vectorized form of InputChecker.is_valid_location, which also rejects zero latitudes and longitudes. NaN is never valid."""
+    mask = (latitudes != 0.0) & (latitudes >= -90.0) & (latitudes <= 90.0) & (longitudes != 0.0) & (longitudes >= -180.0) & (longitudes <= 180.0)
+    return mask & ~((horizontal_accuracies < 0.0) | (horizontal_accuracies >= 50.0))
 
 class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
     """Class for performing calculations on a location track."""
@@ -62,6 +83,20 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
         else:
             self.speed_window_size = 11
 
+        # Distances for which we compute a best time, in the order in which they are checked.
+        self.record_distances = [ (Keys.BEST_1K, 1000), (Keys.BEST_MILE, Units.METERS_PER_MILE), (Keys.BEST_5K, 5000), (Keys.BEST_10K, 10000) ]
+        if self.activity_type == Keys.TYPE_RUNNING_KEY:
+            self.record_distances.extend([ (Keys.BEST_15K, 15000), (Keys.BEST_HALF_MARATHON, Units.METERS_PER_HALF_MARATHON), (Keys.BEST_MARATHON, Units.METERS_PER_MARATHON) ])
+        if self.activity_type == Keys.TYPE_CYCLING_KEY:
+            self.record_distances.extend([ (Keys.BEST_METRIC_CENTURY, 100000), (Keys.BEST_CENTURY, Units.METERS_PER_MILE * 100.0) ])
+
+        # Sliding window state. Each window is a pointer into distance_buf that only ever moves forward, which is what makes
+        # the speed and best calculations linear in the number of locations.
+        self.next_window_end = 0 # Index of the next item in distance_buf whose windows have not been examined
+        self.speed_window_start = 0 # Oldest item that could still be the start of a current speed window
+        self.record_window_starts = [0] * len(self.record_distances) # For each record distance, the number of items that are at least that far from the window end
+        self.use_scan = False # Set if timestamps arrive out of order, since the windows then no longer move forward
+
     def update_average_speed(self, date_time_ms):
         """Computes the average speed of the workout. Called by 'append_location'."""
         elapsed_milliseconds = date_time_ms - self.start_time_ms
@@ -84,24 +119,107 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
         else:
             split_buf[whole_units_traveled] = seconds
 
+    def do_split_checks(self, elapsed_ms, distances, split_meters, split_buf):
+        """Same as calling 'do_split_check' for each item, in order, but only loops once per split rather than once per location."""
+        """elapsed_ms is a list and distances is an array of the corresponding total distances."""
+        units_traveled = (distances / split_meters).astype(np.int64)
+        run_starts = np.flatnonzero(np.diff(units_traveled, prepend=-1))
+        run_ends = np.append(run_starts[1:], len(units_traveled))
+        for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+            whole_units_traveled = int(units_traveled[run_start])
+            num_appends = min(run_end - run_start, max(0, whole_units_traveled + 1 - len(split_buf)))
+            split_buf.extend(elapsed_ms[run_start:run_start + num_appends])
+            if num_appends < run_end - run_start:
+                split_buf[whole_units_traveled] = elapsed_ms[run_end - 1]
+
     def update_speeds(self):
-        """Computes the average speed over the last mile. Called by 'append_location'."""
+        """Computes the current speed and the "bests" for every location added since the last call. Called after 'append_location'."""
+        """Each location is examined once, so the total cost is linear in the number of locations."""
+        if self.current_speed is None:
+            self.current_speed = 0.0
+
+        while self.next_window_end < len(self.distance_buf):
+            end_index = self.next_window_end
+            self.next_window_end = end_index + 1
+
+            # The sliding windows depend on the times increasing.
+            if end_index > 0 and self.distance_buf[end_index][0] < self.distance_buf[end_index - 1][0]:
+                self.use_scan = True
+
+            if self.use_scan:
+                self.update_speeds_by_scan(end_index)
+            else:
+                self.update_speeds_for_window_end(end_index)
+
+    def update_speeds_for_window_end(self, end_index):
+        """Computes the current speed and the "bests" for the windows that end at the given item in distance_buf."""
+        end_time_ms, end_distance = self.distance_buf[end_index]
+
+        # Current speed is the average over the speed window. Skip past the items that are too old to start a window.
+        self.current_speed = 0.0
+        start_index = self.speed_window_start
+        while start_index < end_index and int((end_time_ms - self.distance_buf[start_index][0]) / 1000.0) > self.speed_window_size:
+            start_index = start_index + 1
+        self.speed_window_start = start_index
+
+        # Everything from there, until the window is too short, starts a window of the right length. The newest one goes in the
+        # speed graph, the oldest one is the current speed.
+        newest_window = None
+        while start_index < end_index:
+            current_time_ms, current_distance = self.distance_buf[start_index]
+            total_seconds = (end_time_ms - current_time_ms) / 1000.0
+            if int(total_seconds) != self.speed_window_size:
+                break
+            speed = (end_distance - current_distance) / total_seconds
+            if newest_window is None:
+                self.current_speed = speed
+            newest_window = (current_time_ms, speed)
+            if Keys.BEST_SPEED not in self.bests or speed > self.bests[Keys.BEST_SPEED]:
+                self.bests[Keys.BEST_SPEED] = speed
+            start_index = start_index + 1
+        if newest_window is not None and newest_window[0] > self.last_speed_buf_update_time:
+            self.speed_times.append(newest_window[0])
+            self.speed_graph.append(newest_window[1])
+            self.last_speed_buf_update_time = newest_window[0]
+
+        # For each record distance, the fastest window ending here is the one that starts at the newest item that is at least that distance back.
+        for record_index, (record_name, record_meters) in enumerate(self.record_distances):
+            num_starts = self.record_window_starts[record_index]
+            while num_starts < end_index and end_distance - self.distance_buf[num_starts][1] >= record_meters:
+                num_starts = num_starts + 1
+            self.record_window_starts[record_index] = num_starts
+
+            # Windows that take no time are ignored.
+            start_index = num_starts - 1
+            while start_index >= 0 and self.distance_buf[start_index][0] >= end_time_ms:
+                start_index = start_index - 1
+            if start_index < 0:
+                break # Longer distances can't have a start either
+
+            total_seconds = (end_time_ms - self.distance_buf[start_index][0]) / 1000.0
+            total_meters = end_distance - self.distance_buf[start_index][1]
+            self.do_record_check(record_name, total_seconds, total_meters, record_meters)
+
+    def update_speeds_by_scan(self, end_index):
+        """Computes the current speed and the "bests" for the windows that end at the given item in distance_buf by examining"""
+        """every earlier item. Quadratic over the whole activity, so only used when the timestamps are out of order."""
+        end_time_ms, end_distance = self.distance_buf[end_index]
 
         # This will be recomputed here, so zero it out.
         self.current_speed = 0.0
 
         # Loop through the list, in reverse order, updating the current speed, and all "bests".
-        for time_distance_node in reversed(self.distance_buf):
+        for time_distance_node in reversed(self.distance_buf[:end_index + 1]):
 
-            # Convert time from ms to seconds - seconds from this point to the end of the activity.
+            # Convert time from ms to seconds - seconds from this point to the end of the window.
             current_time_ms = time_distance_node[0]
-            total_seconds = (self.last_time_ms - current_time_ms) / 1000.0
+            total_seconds = (end_time_ms - current_time_ms) / 1000.0
             if total_seconds <= 0.0:
                 continue
 
-            # Distance travelled from this point to the end of the activity.
+            # Distance travelled from this point to the end of the window.
             current_distance = time_distance_node[1]
-            total_meters = self.total_distance - current_distance
+            total_meters = end_distance - current_distance
 
             # Current speed is the average of the last ten seconds.
             if int(total_seconds) == self.speed_window_size:
@@ -115,56 +233,11 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
                     self.speed_graph.append(self.current_speed)
                     self.last_speed_buf_update_time = current_time_ms
 
-            # Is this a new kilometer record for this activity?
-            if total_meters < 1000:
-                continue
-            self.do_record_check(Keys.BEST_1K, total_seconds, total_meters, 1000)
-
-            # Is this a new mile record for this activity?
-            if total_meters < Units.METERS_PER_MILE:
-                continue
-            self.do_record_check(Keys.BEST_MILE, total_seconds, total_meters, Units.METERS_PER_MILE)
-
-            # Is this a new 5K record for this activity?
-            if total_meters < 5000:
-                continue
-            self.do_record_check(Keys.BEST_5K, total_seconds, total_meters, 5000)
-
-            # Is this a new 10K record for this activity?
-            if total_meters < 10000:
-                continue
-            self.do_record_check(Keys.BEST_10K, total_seconds, total_meters, 10000)
-
-            # Running-specific records:
-            if self.activity_type == Keys.TYPE_RUNNING_KEY:
-
-                # Is this a new 15K record for this activity?
-                if total_meters < 15000:
-                    continue
-                self.do_record_check(Keys.BEST_15K, total_seconds, total_meters, 15000)
-
-                # Is this a new half marathon record for this activity?
-                if total_meters < Units.METERS_PER_HALF_MARATHON:
-                    continue
-                self.do_record_check(Keys.BEST_HALF_MARATHON, total_seconds, total_meters, Units.METERS_PER_HALF_MARATHON)
-
-                # Is this a new marathon record for this activity?
-                if total_meters < Units.METERS_PER_MARATHON:
-                    continue
-                self.do_record_check(Keys.BEST_MARATHON, total_seconds, total_meters, Units.METERS_PER_MARATHON)
-
-            # Cycling-specific records:
-            if self.activity_type == Keys.TYPE_CYCLING_KEY:
-
-                # Is this a new metric century record for this activity?
-                if total_meters < 100000:
-                    continue
-                self.do_record_check(Keys.BEST_METRIC_CENTURY, total_seconds, total_meters, 100000)
-
-                # Is this a new century record for this activity?
-                if total_meters < Units.METERS_PER_MILE * 100.0:
-                    continue
-                self.do_record_check(Keys.BEST_CENTURY, total_seconds, total_meters, Units.METERS_PER_MILE * 100.0)
+            # Is this a new record for this activity? Distances are in increasing order, so stop at the first one that is too long.
+            for record_name, record_meters in self.record_distances:
+                if total_meters < record_meters:
+                    break
+                self.do_record_check(record_name, total_seconds, total_meters, record_meters)
 
     def append_location(self, date_time_ms, latitude, longitude, altitude, horizontal_accuracy, vertical_accuracy):
         """Adds another location to the analyzer. Locations should be sent in order."""
@@ -204,26 +277,77 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
         self.last_lon = longitude
         self.last_alt = altitude
 
-    def append_locations(self, locations):
-        """Adds many locations to the analyzer. Locations should be sent in order."""
+    def append_location_arrays(self, times_ms, latitudes, longitudes, altitudes, horizontal_accuracies=None):
+        """Adds many locations to the analyzer. Same as calling 'append_location' for each one, in order, but the math is vectorized,"""
+        """which makes it much faster. 'append_location' is for live data, which arrives a point at a time."""
+        times = np.asarray(times_ms)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        altitudes = np.asarray(altitudes, dtype=np.float64)
+        if horizontal_accuracies is None:
+            horizontal_accuracies = np.zeros(len(times))
+        horizontal_accuracies = np.asarray(horizontal_accuracies, dtype=np.float64)
+
+        # Ignore invalid readings.
+        valid = valid_location_mask(latitudes, longitudes, horizontal_accuracies)
+        times = times[valid]
+        latitudes = latitudes[valid]
+        longitudes = longitudes[valid]
+        altitudes = altitudes[valid]
+        if len(times) == 0:
+            return
 
-        for location in locations:
+        # Update the heat map.
+        self.location_heat_map.append_many(latitudes, longitudes)
 
-            # Required elements.
-            date_time = location[Keys.LOCATION_TIME_KEY]
-            latitude = location[Keys.LOCATION_LAT_KEY]
-            longitude = location[Keys.LOCATION_LON_KEY]
-            altitude = location[Keys.LOCATION_ALT_KEY]
+        # Each location is measured from the one before it. For the first location that's either nothing, in which
+        # case it only sets the start time, or the last location that was added.
+        if self.start_time_ms is None:
+            self.start_time_ms = times[0].item()
+            moved_times = times[1:]
+        else:
+            moved_times = times
+            latitudes = np.concatenate(([self.last_lat], latitudes))
+            longitudes = np.concatenate(([self.last_lon], longitudes))
+            altitudes = np.concatenate(([self.last_alt], altitudes))
 
-            # Optional elements.
-            horizontal_accuracy = 0.0
-            vertical_accuracy = 0.0
-            if Keys.LOCATION_HORIZONTAL_ACCURACY_KEY in location:
-                horizontal_accuracy = location[Keys.LOCATION_HORIZONTAL_ACCURACY_KEY]
-            if Keys.LOCATION_VERTICAL_ACCURACY_KEY in location:
-                vertical_accuracy = location[Keys.LOCATION_VERTICAL_ACCURACY_KEY]
+        if len(moved_times) > 0:
 
-            self.append_location(date_time, latitude, longitude, altitude, horizontal_accuracy, vertical_accuracy)
+            # Update totals and averages.
+            distances = self.total_distance + np.cumsum(haversine_distances(latitudes, longitudes, altitudes))
+            self.total_distance = float(distances[-1])
+            moved_times_list = moved_times.tolist()
+            self.distance_buf.extend([[date_time_ms, total_distance] for date_time_ms, total_distance in zip(moved_times_list, distances.tolist())])
+            vertical = np.diff(altitudes)
+            self.total_vertical = self.total_vertical + float(np.sum(vertical[vertical > 0.0]))
+            elapsed_ms = [date_time_ms - self.start_time_ms for date_time_ms in moved_times_list]
+            elapsed_indexes = np.flatnonzero(np.asarray(elapsed_ms) > 0)
+            if len(elapsed_indexes) > 0:
+                last_index = elapsed_indexes[-1]
+                self.avg_speed = float(distances[last_index]) / (elapsed_ms[last_index] / 1000.0)
+
+            # Update the split calculations.
+            self.do_split_checks(elapsed_ms, distances, 1000, self.km_splits)
+            self.do_split_checks(elapsed_ms, distances, Units.METERS_PER_MILE, self.mile_splits)
+
+        self.last_time_ms = times[-1].item()
+        self.last_lat = float(latitudes[-1])
+        self.last_lon = float(longitudes[-1])
+        self.last_alt = float(altitudes[-1])
+
+    def append_locations(self, locations):
+        """Adds many locations to the analyzer. Locations should be sent in order."""
+        """Takes either the list of dictionaries stored in the activity or a StreamCodec.StreamData object."""
+        stream_data = StreamCodec.from_values(Keys.APP_LOCATIONS_KEY, locations)
+        if len(stream_data) == 0:
+            return
+
+        # Optional elements.
+        horizontal_accuracies = None
+        if Keys.LOCATION_HORIZONTAL_ACCURACY_KEY in stream_data.columns:
+            horizontal_accuracies = np.nan_to_num(stream_data.column(Keys.LOCATION_HORIZONTAL_ACCURACY_KEY), nan=0.0)
+
+        self.append_location_arrays(stream_data.times, stream_data.column(Keys.LOCATION_LAT_KEY), stream_data.column(Keys.LOCATION_LON_KEY), stream_data.column(Keys.LOCATION_ALT_KEY), horizontal_accuracies)
     
     def examine_interval_peak(self, start_index, end_index):
         """Examines a line of near-constant pace/speed."""
@@ -288,48 +412,17 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
                         if interval is not None:
                             filtered_interval_list.append(interval)
 
-                    # Do a k-means analysis on the computed speed/pace blocks so we can get rid of any outliers.
+                    # Cluster the speed/pace blocks so we can get rid of any outliers. Blocks that aren't in the slowest
+                    # cluster are the intervals. Only lines that were long enough to have a speed block are considered.
                     significant_intervals = []
-                    num_speed_blocks = len(self.speed_blocks)
-                    if num_speed_blocks >= 2:
-
-                        # Make the data two dimensional because this is needed for the k means algorithm.
-                        x1 = np.array(self.speed_blocks)
-                        x2 = np.array([1] * num_speed_blocks)
-                        X = np.array(list(zip(x1, x2))).reshape(num_speed_blocks, 2)
-
-                        # Determine the maximum value of k.
-                        max_k = 10
-                        if num_speed_blocks < max_k:
-                            max_k = num_speed_blocks
-
-                        # Run k means for each possible k.
-                        best_k = 0
-                        best_labels = []
-                        steepest_slope = 0
-                        distortions = []
-                        for k in range(1, max_k):
-                            kmeans_model = KMeans(n_clusters=k, n_init=10).fit(X)
-                            distances = cdist(X, kmeans_model.cluster_centers_, 'euclidean')
-                            distances_sum = sum(np.min(distances, axis = 1))
-                            distortion = distances_sum / X.shape[0]
-                            distortions.append(distortion)
-
-                            # Use the elbow method to find the best value for k.
-                            if len(distortions) >= 2 and k >= 2:
-                                slope = (distortions[k-1] + distortions[k-2]) / 2
-
-                                if best_k == 0 or slope > steepest_slope:
-                                    best_k = k
-                                    best_labels = kmeans_model.labels_
-                                    steepest_slope = slope
-
-                        # Save off the significant peaks.
-                        interval_index = 0
-                        for label in best_labels:
+                    timed_interval_list = [interval for interval in filtered_interval_list if interval[2] > 10]
+                    if len(timed_interval_list) >= 2:
+                        speeds = [interval[4] for interval in timed_interval_list]
+                        min_stddev = INTERVAL_SPEED_RESOLUTION * statistics.mean(speeds)
+                        _, labels = Ckmeans.cluster_with_best_k(speeds, MAX_INTERVAL_SPEED_CLUSTERS, min_stddev)
+                        for interval, label in zip(timed_interval_list, labels):
                             if label >= 1:
-                                significant_intervals.append(filtered_interval_list[interval_index])
-                            interval_index = interval_index + 1
+                                significant_intervals.append(interval)
 
                     results[Keys.ACTIVITY_INTERVALS_KEY] = significant_intervals
 
@@ -340,6 +433,13 @@ class LocationAnalyzer(SensorAnalyzer.SensorAnalyzer):
         results[Keys.MILE_SPLITS] = self.mile_splits
         results[Keys.KM_SPLITS] = self.km_splits
 
+        # Best speed for each duration, which is what the user's pace-duration curve is built from.
+        if len(self.distance_buf) > 1:
+            times = [item[0] for item in self.distance_buf]
+            distances = [item[1] for item in self.distance_buf]
+            pace_curve = MeanMaximal.compute_rate_curve(times, distances, max_gap_secs=PACE_CURVE_MAX_GAP_SECS)
+            results[Keys.PACE_CURVE] = [[duration, round(speed, 3)] for duration, speed in pace_curve]
+
         return results
 
     def create_speed_graph(self):
@@ -23,6 +23,7 @@
 # SOFTWARE.
 """Heat map for location values."""
 
+import collections
 import HeatMap
 from decimal import *
 
@@ -34,5 +35,10 @@ class LocationHeatMap(HeatMap.HeatMap):
         getcontext().prec = 5
 
     def append(self, lat, lon):
-        data = frozenset((Decimal(lat), Decimal(lon)))
+        # Decimal(x) is exact, and compares and hashes the same as x, so there's no need to pay for the conversion.
+        data = frozenset((float(lat), float(lon)))
         super(LocationHeatMap, self).append(data)
+
+    def append_many(self, lats, lons):
+        """Same as calling append for each location."""
+        self.append_counts(collections.Counter(map(frozenset, zip(lats.tolist(), lons.tolist()))))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Bounded, thread-safe, least-recently-used cache with per-entry expiry."""
+
+import collections
+import threading
+import time
+
+class LruCache(object):
+    """Least-recently-used cache. Entries are dropped once they expire, or when the cache is full and they are the least recently used."""
+
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self.entries = collections.OrderedDict() # key -> (value, expiry)
+        self.lock = threading.Lock()
+        super(LruCache, self).__init__()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key):
+        """Returns the cached value, or None if it isn't cached or has expired."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expiry = entry
+            if now >= expiry:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expiry):
+        """Caches the value until the expiry time (UNIX timestamp)."""
+        with self.lock:
+            self.entries[key] = (value, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Removes the entry, if it is cached."""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_matching(self, predicate):
+        """Removes every entry for which predicate(key, value) is True."""
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if predicate(key, entry[0])]:
+                del self.entries[key]
+
+    def clear(self):
+        """Removes every entry."""
+        with self.lock:
+            self.entries.clear()
@@ -22,109 +22,225 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 """Given a lat/lon, searches world maps to determine the political entity containing that position."""
+"""The maps are preprocessed into flat arrays of polygon rings along with a grid index of the rings' bounding boxes, so that a search"""
+"""only tests the rings that could contain the point. The preprocessed maps are cached in a binary file, which loads much faster than"""
+"""the GeoJSON, and one searcher is shared by everything in the process."""
 
-import inspect
+import hashlib
 import os
-import sys
+import threading
+import numpy as np
 import GeoJsonReader
 
-# Locate and load the statistics module (the functions we're using in are made obsolete in Python 3, but we want to work in Python 2, also)
-currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-libmathdir = os.path.join(currentdir, 'LibMath', 'python')
-sys.path.insert(0, libmathdir)
-import graphics
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+WORLD_MAP_FILE = os.path.join(DATA_DIR, 'world.geo.json')
+US_STATES_MAP_FILE = os.path.join(DATA_DIR, 'us_states.geo.json')
+CANADIAN_PROVINCES_MAP_FILE = os.path.join(DATA_DIR, 'canada.geo.json')
+CACHE_FILE = os.path.join(DATA_DIR, 'map_search_cache.npz')
 
-class MapSearch(object):
-    """Given a lat/lon, searches world maps to determine the political entity containing that position."""
+CACHE_FORMAT_VERSION = 1 # Bump this whenever the preprocessed arrays change
+GRID_CELL_DEGREES = 2.0 # Size of the cells in the bounding box index
+GRID_ROWS = int(180.0 / GRID_CELL_DEGREES)
+GRID_COLUMNS = int(360.0 / GRID_CELL_DEGREES)
 
-    def __init__(self, world_data_url, us_data_url, canadian_data_url):
-        self.world_data = GeoJsonReader.GeoJsonReader()
-        self.world_data.read(world_data_url)
-        self.world_coordinates = self.world_data.name_to_coordinate_map()
+LAYER_NAMES = [ 'world', 'us', 'canada' ]
 
-        self.us_data = GeoJsonReader.GeoJsonReader()
-        self.us_data.read(us_data_url)
-        self.us_coordinates = self.us_data.name_to_coordinate_map()
+g_map_search = None
+g_map_search_lock = threading.Lock()
 
-        self.canadian_data = GeoJsonReader.GeoJsonReader()
-        self.canadian_data.read(canadian_data_url)
-        self.canadian_coordinates = self.canadian_data.name_to_coordinate_map()
+def get_map_search():
+    """Returns the searcher shared by everything in the process, loading it the first time it's needed."""
+    global g_map_search
+    with g_map_search_lock:
+        if g_map_search is None:
+            g_map_search = MapSearch(WORLD_MAP_FILE, US_STATES_MAP_FILE, CANADIAN_PROVINCES_MAP_FILE, CACHE_FILE)
+    return g_map_search
 
-        self.last_country = None
-        self.last_us_state = None
-        self.last_canadian_province = None
+def grid_cell(lat, lon):
+    """Returns the row and column of the grid cell containing the point."""
+    row = min(max(int(np.floor((lat + 90.0) / GRID_CELL_DEGREES)), 0), GRID_ROWS - 1)
+    column = min(max(int(np.floor((lon + 180.0) / GRID_CELL_DEGREES)), 0), GRID_COLUMNS - 1)
+    return row, column
 
-        super(MapSearch, self).__init__()
+def is_point_in_ring(lons, lats, lat, lon):
+    """Returns True if the point is within the ring, using the even-odd rule. Each vertex is tested against the edge from the previous one."""
+    prev_lons = np.roll(lons, 1)
+    prev_lats = np.roll(lats, 1)
+    crosses = (lats > lat) != (prev_lats > lat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersect_lons = (prev_lons - lons) * (lat - lats) / (prev_lats - lats) + lons
+    return np.count_nonzero(crosses & (lon < intersect_lons)) % 2 == 1
 
-    def is_in_region(self, region, lat, lon):
-        """Returns True if the specified lat and lon is within the bounds of the given polygon."""
-        if isinstance(region, list):
-            if graphics.is_point_in_poly_array(lon, lat, region):
-                return True
-            for subregion in region:
-                if self.is_in_region(subregion, lat, lon):
-                    return True
-        return False
-
-    def is_in_country(self, country_name, lat, lon):
-        """Returns True if the specified lat and lon is within the bounds of the given country."""
-        coordinate_list = self.world_coordinates[country_name]
-        return self.is_in_region(coordinate_list, lat, lon)
+def rings_from_geometry(geometry):
+    """Returns the rings (lists of [lon, lat]) of a Polygon or MultiPolygon, holes included."""
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
 
-    def which_country(self, lat, lon):
-        """Given a lat/lon, returns the name of the country in which it falls, or empty string if not found."""
+class MapLayer(object):
+    """One map (countries, for example) as flat arrays. The vertices of every ring are stored one after the other, with ring_starts"""
+    """giving where each ring begins, and the grid index lists the rings whose bounding boxes overlap each cell."""
 
-        # Test against the last country we used, since there's a good chance it'll be in the same one.
-        if self.last_country:
-            if self.is_in_country(self.last_country, lat, lon):
-                return self.last_country
+    ARRAY_NAMES = [ 'names', 'ring_features', 'ring_starts', 'lons', 'lats', 'ring_bounds', 'cell_starts', 'cell_rings' ]
 
-        # Loop through each country until we find a match.
-        for country_name in self.world_coordinates.keys():
-            if self.is_in_country(country_name, lat, lon):
-                self.last_country = country_name
-                return country_name
-        return None
+    def __init__(self, arrays):
+        self.names = arrays['names']
+        self.ring_features = arrays['ring_features']
+        self.ring_starts = arrays['ring_starts']
+        self.lons = arrays['lons']
+        self.lats = arrays['lats']
+        self.ring_bounds = arrays['ring_bounds'] # min lon, min lat, max lon, max lat
+        self.cell_starts = arrays['cell_starts']
+        self.cell_rings = arrays['cell_rings']
+        super(MapLayer, self).__init__()
 
-    def is_in_us_state(self, state_name, lat, lon):
-        """Returns True if the specified lat and lon is within the bounds of the given US state."""
-        coordinate_list = self.us_coordinates[state_name]
-        return self.is_in_region(coordinate_list, lat, lon)
+    @staticmethod
+    def from_geojson(data):
+        """Preprocesses parsed GeoJSON."""
+        names = []
+        ring_features = []
+        ring_lengths = []
+        points = []
+        for feature in data['features']:
+            for ring in rings_from_geometry(feature['geometry']):
+                if len(ring) == 0:
+                    continue
+                ring_features.append(len(names))
+                ring_lengths.append(len(ring))
+                points.extend(ring)
+            names.append(feature['properties']['name'])
 
-    def which_us_state(self, lat, lon):
-        """Given a lat/lon, returns the name of the US state in which it falls, or empty string if not found."""
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        ring_starts = np.concatenate(([0], np.cumsum(ring_lengths))).astype(np.int64)
+        lons = np.ascontiguousarray(points[:, 0])
+        lats = np.ascontiguousarray(points[:, 1])
+        ring_bounds = np.array([[lons[start:end].min(), lats[start:end].min(), lons[start:end].max(), lats[start:end].max()] for start, end in zip(ring_starts[:-1], ring_starts[1:])], dtype=np.float64).reshape(-1, 4)
+
+        # Index the rings by the grid cells that their bounding boxes overlap.
+        cells = []
+        cell_ring_list = []
+        for ring_index, (min_lon, min_lat, max_lon, max_lat) in enumerate(ring_bounds):
+            min_row, min_column = grid_cell(min_lat, min_lon)
+            max_row, max_column = grid_cell(max_lat, max_lon)
+            rows, columns = np.meshgrid(np.arange(min_row, max_row + 1), np.arange(min_column, max_column + 1), indexing='ij')
+            ring_cells = (rows * GRID_COLUMNS + columns).ravel()
+            cells.append(ring_cells)
+            cell_ring_list.append(np.full(len(ring_cells), ring_index))
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64)
+        cell_rings = np.concatenate(cell_ring_list) if cell_ring_list else np.zeros(0, dtype=np.int64)
+        order = np.argsort(cells, kind='stable')
+        cell_starts = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=GRID_ROWS * GRID_COLUMNS))))
+
+        return MapLayer({ 'names': np.array(names, dtype=np.str_), 'ring_features': np.array(ring_features, dtype=np.int32),
+            'ring_starts': ring_starts, 'lons': lons, 'lats': lats, 'ring_bounds': ring_bounds,
+            'cell_starts': cell_starts.astype(np.int32), 'cell_rings': cell_rings[order].astype(np.int32) })
+
+    def arrays(self):
+        """The arrays that make up the layer, for storing in the cache."""
+        return dict((name, getattr(self, name)) for name in MapLayer.ARRAY_NAMES)
+
+    def search(self, lat, lon):
+        """Returns the name of the first feature that contains the point, or None if there isn't one."""
+        row, column = grid_cell(lat, lon)
+        cell = row * GRID_COLUMNS + column
+        candidates = self.cell_rings[self.cell_starts[cell]:self.cell_starts[cell + 1]]
+        bounds = self.ring_bounds[candidates]
+        candidates = candidates[(bounds[:, 0] <= lon) & (lon <= bounds[:, 2]) & (bounds[:, 1] <= lat) & (lat <= bounds[:, 3])]
+
+        # A feature contains the point if an odd number of its rings do, which takes care of holes (and of islands within lakes, etc.)
+        odd_features = set()
+        for ring in candidates:
+            start = self.ring_starts[ring]
+            end = self.ring_starts[ring + 1]
+            if is_point_in_ring(self.lons[start:end], self.lats[start:end], lat, lon):
+                feature = int(self.ring_features[ring])
+                if feature in odd_features:
+                    odd_features.remove(feature)
+                else:
+                    odd_features.add(feature)
+        if len(odd_features) == 0:
+            return None
+        return str(self.names[min(odd_features)])
+
+class MapSearch(object):
+    """Given a lat/lon, searches world maps to determine the political entity containing that position."""
+
+    def __init__(self, world_file_name, us_file_name, canadian_file_name, cache_file_name=None):
+        file_names = [ world_file_name, us_file_name, canadian_file_name ]
 
-        # Test against the last state we used, since there's a good chance it'll be in the same one.
-        if self.last_us_state:
-            if self.is_in_us_state(self.last_us_state, lat, lon):
-                return self.last_us_state
+        # The cache is only used if it was made from exactly these maps.
+        sources = []
+        for file_name in file_names:
+            with open(file_name, 'rb') as source_file:
+                sources.append(source_file.read())
+        source_hash = MapSearch.hash_sources(sources)
+
+        layers = None
+        if cache_file_name is not None:
+            layers = MapSearch.load_cache(cache_file_name, source_hash)
+        if layers is None:
+            layers = []
+            for source in sources:
+                reader = GeoJsonReader.GeoJsonReader()
+                reader.parse(source)
+                layers.append(MapLayer.from_geojson(reader.data))
+            if cache_file_name is not None:
+                MapSearch.save_cache(cache_file_name, source_hash, layers)
+
+        self.world_layer, self.us_layer, self.canadian_layer = layers
+        super(MapSearch, self).__init__()
 
-        # Loop through each state until we find a match.
-        for state_name in self.us_coordinates.keys():
-            if self.is_in_us_state(state_name, lat, lon):
-                self.last_us_state = state_name
-                return state_name
-        return None
+    @staticmethod
+    def hash_sources(sources):
+        """Hash of the map files, used to tell whether the cache is out of date."""
+        h = hashlib.blake2b(digest_size=32)
+        h.update(str(CACHE_FORMAT_VERSION).encode())
+        for source in sources:
+            h.update(str(len(source)).encode())
+            h.update(source)
+        return h.hexdigest()
 
-    def is_in_canadian_province(self, province_name, lat, lon):
-        """Returns True if the specified lat and lon is within the bounds of the given US state."""
-        coordinate_list = self.canadian_coordinates[province_name]
-        return self.is_in_region(coordinate_list, lat, lon)
+    @staticmethod
+    def load_cache(cache_file_name, source_hash):
+        """Returns the layers from the cache file, or None if there isn't a usable cache."""
+        try:
+            with np.load(cache_file_name, allow_pickle=False) as cache:
+                if str(cache['source_hash']) != source_hash:
+                    return None
+                return [MapLayer(dict((name, cache[layer_name + '_' + name]) for name in MapLayer.ARRAY_NAMES)) for layer_name in LAYER_NAMES]
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def save_cache(cache_file_name, source_hash, layers):
+        """Writes the layers to the cache file. Written to a temporary file first, so other processes never see a partial cache."""
+        arrays = { 'source_hash': np.array(source_hash) }
+        for layer_name, layer in zip(LAYER_NAMES, layers):
+            for name, array in layer.arrays().items():
+                arrays[layer_name + '_' + name] = array
+        temp_file_name = cache_file_name + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(temp_file_name, 'wb') as temp_file:
+                np.savez(temp_file, **arrays)
+            os.replace(temp_file_name, cache_file_name)
+        except OSError:
+            # Not being able to write the cache only costs time.
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+
+    def which_country(self, lat, lon):
+        """Given a lat/lon, returns the name of the country in which it falls, or None if not found."""
+        return self.world_layer.search(lat, lon)
+
+    def which_us_state(self, lat, lon):
+        """Given a lat/lon, returns the name of the US state in which it falls, or None if not found."""
+        return self.us_layer.search(lat, lon)
 
     def which_canadian_province(self, lat, lon):
-        """Given a lat/lon, returns the name of the Canadian province in which it falls, or empty string if not found."""
-
-        # Test against the last province we used, since there's a good chance it'll be in the same one.
-        if self.last_canadian_province:
-            if self.is_in_canadian_province(self.last_canadian_province, lat, lon):
-                return self.last_canadian_province
-
-        # Loop through each province until we find a match.
-        for province_name in self.canadian_coordinates.keys():
-            if self.is_in_canadian_province(province_name, lat, lon):
-                self.last_canadian_province = province_name
-                return province_name
-        return None
+        """Given a lat/lon, returns the name of the Canadian province in which it falls, or None if not found."""
+        return self.canadian_layer.search(lat, lon)
 
     def search_map(self, lat, lon):
         """Given a lat/lon, returns an array containing the place description, from most significant to least significant, i.e. ['United States', 'Florida']"""
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Mean-maximal curves, i.e., the best average of a sensor value (power, for example) for each of a range of durations."""
+
+import numpy as np
+
+MAX_GAP_SECS = 5.0 # A reading is assumed to hold until the next one, but for no longer than this. Longer gaps count as zero.
+CURVE_GROWTH = 1.03 # Beyond a minute, each duration in the curve is this much longer than the last
+ROUND_DURATIONS = [120, 300, 600, 720, 1200, 1800, 3600, 5400, 7200, 10800] # Durations that are always in the curve, because they're commonly asked for
+MAX_GRID_SECS = 2 * 86400 # Longest duration considered when deciding whether a duration is on the grid
+
+def reading_holds(offsets, max_gap_secs=MAX_GAP_SECS):
+    """How long (seconds) each reading holds, given the reading times in seconds. A reading holds until the next one, but for no longer"""
+    """than max_gap_secs. The last reading holds for a second."""
+    return np.minimum(np.append(np.diff(offsets), 1.0), max_gap_secs)
+
+def integrate_to_seconds(offsets, values, holds, seconds):
+    """Running total, from the first reading, at each of the given times (seconds, on the same scale as the offsets, none before the first reading)."""
+    """The offsets have to be in order."""
+
+    # Running total at the start of each reading.
+    totals = np.concatenate(([0.0], np.cumsum(values * holds)))
+
+    # Running total at each time: the total at the start of the reading in effect, plus that reading's part.
+    indexes = np.searchsorted(offsets, seconds, side='right') - 1
+    return totals[indexes] + values[indexes] * np.minimum(seconds - offsets[indexes], holds[indexes])
+
+def cumulative_seconds(times_ms, values, max_gap_secs=MAX_GAP_SECS):
+    """Integrates the readings, treating each one as constant until the next, and returns the running total at each whole second."""
+    """Element i of the result is the integral from the first reading to i seconds after it, so the average over any whole"""
+    """number of seconds is a difference of two elements. Works regardless of the sample rate and of gaps in the data."""
+    times = np.asarray(times_ms, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) == 0:
+        return np.zeros(1)
+    if np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        values = values[order]
+
+    # Seconds since the first reading, and how long each reading holds.
+    offsets = (times - times[0]) / 1000.0
+    holds = reading_holds(offsets, max_gap_secs)
+
+    num_seconds = int(np.floor(offsets[-1] + holds[-1]))
+    return integrate_to_seconds(offsets, values, holds, np.arange(num_seconds + 1, dtype=np.float64))
+
+def grid_durations(num_seconds):
+    """Returns the durations (seconds), no longer than num_seconds, that every curve is evaluated at: every second for"""
+    """the first minute, then spaced geometrically, plus the round durations."""
+    durations = set(range(1, min(60, num_seconds) + 1))
+    duration = 60.0
+    while duration < num_seconds:
+        durations.add(int(round(duration)))
+        duration = duration * CURVE_GROWTH
+    for duration in ROUND_DURATIONS:
+        if duration <= num_seconds:
+            durations.add(duration)
+    return durations
+
+GRID_DURATIONS = grid_durations(MAX_GRID_SECS)
+
+def is_grid_duration(duration):
+    """Returns True if every curve long enough to reach the duration has a value for it, i.e., if curves from different"""
+    """activities can be compared at that duration."""
+    return duration in GRID_DURATIONS
+
+def curve_durations(num_seconds, required_durations=()):
+    """Returns the durations (seconds) at which to evaluate a curve: the grid durations plus the required durations and the full length."""
+    durations = grid_durations(num_seconds)
+    for duration in required_durations:
+        if duration <= num_seconds:
+            durations.add(duration)
+    if num_seconds > 0:
+        durations.add(num_seconds)
+    return sorted(durations)
+
+def mean_maximal(totals, durations):
+    """Returns the best average for each duration, given the running totals from cumulative_seconds."""
+    """Each duration is a single vectorized pass over the totals."""
+    best_averages = []
+    for duration in durations:
+        best_averages.append(float(np.max(totals[duration:] - totals[:-duration])) / duration)
+    return best_averages
+
+def compute_curve(times_ms, values, required_durations=(), max_gap_secs=MAX_GAP_SECS):
+    """Returns the mean-maximal curve as a list of [duration (seconds), best average] pairs."""
+    return compute_curve_from_totals(cumulative_seconds(times_ms, values, max_gap_secs), required_durations)
+
+def compute_curve_from_totals(totals, required_durations=()):
+    """Same as compute_curve, for when the running totals from cumulative_seconds are needed for something else as well."""
+    durations = curve_durations(len(totals) - 1, required_durations)
+    return [[duration, best_average] for duration, best_average in zip(durations, mean_maximal(totals, durations))]
+
+def compute_rate_curve(times_ms, running_totals, required_durations=(), max_gap_secs=MAX_GAP_SECS):
+    """Like compute_curve, but for a running total, such as distance. Returns the best rate of change (speed, for example)"""
+    """for each duration. The rate between two readings is assumed to be constant."""
+    times = np.asarray(times_ms, dtype=np.float64)
+    running_totals = np.asarray(running_totals, dtype=np.float64)
+    if len(times) == 0:
+        return []
+    if np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        running_totals = running_totals[order]
+
+    # The rate over each interval is assigned to the reading at the start of the interval. Readings with the same timestamp have no interval.
+    elapsed_secs = np.diff(times) / 1000.0
+    rates = np.divide(np.diff(running_totals), elapsed_secs, out=np.zeros(len(elapsed_secs)), where=elapsed_secs > 0)
+    return compute_curve(times, np.append(rates, 0.0), required_durations, max_gap_secs)
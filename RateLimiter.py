@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Sliding window API rate limiting, with a per-process backend and a database backed one that is shared by all processes."""
+
+import math
+import threading
+import time
+
+# Requests allowed, per key, per endpoint, in the given number of seconds. Endpoints that aren't listed only count against
+# the key's overall limits. These are the expensive requests, the ones that cause imports, analysis, or plan generation.
+ENDPOINT_LIMITS = {}
+ENDPOINT_LIMITS['upload_activity_file'] = (10, 60)
+ENDPOINT_LIMITS['upload_activity_photo'] = (10, 60)
+ENDPOINT_LIMITS['add_activity'] = (10, 60)
+ENDPOINT_LIMITS['export_activity'] = (10, 60)
+ENDPOINT_LIMITS['refresh_analysis'] = (2, 60)
+ENDPOINT_LIMITS['refresh_personal_records'] = (2, 60)
+ENDPOINT_LIMITS['generate_workout_plan'] = (2, 60)
+ENDPOINT_LIMITS['generate_workout_plan_from_inputs'] = (2, 60)
+ENDPOINT_LIMITS['merge_activities'] = (2, 60)
+
+DAY_WINDOW = 86400
+BURST_WINDOW = 60
+
+class RateLimitResult(object):
+    """The outcome of a rate limit check."""
+
+    def __init__(self, allowed, limit, remaining, reset_time):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_time = reset_time # UNIX timestamp at which the window, and therefore the remaining count, rolls over
+        super(RateLimitResult, self).__init__()
+
+    def headers(self):
+        """Returns the HTTP response headers that describe this result, as a list of (name, value) tuples."""
+        headers = []
+        headers.append(('X-RateLimit-Limit', str(self.limit)))
+        headers.append(('X-RateLimit-Remaining', str(self.remaining)))
+        headers.append(('X-RateLimit-Reset', str(int(self.reset_time))))
+        if not self.allowed:
+            headers.append(('Retry-After', str(max(1, int(math.ceil(self.reset_time - time.time()))))))
+        return headers
+
+class LocalBackend(object):
+    """Keeps the counters in memory. Only suitable when a single process is serving API requests."""
+
+    def __init__(self):
+        self.counters = {} # (key, window length, window start) -> count
+        self.lock = threading.Lock()
+        self.last_pruned = 0
+        super(LocalBackend, self).__init__()
+
+    def prune(self, now):
+        """Drops counters for windows that can no longer affect a result, i.e., anything older than the previous window."""
+        for counter_key in list(self.counters.keys()):
+            _, window, window_start = counter_key
+            if window_start + (2 * window) <= now:
+                del self.counters[counter_key]
+        self.last_pruned = now
+
+    def increment(self, key, window, window_start, expiry, max_count):
+        """Increments the counter for the window, unless it has already reached max_count. Returns the new count, or None if the counter was full."""
+        with self.lock:
+            if window_start - self.last_pruned > BURST_WINDOW:
+                self.prune(window_start)
+            counter_key = (key, window, window_start)
+            count = self.counters.get(counter_key, 0)
+            if count >= max_count:
+                return None
+            self.counters[counter_key] = count + 1
+            return count + 1
+
+    def decrement(self, key, window, window_start):
+        """Takes back a request counted by increment."""
+        with self.lock:
+            counter_key = (key, window, window_start)
+            if self.counters.get(counter_key, 0) > 0:
+                self.counters[counter_key] = self.counters[counter_key] - 1
+
+    def count(self, key, window, window_start):
+        """Returns the counter for the window."""
+        with self.lock:
+            return self.counters.get((key, window, window_start), 0)
+
+class DatabaseBackend(object):
+    """Keeps the counters in the database so that the limits hold across processes and servers."""
+
+    def __init__(self, database):
+        self.database = database
+        super(DatabaseBackend, self).__init__()
+
+    def increment(self, key, window, window_start, expiry, max_count):
+        """Increments the counter for the window, unless it has already reached max_count. Returns the new count, or None if the counter was full."""
+        return self.database.increment_rate_limit_counter(key + ":" + str(window), window_start, expiry, max_count)
+
+    def decrement(self, key, window, window_start):
+        """Takes back a request counted by increment."""
+        self.database.decrement_rate_limit_counter(key + ":" + str(window), window_start)
+
+    def count(self, key, window, window_start):
+        """Returns the counter for the window."""
+        return self.database.retrieve_rate_limit_counter(key + ":" + str(window), window_start)
+
+class RateLimiter(object):
+    """Sliding window rate limiter. Approximates the number of requests in the trailing window from the counts of the"""
+    """current and previous fixed windows. Requests are only counted once every limit they fall under has allowed them,"""
+    """so rejected requests don't use up the quota."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        super(RateLimiter, self).__init__()
+
+    def capacity(self, key, limit, window, window_start, now):
+        """Returns the most requests the current window can hold, given how much of the previous window still overlaps the trailing window."""
+        previous_count = self.backend.count(key, window, window_start - window)
+        overlap = 1.0 - ((now - window_start) / window)
+        return max(0, int(math.floor(limit - (previous_count * overlap))))
+
+    def check(self, api_key, max_daily_rate, burst_rate, endpoint):
+        """Counts a request against the key's daily limit, its burst limit, and the endpoint's limit (if it has one), but only"""
+        """if all of them allow it. Returns the result for the most restrictive of those limits."""
+        now = time.time()
+        limits = []
+        limits.append((api_key, max_daily_rate, DAY_WINDOW))
+        if burst_rate > 0:
+            limits.append((api_key, burst_rate, BURST_WINDOW))
+        if endpoint in ENDPOINT_LIMITS:
+            endpoint_rate, endpoint_window = ENDPOINT_LIMITS[endpoint]
+            limits.append((api_key + ":" + endpoint, endpoint_rate, endpoint_window))
+
+        # Check every limit before counting the request against any of them.
+        windows = []
+        results = []
+        for key, limit, window in limits:
+            window_start = int(now // window) * window
+            capacity = self.capacity(key, limit, window, window_start, now)
+            current_count = self.backend.count(key, window, window_start)
+            windows.append((key, window, window_start, capacity))
+            results.append(RateLimitResult(current_count < capacity, limit, max(0, capacity - current_count - 1), window_start + window))
+
+        # Count it. The increment is conditional, so a concurrent request can still fill a window between the check and here,
+        # in which case the windows that were already counted are given back.
+        if all(result.allowed for result in results):
+            counted = []
+            for (key, window, window_start, capacity), result in zip(windows, results):
+                count = self.backend.increment(key, window, window_start, window_start + (2 * window), capacity)
+                if count is None:
+                    result.allowed = False
+                    result.remaining = 0
+                    for counted_key, counted_window, counted_window_start in counted:
+                        self.backend.decrement(counted_key, counted_window, counted_window_start)
+                    break
+                counted.append((key, window, window_start))
+                result.remaining = max(0, capacity - count)
+
+        result = None
+        for limit_result in results:
+            if result is None or (result.allowed and not limit_result.allowed) or (result.allowed == limit_result.allowed and limit_result.remaining < result.remaining):
+                result = limit_result
+        return result
@@ -1,24 +1,72 @@
 # Copyright 2018 Michael J Simms
 """Performs calculations on basic sensor information (heart rate, power, etc.)."""
 
+import numpy as np
+
+TIME_DTYPE = np.int64 # Timestamps, in milliseconds
+VALUE_DTYPE = np.float64
+
 class SensorAnalyzer(object):
     """Class for performing calculations on basic sensor information (heart rate, power, etc.)."""
+    """Readings are kept in a pair of arrays, a timestamp and a value, rather than as a Python object per reading. Whole streams can be"""
+    """added in one call with 'append_sensor_values' and the statistics are computed from the arrays when they're needed."""
+
+    __slots__ = ('activity_type', 'type', 'units', 'bests', 'num_readings', 'time_buf', 'value_buf')
 
     def __init__(self, sensor_type, units, activity_type):
         super(SensorAnalyzer, self).__init__()
         self.activity_type = activity_type
         self.type = sensor_type
         self.units = units
-        self.start_time = None
-        self.end_time = None
-        self.max_time = 0 # Timestamp of the maximum sensor value
-        self.max = 0.0 # Maximum sensor value
-        self.avg = 0.0 # Average sensor value
-        self.sum = 0.0 # Used in computing the average
-        self.readings = [] # All the readings
-        self.value_readings = [] # All the readings, just the value part
-        self.num_readings = 0 # Cached for efficiency
         self.bests = {} # Best times within the current activity (best mile, best 20 minute power, etc.)
+        self.num_readings = 0
+        self.time_buf = np.empty(0, dtype=TIME_DTYPE) # Has room to grow, only the first num_readings items are valid
+        self.value_buf = np.empty(0, dtype=VALUE_DTYPE)
+
+    @property
+    def times(self):
+        """Timestamps of the readings, in milliseconds."""
+        return self.time_buf[:self.num_readings]
+
+    @property
+    def values(self):
+        """Values of the readings."""
+        return self.value_buf[:self.num_readings]
+
+    @property
+    def start_time(self):
+        """Timestamp of the first reading, or None if there aren't any."""
+        if self.num_readings == 0:
+            return None
+        return int(self.time_buf[0])
+
+    @property
+    def end_time(self):
+        """Timestamp of the last reading, or None if there aren't any."""
+        if self.num_readings == 0:
+            return None
+        return int(self.time_buf[self.num_readings - 1])
+
+    @property
+    def max(self):
+        """Maximum sensor value. Zero if there aren't any readings, or if they're all negative."""
+        if self.num_readings == 0:
+            return 0.0
+        return max(0.0, float(np.max(self.values)))
+
+    @property
+    def max_time(self):
+        """Timestamp of the (first) maximum sensor value. Zero if there isn't a maximum."""
+        if self.max <= 0.0:
+            return 0
+        return int(self.times[np.argmax(self.values)])
+
+    @property
+    def avg(self):
+        """Average sensor value."""
+        if self.num_readings == 0:
+            return 0.0
+        return float(np.mean(self.values))
 
     def get_best_time(self, record_name):
         """Returns the time associated with the specified record, or None if not found."""
@@ -26,29 +74,37 @@ class SensorAnalyzer(object):
             return self.bests[record_name]
         return None
 
-    def update_maximum_value(self, date_time, reading):
-        """Computes the maximum value for the workout. Called by 'append_sensor_value'."""
-        if reading > self.max:
-            self.max_time = date_time
-            self.max = reading
-
-    def update_average_value(self, reading):
-        """Computes the average value for the workout. Called by 'append_sensor_value'."""
-        self.sum = self.sum + reading
-        if self.num_readings > 0:
-            self.avg = self.sum / self.num_readings
+    def reserve(self, num_readings):
+        """Makes sure there's room for the given number of readings. Grows geometrically, so appending one reading at a time is still linear."""
+        capacity = len(self.time_buf)
+        if num_readings <= capacity:
+            return
+        capacity = max(num_readings, 2 * capacity)
+        time_buf = np.empty(capacity, dtype=TIME_DTYPE)
+        value_buf = np.empty(capacity, dtype=VALUE_DTYPE)
+        time_buf[:self.num_readings] = self.times
+        value_buf[:self.num_readings] = self.values
+        self.time_buf = time_buf
+        self.value_buf = value_buf
 
     def append_sensor_value(self, date_time, value):
         """Adds another reading to the analyzer."""
-        if self.start_time is None:
-            self.start_time = date_time
-        self.end_time = date_time
-
+        self.reserve(self.num_readings + 1)
+        self.time_buf[self.num_readings] = date_time
+        self.value_buf[self.num_readings] = value
         self.num_readings = self.num_readings + 1
-        self.readings.append([date_time, value])
-        self.value_readings.append(value)
-        self.update_maximum_value(date_time, value)
-        self.update_average_value(value)
+
+    def append_sensor_values(self, times, values):
+        """Adds many readings to the analyzer. Same as calling 'append_sensor_value' for each one, in order."""
+        times = np.asarray(times)
+        values = np.asarray(values, dtype=VALUE_DTYPE)
+        num_new_readings = len(times)
+        if num_new_readings == 0:
+            return
+        self.reserve(self.num_readings + num_new_readings)
+        self.time_buf[self.num_readings:self.num_readings + num_new_readings] = times
+        self.value_buf[self.num_readings:self.num_readings + num_new_readings] = values
+        self.num_readings = self.num_readings + num_new_readings
 
     def analyze(self):
         """Called when all sensor readings have been processed."""
@@ -29,6 +29,7 @@ import AccelerometerAnalyzer
 import CadenceAnalyzer
 import HeartRateAnalyzer
 import PowerAnalyzer
+import StreamCodec
 
 def supported_sensor_types():
     return [Keys.APP_ACCELEROMETER_KEY, Keys.APP_CADENCE_KEY, Keys.APP_HEART_RATE_KEY, Keys.APP_POWER_KEY]
@@ -41,21 +42,22 @@ def create(sensor_type, activity_type, activity_user_id, data_mgr, user_mgr):
     elif sensor_type == Keys.APP_CADENCE_KEY:
         sensor_analyzer = CadenceAnalyzer.CadenceAnalyzer(activity_type)
     elif sensor_type == Keys.APP_HEART_RATE_KEY:
-        sensor_analyzer = HeartRateAnalyzer.HeartRateAnalyzer(activity_type)
+        sensor_analyzer = HeartRateAnalyzer.HeartRateAnalyzer(activity_type, activity_user_id, user_mgr)
     elif sensor_type == Keys.APP_POWER_KEY:
         sensor_analyzer = PowerAnalyzer.PowerAnalyzer(activity_type, activity_user_id, data_mgr, user_mgr)
     return sensor_analyzer
 
 def create_with_data(sensor_type, data, activity_type, activity_user_id, data_mgr, user_mgr):
     """Creates a sensor analyzer object of the specified type and loads it with the given data."""
+    """The data may be either a list, as stored in the activity, or a StreamCodec.StreamData object."""
     sensor_analyzer = create(sensor_type, activity_type, activity_user_id, data_mgr, user_mgr)
     if sensor_analyzer is not None:
         if sensor_type == Keys.APP_ACCELEROMETER_KEY:
+            if isinstance(data, StreamCodec.StreamData):
+                data = data.to_samples()
             for datum in data:
                 sensor_analyzer.append_sensor_value_from_dict(datum)
         else:
-            for datum in data:
-                time = int(float(list(datum.keys())[0]))
-                value = float(list(datum.values())[0])
-                sensor_analyzer.append_sensor_value(time, value)
+            times, values = StreamCodec.time_value_arrays(data)
+            sensor_analyzer.append_sensor_values(times, values)
     return sensor_analyzer
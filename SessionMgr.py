@@ -32,8 +32,12 @@ import uuid
 
 import AppDatabase
 import Keys
+import LruCache
 import SessionException
 
+SESSION_CACHE_SIZE = 10000 # Maximum number of validated session tokens to keep in memory
+SESSION_CACHE_MAX_AGE = 60.0 # Seconds before a cached token is checked against the database again, so logouts in other processes are noticed
+
 class SessionMgr(object):
     """Class for managing sessions. A user may have more than one session"""
 
@@ -83,6 +87,7 @@ class CustomSessionMgr(SessionMgr):
         super(SessionMgr, self).__init__()
         assert config is not None
         self.current_session_cookie = None
+        self.session_cache = LruCache.LruCache(SESSION_CACHE_SIZE)
         self.database = AppDatabase.MongoDatabase()
         self.database.connect(config)
 
@@ -92,12 +97,21 @@ class CustomSessionMgr(SessionMgr):
 
     def get_logged_in_username_from_cookie(self, session_cookie):
         """Returns the username associated with the specified session cookie."""
+        if session_cookie is None:
+            return None
+
+        # Recently validated tokens are cached, along with their expiry, so most checks don't need the database.
+        session_user = self.session_cache.get(session_cookie)
+        if session_user is not None:
+            return session_user
+
         session_user, session_expiry = self.database.retrieve_session_data(session_cookie)
         if session_user is not None and session_expiry is not None:
 
             # Is the token still valid.
             now = time.time()
             if now < session_expiry:
+                self.session_cache.set(session_cookie, session_user, min(session_expiry, now + SESSION_CACHE_MAX_AGE))
                 return session_user
 
             # Token is expired, so delete it.
@@ -109,6 +123,7 @@ class CustomSessionMgr(SessionMgr):
         session_cookie = str(uuid.uuid4())
         expiry = int(time.time() + 90.0 * 86400.0)
         if self.database.create_session_token(session_cookie, username, expiry):
+            self.session_cache.set(session_cookie, username, min(expiry, time.time() + SESSION_CACHE_MAX_AGE))
             self.current_session_cookie = session_cookie
             return session_cookie, expiry
         return None, None
@@ -123,6 +138,7 @@ class CustomSessionMgr(SessionMgr):
 
     def invalidate_session_token(self, session_cookie):
         """Removes the session token from the cache, and anywhere else it might be stored."""
+        self.session_cache.invalidate(session_cookie)
         self.database.delete_session_token(session_cookie)
 
 class CherryPySessionMgr(SessionMgr):
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Packed, columnar encoding of activity streams and a common reader for both the packed and the list-of-dictionaries forms."""
+
+import numpy as np
+from bson.binary import Binary
+import Keys
+
+TIME_DTYPE = '<i8'
+
+# Every column is stored as float64 unless all of a chunk's values survive a round trip through a smaller type, in which case the
+# smallest such type is used. The type is stored with the chunk, so packing never changes a value.
+FULL_COLUMN_DTYPE = '<f8'
+NARROW_COLUMN_DTYPES = [ '<i2', '<i4', '<f4' ] # Tried in this order
+
+# Chunks packed before the column types were stored with the chunk used these types.
+LEGACY_COLUMN_DTYPES = {}
+LEGACY_COLUMN_DTYPES[Keys.APP_LOCATIONS_KEY] = { Keys.LOCATION_LAT_KEY: '<f8', Keys.LOCATION_LON_KEY: '<f8', Keys.LOCATION_ALT_KEY: '<f8', Keys.LOCATION_HORIZONTAL_ACCURACY_KEY: '<f4', Keys.LOCATION_VERTICAL_ACCURACY_KEY: '<f4' }
+LEGACY_COLUMN_DTYPES[Keys.APP_ACCELEROMETER_KEY] = { Keys.ACCELEROMETER_AXIS_NAME_X: '<f4', Keys.ACCELEROMETER_AXIS_NAME_Y: '<f4', Keys.ACCELEROMETER_AXIS_NAME_Z: '<f4' }
+LEGACY_COLUMN_DTYPES[Keys.APP_HEART_RATE_KEY] = { Keys.STREAM_SAMPLE_VALUE_KEY: '<f4' }
+LEGACY_COLUMN_DTYPES[Keys.APP_CADENCE_KEY] = { Keys.STREAM_SAMPLE_VALUE_KEY: '<f4' }
+LEGACY_COLUMN_DTYPES[Keys.APP_POWER_KEY] = { Keys.STREAM_SAMPLE_VALUE_KEY: '<f4' }
+LEGACY_DEFAULT_COLUMN_DTYPES = { Keys.STREAM_SAMPLE_VALUE_KEY: '<f8' }
+
+def is_time_value_stream(stream_name):
+    """Locations and accelerometer readings are stored as dictionaries, everything else is a list of time/value pairs."""
+    return stream_name not in [ Keys.APP_LOCATIONS_KEY, Keys.APP_ACCELEROMETER_KEY ]
+
+def legacy_column_dtypes(stream_name):
+    """Returns the storage type of each of the stream's columns, for chunks that don't say what they are."""
+    if stream_name in LEGACY_COLUMN_DTYPES:
+        return LEGACY_COLUMN_DTYPES[stream_name]
+    return LEGACY_DEFAULT_COLUMN_DTYPES
+
+def narrowest_dtype(column):
+    """Returns the smallest storage type that holds every value of the (float64) column exactly, sign of zero included."""
+    with np.errstate(invalid='ignore', over='ignore'):
+        for dtype in NARROW_COLUMN_DTYPES:
+            narrowed = column.astype(dtype).astype(np.float64)
+            if np.array_equal(narrowed, column) and np.array_equal(np.signbit(narrowed), np.signbit(column)):
+                return dtype
+    return FULL_COLUMN_DTYPE
+
+
+class StreamData(object):
+    """Columnar view of a stream: an array of timestamps (ms) and one array per column. Time/value streams have a single 'value' column."""
+
+    def __init__(self, stream_name, times, columns):
+        self.stream_name = stream_name
+        self.times = times
+        self.columns = columns
+        super(StreamData, self).__init__()
+
+    def __len__(self):
+        return len(self.times)
+
+    def values(self):
+        """Returns the value array of a time/value stream."""
+        return self.columns[Keys.STREAM_SAMPLE_VALUE_KEY]
+
+    def column(self, name):
+        """Returns the named column."""
+        return self.columns[name]
+
+    def slice(self, start_time, end_time):
+        """Returns the portion of the stream that falls within the (inclusive) time range. Either end of the range may be None."""
+        if start_time is None and end_time is None:
+            return self
+        mask = np.ones(len(self.times), dtype=bool)
+        if start_time is not None:
+            mask &= self.times >= start_time
+        if end_time is not None:
+            mask &= self.times <= end_time
+        columns = {}
+        for name in self.columns:
+            columns[name] = self.columns[name][mask]
+        return StreamData(self.stream_name, self.times[mask], columns)
+
+    def to_samples(self):
+        """Converts to the list of dictionaries used by the stream store's samples list."""
+        times = self.times.tolist()
+        names = list(self.columns.keys())
+        columns = [self.columns[name].tolist() for name in names]
+        samples = []
+        for i, sample_time in enumerate(times):
+            sample = { Keys.STREAM_SAMPLE_TIME_KEY: sample_time }
+            for name, column in zip(names, columns):
+                sample[name] = column[i]
+            samples.append(sample)
+        return samples
+
+    def to_values(self):
+        """Converts to the form stored in the activity document, i.e. a list of { time: value } pairs or a list of dictionaries."""
+        if is_time_value_stream(self.stream_name):
+            return [{ str(sample_time): value } for sample_time, value in zip(self.times.tolist(), self.values().tolist())]
+        return self.to_samples()
+
+def pack_samples(stream_name, samples):
+    """Encodes a list of stream store samples as delta-encoded int64 timestamps plus one binary array per column."""
+    """Returns None if the samples can't be represented exactly, i.e. if they don't all have the same, numeric, fields or times aren't whole milliseconds."""
+    if not samples:
+        return None
+
+    names = [name for name in samples[0].keys() if name != Keys.STREAM_SAMPLE_TIME_KEY]
+
+    times = []
+    columns = dict((name, []) for name in names)
+    for sample in samples:
+        if len(sample) != len(names) + 1:
+            return None
+        sample_time = sample[Keys.STREAM_SAMPLE_TIME_KEY]
+        if isinstance(sample_time, bool) or not isinstance(sample_time, (int, float)) or int(sample_time) != sample_time:
+            return None
+        times.append(int(sample_time))
+        for name in names:
+            if name not in sample:
+                return None
+            value = sample[name]
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+            columns[name].append(value)
+
+    time_array = np.array(times, dtype=TIME_DTYPE)
+    if np.any(np.diff(time_array) < 0):
+        order = np.argsort(time_array, kind='stable')
+        time_array = time_array[order]
+        for name in names:
+            columns[name] = [columns[name][i] for i in order]
+
+    packed = {}
+    packed[Keys.STREAM_PACKED_COUNT_KEY] = len(times)
+    packed[Keys.STREAM_PACKED_TIMES_KEY] = Binary(np.diff(time_array, prepend=0).astype(TIME_DTYPE).tobytes())
+    packed_columns = {}
+    packed_dtypes = {}
+    for name in names:
+        column = np.array(columns[name], dtype=np.float64)
+        if not np.array_equal(column, columns[name]):
+            return None # Integers too big for a float64
+        packed_dtypes[name] = narrowest_dtype(column)
+        packed_columns[name] = Binary(column.astype(packed_dtypes[name]).tobytes())
+    packed[Keys.STREAM_PACKED_COLUMNS_KEY] = packed_columns
+    packed[Keys.STREAM_PACKED_DTYPES_KEY] = packed_dtypes
+    return packed
+
+def unpack(stream_name, packed):
+    """Decodes packed stream data. Columns are always float64; those stored as float64 are read-only views of the stored buffers."""
+    if Keys.STREAM_PACKED_DTYPES_KEY in packed:
+        dtypes = packed[Keys.STREAM_PACKED_DTYPES_KEY]
+    else:
+        dtypes = legacy_column_dtypes(stream_name)
+    times = np.cumsum(np.frombuffer(packed[Keys.STREAM_PACKED_TIMES_KEY], dtype=TIME_DTYPE))
+    columns = {}
+    packed_columns = packed[Keys.STREAM_PACKED_COLUMNS_KEY]
+    for name in packed_columns:
+        column = np.frombuffer(packed_columns[name], dtype=dtypes[name])
+        if column.dtype != np.float64:
+            column = column.astype(np.float64)
+        columns[name] = column
+    return StreamData(stream_name, times, columns)
+
+def from_samples(stream_name, samples):
+    """Builds a columnar view from a list of stream store samples."""
+    times = np.array([sample[Keys.STREAM_SAMPLE_TIME_KEY] for sample in samples], dtype=TIME_DTYPE)
+    columns = {}
+    if samples:
+        for name in samples[0].keys():
+            if name != Keys.STREAM_SAMPLE_TIME_KEY:
+                columns[name] = np.array([sample[name] if name in sample else np.nan for sample in samples], dtype=np.float64)
+    elif is_time_value_stream(stream_name):
+        columns[Keys.STREAM_SAMPLE_VALUE_KEY] = np.array([], dtype=np.float64)
+    return StreamData(stream_name, times, columns)
+
+def from_values(stream_name, values):
+    """Builds a columnar view from the form stored in the activity document."""
+    if isinstance(values, StreamData):
+        return values
+    if is_time_value_stream(stream_name):
+        times = np.fromiter((float(next(iter(value))) for value in values), dtype=np.float64, count=len(values)).astype(TIME_DTYPE)
+        value_array = np.fromiter((float(next(iter(value.values()))) for value in values), dtype=np.float64, count=len(values))
+        return StreamData(stream_name, times, { Keys.STREAM_SAMPLE_VALUE_KEY: value_array })
+    return from_samples(stream_name, values)
+
+def concatenate(stream_name, parts):
+    """Joins several pieces of the same stream, keeping the result in time order."""
+    parts = [part for part in parts if len(part) > 0]
+    if not parts:
+        return from_samples(stream_name, [])
+    if len(parts) == 1:
+        return parts[0]
+
+    names = set(parts[0].columns.keys())
+    for part in parts[1:]:
+        names &= set(part.columns.keys())
+    times = np.concatenate([part.times for part in parts])
+    columns = {}
+    for name in names:
+        columns[name] = np.concatenate([part.columns[name].astype(np.float64) for part in parts])
+
+    # Pieces overlap when data arrived out of order, or when older data is still in the activity document.
+    if np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        for name in names:
+            columns[name] = columns[name][order]
+    return StreamData(stream_name, times, columns)
+
+def time_value_arrays(data):
+    """Returns the (times, values) arrays of a time/value stream. Accepts either a StreamData object or a list of { time: value } pairs."""
+    if isinstance(data, StreamData):
+        return data.times, data.values()
+    stream_data = from_values(None, data)
+    return stream_data.times, stream_data.values()
+
+def time_value_pairs(data):
+    """Iterates over a time/value stream as (time, value) tuples. Accepts either a StreamData object or a list of { time: value } pairs."""
+    times, values = time_value_arrays(data)
+    return zip(times.tolist(), values.tolist())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Training load and time in zone calculations: normalized power (NP), variability index (VI), intensity factor (IF), the intensity"""
+"""score (TSS), and the time spent in each power and heart rate training zone. Everything is computed from the per second running"""
+"""totals in MeanMaximal.cumulative_seconds, so one pass over the readings serves the power curve as well as all of these."""
+
+import numpy as np
+import FtpCalculator
+import HeartRateCalculator
+import IntensityCalculator
+import Keys
+
+ROLLING_WINDOW_SECS = 30 # Normalized power is computed from the 30 second rolling average
+
+def rolling_averages(totals, window_secs=ROLLING_WINDOW_SECS):
+    """Returns the average over every window of window_secs consecutive seconds, given the running totals from MeanMaximal.cumulative_seconds."""
+    if len(totals) <= window_secs:
+        return np.zeros(0)
+    return (totals[window_secs:] - totals[:-window_secs]) / window_secs
+
+def normalized_power(totals):
+    """Fourth root of the average of the fourth powers of the 30 second rolling average. None if there's less than 30 seconds of data."""
+    rolling = rolling_averages(totals)
+    if len(rolling) == 0:
+        return None
+    return float(np.mean(rolling ** 4)) ** 0.25
+
+def time_in_zones(seconds, zone_bounds):
+    """Takes the average value of each second and returns the number of seconds spent in each zone. The bounds are the upper"""
+    """limits (inclusive) of each zone, in order. The last zone has no upper limit, so there's one more zone than there are bounds."""
+    zone_indexes = np.searchsorted(np.asarray(zone_bounds, dtype=np.float64), seconds, side='left')
+    return np.bincount(zone_indexes, minlength=len(zone_bounds) + 1).tolist()
+
+def power_zone_bounds(ftp):
+    """Upper limits of the power training zones."""
+    calc = FtpCalculator.FtpCalculator()
+    return calc.power_training_zones(ftp)
+
+def heart_rate_zone_bounds(user_mgr, user_id):
+    """Upper limits of the user's heart rate training zones, or None if the user's maximum heart rate isn't known. A maximum heart"""
+    """rate set by the user takes precedence over the estimated one, same as when listing the zones."""
+    max_hr = float(user_mgr.retrieve_user_setting(user_id, Keys.USER_MAXIMUM_HEART_RATE_KEY))
+    if max_hr < 1.0:
+        max_hr = user_mgr.estimate_max_heart_rate(user_id)
+        if max_hr is None or max_hr < 1.0:
+            return None
+    resting_hr = float(user_mgr.retrieve_user_setting(user_id, Keys.USER_RESTING_HEART_RATE_KEY))
+    calc = HeartRateCalculator.HeartRateCalculator()
+    zones = calc.training_zones(max_hr, resting_hr, None)
+
+    # The last bound is the maximum heart rate. Leave it off so that anything above an estimated maximum counts towards the top zone.
+    return zones[:-1]
+
+def power_results(totals, ftp):
+    """Returns NP and VI and, if the FTP is known, IF, the intensity score and the time spent in each power zone."""
+    results = {}
+    num_seconds = len(totals) - 1
+    if num_seconds <= 0:
+        return results
+
+    np_value = normalized_power(totals)
+    if np_value is not None:
+        results[Keys.NORMALIZED_POWER] = np_value
+
+        # Compute the variability index (VI = NP / AP).
+        ap = float(totals[-1]) / num_seconds
+        if ap > 0.0:
+            results[Keys.VARIABILITY_INDEX] = np_value / ap
+
+    # The rest depends on the user's FTP.
+    if ftp is None or ftp <= 0.0:
+        return results
+    if np_value is not None:
+        calc = IntensityCalculator.IntensityCalculator()
+        results[Keys.INTENSITY_FACTOR] = np_value / ftp
+        results[Keys.INTENSITY_SCORE] = calc.calculate_intensity_score_from_power(num_seconds, np_value, ftp)
+    results[Keys.POWER_ZONE_DISTRIBUTION] = time_in_zones(np.diff(totals), power_zone_bounds(ftp))
+    return results
+
+def heart_rate_results(totals, zone_bounds):
+    """Returns the time spent in each heart rate zone. Seconds without a reading are left out, rather than counted as the lowest zone."""
+    if zone_bounds is None or len(totals) < 2:
+        return {}
+    seconds = np.diff(totals)
+    return { Keys.HEART_RATE_ZONE_DISTRIBUTION: time_in_zones(seconds[seconds > 0.0], zone_bounds) }
@@ -26,6 +26,11 @@
 import Keys
 import VO2MaxCalculator
 
+# Efforts from the pace-duration curve that are used to estimate VO2Max. Shorter efforts overstate it and the formula
+# isn't meant for anything much longer than a marathon.
+PACE_CURVE_MIN_SECS = 12 * 60
+PACE_CURVE_MAX_SECS = 4 * 60 * 60
+
 class TrainingPaceCalculator(object):
     """Computes training paces based on previous efforts"""
 
@@ -87,11 +92,32 @@ class TrainingPaceCalculator(object):
         vo2max = vo2maxCalc.estimate_vo2max_from_race_distance_in_meters(race_distance_meters, race_time_secs)
         return self.calc_from_vo2max(vo2max)
 
+    def calc_from_pace_curve(self, pace_curve):
+        """Give the athlete's pace-duration curve, a list of [seconds, meters per second], returns the suggested long run, easy run, tempo run,"""
+        """and speed run paces. Each effort on the curve is treated as a race and the best resulting VO2Max is used. Returns an empty dictionary"""
+        """if the curve has no efforts of a suitable length."""
+        vo2maxCalc = VO2MaxCalculator.VO2MaxCalculator()
+        best_vo2max = None
+        for duration, speed in pace_curve:
+            if duration < PACE_CURVE_MIN_SECS or duration > PACE_CURVE_MAX_SECS or speed <= 0.0:
+                continue
+            try:
+                vo2max = vo2maxCalc.estimate_vo2max_from_race_distance_in_meters(speed * duration, duration)
+            except:
+                # Implausibly fast, probably bad location data.
+                continue
+            if best_vo2max is None or vo2max > best_vo2max:
+                best_vo2max = vo2max
+        if best_vo2max is None:
+            return {}
+        return self.calc_from_vo2max(best_vo2max)
+
 def main():
     """Entry point when testing from the command line."""
     calc = TrainingPaceCalculator()
     print(calc.calc_from_race_distance_in_meters(5000, 18*60))
     print(calc.calc_from_hr(188, 49))
+    print(calc.calc_from_pace_curve([[720, 4.8], [1080, 4.63], [2400, 4.3]]))
 
 if __name__ == "__main__":
     main()
@@ -356,7 +356,7 @@ def convert_to_string_in_specified_unit_system(unit_system, in_value, in_distanc
         out_value = "{:.2f} ".format(in_value) + get_power_units_str()
     elif label in Keys.INTENSITY_SCORES:
         out_value = "{:.2f} ".format(in_value)
-    elif label == Keys.VARIABILITY_INDEX:
+    elif label == Keys.VARIABILITY_INDEX or label == Keys.INTENSITY_FACTOR:
         out_value = "{:.2f} ".format(in_value)
     else:
         out_value = str(in_value)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Content addressed storage for uploaded activity files."""
+"""An upload is decoded and written once, and named by the hash of its contents. The import task is given that hash instead of the file,"""
+"""reads the stored copy directly, and the same copy is then kept as the archived original."""
+
+import base64
+import contextlib
+import hashlib
+import os
+import tempfile
+import uuid
+import InputChecker
+
+FILESYSTEM_STORE = "filesystem" # Files in a local directory, the web servers and the import workers have to share it
+GRIDFS_STORE = "gridfs" # Files in MongoDB, for when the web servers and the import workers don't share a filesystem
+
+BASE64_CHUNK_LEN = 1024 * 1024 # Characters of base64 text to decode at a time, must be a multiple of four
+GRIDFS_BUCKET_NAME = "staged_uploads"
+
+def decoded_size(encoded_data):
+    """Returns the (approximate) number of bytes the base64 text decodes to, without decoding it."""
+    return (len(encoded_data) * 3) // 4
+
+def decode_base64_chunks(encoded_data):
+    """Decodes base64 text a piece at a time, so the decoded file never has to be in memory all at once."""
+    if "\n" in encoded_data or "\r" in encoded_data:
+        encoded_data = encoded_data.replace("\r", "").replace("\n", "") # Line breaks would throw off the alignment of the pieces
+    for start in range(0, len(encoded_data), BASE64_CHUNK_LEN):
+        chunk = encoded_data[start:start + BASE64_CHUNK_LEN]
+        chunk = chunk.replace(" ", "+") # Some JS base64 encoders replace plus with space, so we need to undo that.
+        yield base64.b64decode(chunk)
+
+def new_content_hasher():
+    """Returns the hash object used to name stored files."""
+    return hashlib.blake2b(digest_size=32)
+
+def check_content_hash(content_hash):
+    """Content hashes come back to us in task messages and end up in file names, so make sure they're what we expect."""
+    if content_hash is None or not InputChecker.is_hex_str(content_hash):
+        raise Exception("Invalid content hash.")
+
+class FilesystemStore(object):
+    """Keeps uploaded files in a local directory."""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        super(FilesystemStore, self).__init__()
+
+    def file_name(self, content_hash):
+        """Returns the name of the file that holds the upload with the given hash."""
+        check_content_hash(content_hash)
+        return os.path.join(self.root_dir, content_hash)
+
+    def put_chunks(self, chunks):
+        """Writes the data, hashing it on the way. Returns [content hash, size in bytes]."""
+        if not os.path.exists(self.root_dir):
+            os.makedirs(self.root_dir, exist_ok=True)
+
+        # The hash isn't known until the end, so write to a temporary name and then move it into place.
+        # If the same file was already uploaded then this just replaces it with an identical copy.
+        hasher = new_content_hasher()
+        size = 0
+        temp_file_name = os.path.join(self.root_dir, str(uuid.uuid4()) + ".tmp")
+        try:
+            with open(temp_file_name, 'wb') as temp_file:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+                    size = size + len(chunk)
+            content_hash = hasher.hexdigest()
+            os.replace(temp_file_name, self.file_name(content_hash))
+        except:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+        return content_hash, size
+
+    @contextlib.contextmanager
+    def local_file(self, content_hash):
+        """Provides the name of a local file that holds the upload. This is the stored file itself, nothing is copied."""
+        file_name = self.file_name(content_hash)
+        if not os.path.isfile(file_name):
+            raise Exception("The uploaded file " + content_hash + " was not found.")
+        yield file_name
+
+    def delete(self, content_hash):
+        """Removes the upload with the given hash, if it exists."""
+        file_name = self.file_name(content_hash)
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+class GridFsStore(object):
+    """Keeps uploaded files in GridFS."""
+
+    def __init__(self, database):
+        import gridfs
+        self.bucket = gridfs.GridFSBucket(database, bucket_name=GRIDFS_BUCKET_NAME)
+        super(GridFsStore, self).__init__()
+
+    def file_ids(self, content_hash):
+        """Returns the GridFS IDs of the files stored under the given hash."""
+        check_content_hash(content_hash)
+        return [grid_out._id for grid_out in self.bucket.find({ "filename": content_hash })]
+
+    def put_chunks(self, chunks):
+        """Writes the data, hashing it on the way. Returns [content hash, size in bytes]."""
+
+        # The hash isn't known until the end, so write under a temporary name and then rename it.
+        hasher = new_content_hasher()
+        size = 0
+        grid_in = self.bucket.open_upload_stream(str(uuid.uuid4()))
+        try:
+            for chunk in chunks:
+                hasher.update(chunk)
+                grid_in.write(chunk)
+                size = size + len(chunk)
+            grid_in.close()
+        except:
+            grid_in.abort()
+            raise
+
+        # Only keep one copy of any given file.
+        content_hash = hasher.hexdigest()
+        if len(self.file_ids(content_hash)) == 0:
+            self.bucket.rename(grid_in._id, content_hash)
+        else:
+            self.bucket.delete(grid_in._id)
+        return content_hash, size
+
+    @contextlib.contextmanager
+    def local_file(self, content_hash):
+        """Provides the name of a local file that holds the upload. The importer needs a file, so this is a temporary copy."""
+        check_content_hash(content_hash)
+        temp_fd, temp_file_name = tempfile.mkstemp()
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                self.bucket.download_to_stream_by_name(content_hash, temp_file)
+            yield temp_file_name
+        finally:
+            os.remove(temp_file_name)
+
+    def delete(self, content_hash):
+        """Removes the upload with the given hash, if it exists."""
+        for file_id in self.file_ids(content_hash):
+            self.bucket.delete(file_id)
@@ -28,6 +28,7 @@ import datetime
 import sys
 import time
 import AppDatabase
+import DurationCurves
 import FtpCalculator
 import Keys
 
@@ -346,27 +347,37 @@ class UserMgr(object):
         ONE_YEAR = (365.25 * 24.0 * 60.0 * 60.0)
         one_year_ago = int(time.time()) - ONE_YEAR
         recent_hrs = [v for k,v in stored_max_hrs.items() if int(k) >= one_year_ago]
+        if len(recent_hrs) == 0:
+            return None
         return max(recent_hrs)
 
     def estimate_ftp(self, user_id):
-        """Looks through the list of 20 minute power bests in the database"""
-        """and returns an FTP estimation using the highest value from the last year."""
+        """Returns an FTP estimation using the user's cycling power-duration curve from the last year. Activities analyzed before the"""
+        """curves existed don't contribute to them, so the list of 20 minute power bests in the database is used alongside the curve."""
         if self.database is None:
             raise Exception("No database.")
         if user_id is None:
             raise Exception("Bad parameter.")
 
-        # Read the stored 20 minute power bests out of the database.
-        stored_20_min_power_bests = self.database.retrieve_user_setting(user_id, Keys.BEST_CYCLING_20_MINUTE_POWER_LIST_KEY)
-        if stored_20_min_power_bests is None:
-            return None
-
         # Only consider values from the last year.
         ONE_YEAR = (365.25 * 24.0 * 60.0 * 60.0)
-        one_year_ago = int(time.time()) - ONE_YEAR
-        recent_bests = [v for k,v in stored_20_min_power_bests.items() if int(k) >= one_year_ago]
+        now = int(time.time())
+        one_year_ago = now - ONE_YEAR
+
+        # Read the user's best efforts from the last year.
         calc = FtpCalculator.FtpCalculator()
-        return calc.estimate_ftp_from_20_min_power(max(recent_bests))
+        power_curve = DurationCurves.retrieve_curve(self.database, user_id, Keys.POWER_CURVE, Keys.CYCLING_ACTIVITIES, one_year_ago, now)
+        calc.add_power_curve(power_curve)
+
+        # Read the stored 20 minute power bests out of the database.
+        stored_20_min_power_bests = self.database.retrieve_user_setting(user_id, Keys.BEST_CYCLING_20_MINUTE_POWER_LIST_KEY)
+        if stored_20_min_power_bests is not None:
+            calc.best_20min.extend([v for k,v in stored_20_min_power_bests.items() if int(k) >= one_year_ago])
+
+        ftp = calc.estimate_ftp()
+        if ftp > 0.0:
+            return ftp
+        return None
 
     def default_user_setting(self, key):
         """Returns the default value for the specified setting."""
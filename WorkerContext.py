@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Resources shared by every task that runs in a worker process."""
+"""Connecting to the database, setting up the celery app used for scheduling, and loading the maps are done once, when the worker process"""
+"""starts, rather than by every task. test/WorkerTaskBenchmark.py measures the difference."""
+
+import os
+import threading
+import AnalysisScheduler
+import Config
+import DataMgr
+import MapSearch
+import UserMgr
+
+g_worker_context = None
+g_worker_context_lock = threading.Lock()
+
+class WorkerContext(object):
+    """The configuration, data manager, and user manager that the tasks in this process use."""
+
+    def __init__(self, config):
+        root_dir = os.path.dirname(os.path.abspath(__file__))
+        self.config = config
+        self.analysis_scheduler = AnalysisScheduler.AnalysisScheduler()
+        self.data_mgr = DataMgr.DataMgr(config=config, root_url="file://" + root_dir, analysis_scheduler=self.analysis_scheduler, import_scheduler=None)
+        self.user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+        super(WorkerContext, self).__init__()
+
+    def terminate(self):
+        """Closes the database connections."""
+        for mgr in [self.data_mgr, self.user_mgr]:
+            if mgr.database is not None and mgr.database.conn is not None:
+                mgr.database.conn.close()
+            mgr.terminate()
+
+def get_worker_context():
+    """Returns the context for this process, creating it if needed. Normally it already exists, having been created by"""
+    """'init_worker_context', but it won't be when a task is run directly, or by a worker that doesn't use child processes."""
+    global g_worker_context
+
+    with g_worker_context_lock:
+        if g_worker_context is None:
+            g_worker_context = WorkerContext(Config.Config())
+        return g_worker_context
+
+def init_worker_context():
+    """Called when a worker process starts. Database connections can't be carried across a fork, so this has to happen in the child process."""
+    get_worker_context()
+    MapSearch.get_map_search() # Used to describe the location of every activity that's analyzed
+
+def shutdown_worker_context():
+    """Called when a worker process exits."""
+    global g_worker_context
+
+    with g_worker_context_lock:
+        if g_worker_context is not None:
+            g_worker_context.terminate()
+            g_worker_context = None
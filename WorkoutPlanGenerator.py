@@ -16,7 +16,6 @@ import traceback
 import uuid
 import AnalysisScheduler
 import BikePlanGenerator
-import Config
 import DataMgr
 import UserMgr
 import Keys
@@ -24,6 +23,7 @@ import Units
 import PlanGenerator
 import RunPlanGenerator
 import SwimPlanGenerator
+import WorkerContext
 import WorkoutScheduler
 
 g_model = None
@@ -36,10 +36,14 @@ except ModuleNotFoundError:
 class WorkoutPlanGenerator(object):
     """Class for performing the computationally expensive workout plan generation tasks."""
 
-    def __init__(self, config, user_obj):
+    def __init__(self, config, user_obj, data_mgr=None, user_mgr=None):
         self.user_obj = user_obj
-        self.data_mgr = DataMgr.DataMgr(config=config, root_url="", analysis_scheduler=AnalysisScheduler.AnalysisScheduler(), import_scheduler=None)
-        self.user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+        if data_mgr is None:
+            data_mgr = DataMgr.DataMgr(config=config, root_url="", analysis_scheduler=AnalysisScheduler.AnalysisScheduler(), import_scheduler=None)
+        if user_mgr is None:
+            user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+        self.data_mgr = data_mgr
+        self.user_mgr = user_mgr
         super(WorkoutPlanGenerator, self).__init__()
 
     def log_error(self, log_str):
@@ -107,7 +111,7 @@ class WorkoutPlanGenerator(object):
     def update_summary_data_cb(context, activity, user_id):
         """Callback function for update_summary_data."""
         if Keys.ACTIVITY_SUMMARY_KEY not in activity:
-            context.data_mgr.schedule_activity_analysis(activity, user_id)
+            context.data_mgr.schedule_activity_analysis(activity[Keys.ACTIVITY_ID_KEY], user_id, False)
 
     def optional_fetch_from_dict(self, dict, key):
         """Utility function for calculate_inputs."""
@@ -426,7 +430,7 @@ class WorkoutPlanGenerator(object):
             print("Failed to remove old workouts from the database.")
 
         # Schedule the new workouts.
-        scheduler = WorkoutScheduler.WorkoutScheduler(user_id)
+        scheduler = WorkoutScheduler.WorkoutScheduler(user_id, self.user_mgr)
         return scheduler.schedule_workouts(workouts, start_time)
 
     def store_plan(self, user_id, scheduled_workouts):
@@ -583,7 +587,8 @@ def generate_workout_plan_for_user(user_str, internal_task_id):
     print("Starting workout plan generation...")
 
     user_obj = json.loads(user_str)
-    generator = WorkoutPlanGenerator(Config.Config(), user_obj)
+    context = WorkerContext.get_worker_context()
+    generator = WorkoutPlanGenerator(context.config, user_obj, context.data_mgr, context.user_mgr)
     generator.generate_plan_for_user(g_model)
 
     print("Workout plan generation finished.")
@@ -595,7 +600,8 @@ def generate_workout_plan_from_inputs(inputs, internal_task_id):
 
     print("Starting workout plan generation...")
 
-    generator = WorkoutPlanGenerator(Config.Config(), None)
+    context = WorkerContext.get_worker_context()
+    generator = WorkoutPlanGenerator(context.config, None, context.data_mgr, context.user_mgr)
     generator.generate_plan_from_inputs(g_model, inputs)
 
     print("Workout plan generation finished.")
@@ -22,9 +22,11 @@ import statistics
 class WorkoutScheduler(object):
     """Organizes workouts."""
 
-    def __init__(self, user_id):
+    def __init__(self, user_id, user_mgr=None):
         self.user_id = user_id
-        self.user_mgr = UserMgr.UserMgr(config=Config.Config(), session_mgr=None)
+        if user_mgr is None:
+            user_mgr = UserMgr.UserMgr(config=Config.Config(), session_mgr=None)
+        self.user_mgr = user_mgr
 
     def score_schedule(self, week):
         """Computes a score for the schedule, based on the daily stress scores."""
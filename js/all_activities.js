@@ -145,8 +145,44 @@ function common_create_tags(root_url, tags)
     });
 }
 
+/// Heart rate and power readings from the most recent call to common_process_sensordata, for computing the time in zones when
+/// the activity summary doesn't have it.
+let zone_fallback_readings = {};
+
+/// @function common_process_zone_distributions
+/// Draws the time in zone charts. The distributions are computed when the activity is analyzed and are part of the activity summary.
+/// Activities that haven't been analyzed by the current version of the analysis code may not have them, so in that case they are
+/// computed from the sensor readings, which requires the max heart rate and FTP (zero if not known).
+function common_process_zone_distributions(summarydata, is_foot_based_activity, max_hr, ftp)
+{
+    let hr_zones = summarydata["Heart Rate Zone Distribution"];
+    let power_zones = summarydata["Power Zone Distribution"];
+
+    if (hr_zones == undefined && max_hr > 0 && "Heart Rate" in zone_fallback_readings)
+    {
+        hr_zones = compute_heart_rate_zone_distribution(max_hr, zone_fallback_readings["Heart Rate"]);
+    }
+    if (hr_zones != undefined && hr_zones.length > 0 && Math.max.apply(Math, hr_zones) > 0)
+    {
+        graph_name = "Heart Rate Zone Distribution"
+        draw_bar_chart(hr_zones, "Heart Rate Zone Distribution", get_graph_color(graph_name));
+    }
+    if (!is_foot_based_activity)
+    {
+        if (power_zones == undefined && ftp > 0 && "Power" in zone_fallback_readings)
+        {
+            power_zones = compute_power_zone_distribution(ftp, zone_fallback_readings["Power"]);
+        }
+        if (power_zones != undefined && power_zones.length > 0 && Math.max.apply(Math, power_zones) > 0)
+        {
+            graph_name = "Power Zone Distribution"
+            draw_bar_chart(power_zones, "Power Zone Distribution", get_graph_color(graph_name));
+        }
+    }
+}
+
 /// @function common_process_sensordata
-function common_process_sensordata(root_url, activity_id, sensordata, is_foot_based_activity, start_time_ms, max_hr, ftp, deletable)
+function common_process_sensordata(root_url, activity_id, sensordata, is_foot_based_activity, start_time_ms, deletable)
 {
     for (key in sensordata)
     {
@@ -174,13 +210,7 @@ function common_process_sensordata(root_url, activity_id, sensordata, is_foot_ba
         }
         else if (key == "Heart Rate")
         {
-            let hr_zones = compute_heart_rate_zone_distribution(max_hr, new_data);
-
-            if (hr_zones.length > 0 && Math.max.apply(Math, hr_zones) > 0)
-            {
-                graph_name = "Heart Rate Zone Distribution"
-                draw_bar_chart(hr_zones, "Heart Rate Zone Distribution", get_graph_color(graph_name));
-            }
+            zone_fallback_readings[key] = new_data;
             draw_graph(root_url, activity_id, start_time_ms, end_time_ms, new_data, key, "BPM", get_graph_color(key), deletable);
         }
         else if (key == "Cadence")
@@ -189,16 +219,7 @@ function common_process_sensordata(root_url, activity_id, sensordata, is_foot_ba
         }
         else if (key == "Power")
         {
-            let power_zones = compute_power_zone_distribution(ftp, new_data);
-
-            if (!is_foot_based_activity)
-            {
-                if (power_zones.length > 0 && Math.max.apply(Math, power_zones) > 0)
-                {
-                    graph_name = "Power Zone Distribution"
-                    draw_bar_chart(power_zones, "Power Zone Distribution", get_graph_color(graph_name));
-                }
-            }
+            zone_fallback_readings[key] = new_data;
             draw_graph(root_url, activity_id, start_time_ms, end_time_ms, new_data, key, "Watts", get_graph_color(key), deletable);
         }
         else if (key == "Temperature")
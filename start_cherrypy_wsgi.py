@@ -818,7 +818,7 @@ def api(env, start_response):
         g_session_mgr.set_current_session(cookie)
 
         # Handle the API request.
-        content, response_code = g_front_end.api_internal(verb, tuple(path), params, cookie)
+        content, response_code, rate_limit_headers = g_front_end.api_internal(verb, tuple(path), params, cookie)
 
         # Housekeeping.
         g_session_mgr.clear_current_session()
@@ -827,12 +827,21 @@ def api(env, start_response):
         if response_code == 200:
             headers = []
             headers.append(('Content-type', 'application/json'))
+            headers.extend(rate_limit_headers)
 
             content = content.encode('utf-8')
             start_response('200 OK', headers)
             return [content]
         elif response_code == 404:
             return handle_error_404(start_response)
+        elif response_code == 429:
+            headers = []
+            headers.append(('Content-type', 'text/plain; charset=utf-8'))
+            headers.extend(rate_limit_headers)
+
+            content = content.encode('utf-8')
+            start_response('429 Too Many Requests', headers)
+            return [content]
     except ApiException.ApiException as e:
         return handle_error(start_response, e.code)
     except:
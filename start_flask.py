@@ -540,6 +540,7 @@ def api(version, method):
     """Endpoint for API calls."""
     response = ""
     code = 500
+    headers = []
     try:
         # The the API params.
         if flask.request.method == 'GET':
@@ -567,11 +568,12 @@ def api(version, method):
             if user_id is not None:
 
                 # Make sure the key is not being abused.
-                if not g_app.data_mgr.check_api_rate(api_key, max_rate):
-                    user_id = None
-                    code = 429
+                rate_limit = g_app.data_mgr.check_api_rate(api_key, max_rate, method)
+                headers = rate_limit.headers()
+                if not rate_limit.allowed:
                     response = "Excessive API requests."
                     g_app.log_error(response)
+                    return response, 429, headers
         else:
 
             # API key not provided, check the session key.
@@ -605,7 +607,7 @@ def api(version, method):
         code = 500
     except:
         code = 500
-    return response, code
+    return response, code, headers
 
 @g_flask_app.route('/google_maps')
 def google_maps():
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the time taken to compute the original (SHA-512 text) activity hash with the chained BLAKE2b hash."""
+"""Uses synthetic tracks so that no database is needed. Also checks that hashing in pieces gives the same result as hashing all at once."""
+
+import argparse
+import inspect
+import os
+import random
+import sys
+import timeit
+
+# Locate and load the hasher module.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import ActivityHasher
+import Keys
+
+def make_activity(num_points):
+    """Returns an activity with a random walk for a track, one point per second."""
+    locations = []
+    lat = 40.0
+    lon = -75.0
+    alt = 100.0
+    for i in range(num_points):
+        lat = lat + random.uniform(-0.00005, 0.00005)
+        lon = lon + random.uniform(-0.00005, 0.00005)
+        alt = alt + random.uniform(-0.5, 0.5)
+        locations.append({ Keys.LOCATION_TIME_KEY: 1600000000000 + 1000 * i, Keys.LOCATION_LAT_KEY: lat, Keys.LOCATION_LON_KEY: lon, Keys.LOCATION_ALT_KEY: alt })
+    return { Keys.ACTIVITY_LOCATIONS_KEY: locations }
+
+def time_ms(func):
+    """Returns the result of calling the function and the time it took, in milliseconds."""
+    start_time = timeit.default_timer()
+    result = func()
+    return result, (timeit.default_timer() - start_time) * 1000.0
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated list of track sizes to test", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    print("Points\tSHA-512 text (ms)\tBLAKE2b chained (ms)\tAppend 1% (ms)")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        activity = make_activity(size)
+        hasher = ActivityHasher.ActivityHasher(activity)
+        _, text_ms = time_ms(lambda: hasher.hash(ActivityHasher.HASH_FORMAT_SHA512_TEXT))
+        full_hash, chained_ms = time_ms(lambda: hasher.hash(ActivityHasher.HASH_FORMAT_BLAKE2B_CHAINED))
+
+        # Hash most of the track, then resume from the saved state once the rest has been appended.
+        num_before = size - size // 100
+        partial_hasher = ActivityHasher.ActivityHasher({ Keys.ACTIVITY_LOCATIONS_KEY: activity[Keys.ACTIVITY_LOCATIONS_KEY][:num_before] })
+        state = partial_hasher.chained_hasher().state()
+        resumed_hash, append_ms = time_ms(lambda: hasher.chained_hasher(state).hexdigest())
+
+        if resumed_hash != full_hash:
+            print("Resumed hash does not match the full hash!")
+        if not hasher.verify(full_hash) or not hasher.verify(hasher.hash(ActivityHasher.HASH_FORMAT_SHA512_TEXT)):
+            print("Hash verification failed!")
+        print(str(size) + "\t" + "{:.3f}".format(text_ms) + "\t" + "{:.3f}".format(chained_ms) + "\t" + "{:.3f}".format(append_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares activity lookup latency, by activity ID, for collections of increasing size."""
+"""Uses a scratch database, which is dropped when the benchmark is finished."""
+
+import argparse
+import inspect
+import os
+import random
+import re
+import sys
+import timeit
+import uuid
+import pymongo
+
+# Locate and load the database module.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import AppDatabase
+import Keys
+
+BENCHMARK_DATABASE_NAME = 'openworkout_benchmark'
+
+def populate(collection, num_activities):
+    """Fills the collection with activity documents. Returns the list of IDs."""
+    activity_ids = [str(uuid.uuid4()) for _ in range(num_activities)]
+    batch = []
+    for activity_id in activity_ids:
+        batch.append({ Keys.ACTIVITY_ID_KEY: activity_id, Keys.ACTIVITY_NAME_KEY: "", Keys.ACTIVITY_START_TIME_KEY: 0 })
+        if len(batch) >= 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    return activity_ids
+
+def time_lookups(func, activity_ids, num_lookups):
+    """Returns the average time, in milliseconds, of a lookup."""
+    sample_ids = [random.choice(activity_ids) for _ in range(num_lookups)]
+    start_time = timeit.default_timer()
+    for activity_id in sample_ids:
+        func(activity_id)
+    return (timeit.default_timer() - start_time) * 1000.0 / num_lookups
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="localhost:27017", help="The database URL", required=False)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated list of collection sizes to test", required=False)
+    parser.add_argument("--lookups", default=200, help="Number of lookups to time, per collection size", type=int, required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    conn = pymongo.MongoClient('mongodb://' + args.url + '/?uuidRepresentation=pythonLegacy')
+    conn.drop_database(BENCHMARK_DATABASE_NAME)
+    database = conn[BENCHMARK_DATABASE_NAME]
+
+    # Point the app's database object at the scratch collections so we time the real code path.
+    db = AppDatabase.MongoDatabase()
+    db.activities_collection = database['activities']
+    db.activity_streams_collection = database['activity_streams']
+    db.activities_collection.create_index(Keys.ACTIVITY_ID_KEY)
+
+    def regex_lookup(activity_id):
+        return db.activities_collection.find_one({ Keys.ACTIVITY_ID_KEY: re.compile(activity_id, re.IGNORECASE) }, db.list_excluded_activity_keys())
+
+    print("Activities\tExact (ms)\tRegex (ms)")
+    try:
+        activity_ids = []
+        for size in [int(x) for x in args.sizes.split(',')]:
+            activity_ids.extend(populate(db.activities_collection, size - len(activity_ids)))
+            exact_ms = time_lookups(db.retrieve_activity_small, activity_ids, args.lookups)
+            regex_ms = time_lookups(regex_lookup, activity_ids, args.lookups)
+            print(str(size) + "\t" + "{:.3f}".format(exact_ms) + "\t" + "{:.3f}".format(regex_ms))
+    finally:
+        conn.drop_database(BENCHMARK_DATABASE_NAME)
+
+if __name__ == "__main__":
+    main()
@@ -97,6 +97,12 @@ def request_workout_intensity_total(api_url, cookies, start_time, end_time):
     payload = {'start_time': start_time, 'end_time': end_time}
     return send_get_request(url, payload, cookies)
 
+def request_duration_curve(api_url, cookies, curve, start_time, end_time):
+    """Tests get_duration_curve()."""
+    url = api_url + "get_duration_curve"
+    payload = {'curve': curve, 'start_time': start_time, 'end_time': end_time}
+    return send_get_request(url, payload, cookies)
+
 def logout(root_url, cookies):
     """Ends the existing session."""
     url = root_url + "logout"
@@ -132,6 +138,28 @@ def run_login_tests(api_url, username, password, realname):
 
     return cookies
 
+def check_duration_curve(curve, response_str):
+    """Checks that a get_duration_curve() response is a list of [seconds, value], in increasing order of duration, where a longer effort"""
+    """is never better than a shorter one. Returns the curve."""
+    points = json.loads(response_str)
+    if not isinstance(points, list):
+        raise Exception("The " + curve + " curve is not a list.")
+    previous_duration = None
+    previous_value = None
+    for point in points:
+        if not isinstance(point, list) or len(point) != 2:
+            raise Exception("The " + curve + " curve has a malformed point: " + str(point))
+        duration, value = point
+        if duration <= 0 or value <= 0.0:
+            raise Exception("The " + curve + " curve has an invalid point: " + str(point))
+        if previous_duration is not None and duration <= previous_duration:
+            raise Exception("The " + curve + " curve is not sorted by duration.")
+        if previous_value is not None and value > previous_value:
+            raise Exception("The " + curve + " curve's best " + str(duration) + " second effort is better than its best shorter effort.")
+        previous_duration = duration
+        previous_value = value
+    return points
+
 def run_workout_analysis_tests(api_url, cookies):
     """Runs unit tests relating to workout analysis."""
     print_test_title("Request a sum of workout intensities")
@@ -144,6 +172,23 @@ def run_workout_analysis_tests(api_url, cookies):
         raise Exception("Failed to logout.")
     print("Test passed!\n")
 
+    for curve in ['power', 'pace']:
+        print_test_title("Request the " + curve + " curve")
+        code, week_curve_str = request_duration_curve(api_url, cookies, curve, start_time, end_time)
+        if code != 200:
+            raise Exception("Failed to retrieve the " + curve + " curve.")
+        week_curve = check_duration_curve(curve, week_curve_str)
+
+        # The curve for a longer time range includes the shorter one's activities, so it has to be at least as good at every duration.
+        code, year_curve_str = request_duration_curve(api_url, cookies, curve, now - (52 * one_week), end_time)
+        if code != 200:
+            raise Exception("Failed to retrieve the " + curve + " curve.")
+        year_curve = dict(check_duration_curve(curve, year_curve_str))
+        for duration, value in week_curve:
+            if duration not in year_curve or year_curve[duration] < value:
+                raise Exception("The " + curve + " curve for the last year is worse than the one for the last week at " + str(duration) + " seconds.")
+        print("Test passed!\n")
+
 def run_logout_test(api_url, cookies):
     """Logs out the test user."""
     print_test_title("Logout")
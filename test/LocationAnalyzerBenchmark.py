@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares the sliding window location analysis with the previous approach, which scanned the entire track for every location."""
+"""Uses synthetic tracks so that no database is needed. Also checks that both approaches produce the same results."""
+
+import argparse
+import inspect
+import math
+import os
+import random
+import sys
+import timeit
+
+# Locate and load the analyzer module.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import Keys
+import LocationAnalyzer
+
+def generate_track(num_points, seed):
+    """Returns a list of (time_ms, lat, lon, alt) for a 1 Hz track with a varying speed."""
+    generator = random.Random(seed)
+    track = []
+    time_ms = 1600000000000
+    lat = 40.0
+    lon = -75.0
+    alt = 100.0
+    heading = generator.uniform(0.0, 2.0 * math.pi)
+    for _ in range(num_points):
+        time_ms = time_ms + 1000
+        speed_degrees = generator.uniform(0.00002, 0.00012)
+        heading = heading + generator.uniform(-0.1, 0.1)
+        lat = lat + speed_degrees * math.cos(heading)
+        lon = lon + speed_degrees * math.sin(heading)
+        alt = alt + generator.uniform(-1.0, 1.0)
+        track.append((time_ms, lat, lon, alt))
+    return track
+
+def analyze(activity_type, track, use_scan):
+    """Runs the track through the analyzer, the same way the activity analyzer does. Returns the analyzer and the elapsed time."""
+    analyzer = LocationAnalyzer.LocationAnalyzer(activity_type)
+    analyzer.use_scan = use_scan
+    start_time = timeit.default_timer()
+    for time_ms, lat, lon, alt in track:
+        analyzer.append_location(time_ms, lat, lon, alt, 0.0, 0.0)
+        analyzer.update_speeds()
+    return analyzer, timeit.default_timer() - start_time
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,3600,18000", help="Comma-separated list of track lengths (number of points) to test", required=False)
+    parser.add_argument("--activity-type", default=Keys.TYPE_CYCLING_KEY, help="The activity type, which determines the record distances", required=False)
+    parser.add_argument("--skip-scan-above", default=20000, help="Don't time the scanning approach for tracks longer than this", type=int, required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    print("Points\tWindows (s)\tScan (s)\tSpeedup\tSame Results")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        track = generate_track(size, size)
+        windowed, windowed_secs = analyze(args.activity_type, track, False)
+        if size > args.skip_scan_above:
+            print(str(size) + "\t" + "{:.3f}".format(windowed_secs) + "\t-\t-\t-")
+            continue
+        scanned, scanned_secs = analyze(args.activity_type, track, True)
+        same = windowed.bests == scanned.bests and windowed.speed_graph == scanned.speed_graph and windowed.speed_times == scanned.speed_times and windowed.mile_splits == scanned.mile_splits and windowed.km_splits == scanned.km_splits
+        print(str(size) + "\t" + "{:.3f}".format(windowed_secs) + "\t" + "{:.3f}".format(scanned_secs) + "\t" + "{:.1f}x".format(scanned_secs / max(windowed_secs, 1e-9)) + "\t" + str(same))
+
+if __name__ == "__main__":
+    main()
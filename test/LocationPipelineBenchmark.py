@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Compares adding a location track to the analyzer one point at a time, as is done with live data, with adding it in bulk."""
+"""Uses synthetic tracks so that no database is needed. Also checks that both approaches produce the same results."""
+
+import argparse
+import inspect
+import math
+import os
+import random
+import sys
+import timeit
+
+# Locate and load the analyzer module.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import Keys
+import LocationAnalyzer
+
+def generate_locations(num_points, seed):
+    """Returns a 1 Hz track, with a varying speed and the occasional invalid point, as the list of dictionaries stored in an activity."""
+    generator = random.Random(seed)
+    locations = []
+    time_ms = 1600000000000
+    lat = 40.0
+    lon = -75.0
+    alt = 100.0
+    heading = generator.uniform(0.0, 2.0 * math.pi)
+    for _ in range(num_points):
+        time_ms = time_ms + 1000
+        speed_degrees = generator.uniform(0.00002, 0.00012)
+        heading = heading + generator.uniform(-0.1, 0.1)
+        lat = lat + speed_degrees * math.cos(heading)
+        lon = lon + speed_degrees * math.sin(heading)
+        alt = alt + generator.uniform(-1.0, 1.0)
+        accuracy = generator.choice([3.0, 5.0, 8.0, 75.0]) if generator.random() < 0.05 else 5.0
+        locations.append({ Keys.LOCATION_TIME_KEY: time_ms, Keys.LOCATION_LAT_KEY: lat, Keys.LOCATION_LON_KEY: lon, Keys.LOCATION_ALT_KEY: alt, Keys.LOCATION_HORIZONTAL_ACCURACY_KEY: accuracy })
+    return locations
+
+def analyze_incrementally(locations, activity_type):
+    """Adds the locations one at a time."""
+    analyzer = LocationAnalyzer.LocationAnalyzer(activity_type)
+    for location in locations:
+        analyzer.append_location(location[Keys.LOCATION_TIME_KEY], location[Keys.LOCATION_LAT_KEY], location[Keys.LOCATION_LON_KEY], location[Keys.LOCATION_ALT_KEY], location[Keys.LOCATION_HORIZONTAL_ACCURACY_KEY], 0.0)
+    return analyzer
+
+def analyze_in_bulk(locations, activity_type):
+    """Adds all the locations at once."""
+    analyzer = LocationAnalyzer.LocationAnalyzer(activity_type)
+    analyzer.append_locations(locations)
+    return analyzer
+
+def is_close(a, b):
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+
+def compare(incremental, bulk):
+    """Raises an exception if the two analyzers don't agree."""
+    if len(incremental.distance_buf) != len(bulk.distance_buf):
+        raise Exception("Distance buffers are different lengths.")
+    for (time_a, distance_a), (time_b, distance_b) in zip(incremental.distance_buf, bulk.distance_buf):
+        if time_a != time_b or not is_close(distance_a, distance_b):
+            raise Exception("Distance buffers differ at " + str(time_a) + ".")
+    if incremental.km_splits != bulk.km_splits or incremental.mile_splits != bulk.mile_splits:
+        raise Exception("Splits differ.")
+    if not is_close(incremental.total_vertical, bulk.total_vertical):
+        raise Exception("Vertical gain differs.")
+    if not is_close(incremental.avg_speed, bulk.avg_speed):
+        raise Exception("Average speed differs.")
+    if incremental.location_heat_map.map != bulk.location_heat_map.map:
+        raise Exception("Heat maps differ.")
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,20000", help="Comma-separated list of track lengths (in points) to test", required=False)
+    parser.add_argument("--activity-type", default=Keys.TYPE_RUNNING_KEY, help="Activity type to analyze", required=False)
+    parser.add_argument("--seed", default=1, help="Random seed for generating the tracks", type=int, required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    print("Points\tIncremental (ms)\tBulk (ms)")
+    for size in [int(x) for x in args.sizes.split(',')]:
+        locations = generate_locations(size, args.seed)
+
+        start_time = timeit.default_timer()
+        incremental = analyze_incrementally(locations, args.activity_type)
+        incremental_ms = (timeit.default_timer() - start_time) * 1000.0
+
+        start_time = timeit.default_timer()
+        bulk = analyze_in_bulk(locations, args.activity_type)
+        bulk_ms = (timeit.default_timer() - start_time) * 1000.0
+
+        compare(incremental, bulk)
+        print(str(size) + "\t" + "{:.1f}".format(incremental_ms) + "\t" + "{:.1f}".format(bulk_ms))
+
+if __name__ == "__main__":
+    main()
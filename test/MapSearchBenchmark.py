@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+"""Compares the original map search (parse the GeoJSON, then test every polygon in turn) with the indexed search: the time to load"""
+"""the maps, with and without the binary cache, and the number of lookups per second. Also checks that both give the same answers."""
+
+import argparse
+import inspect
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+# Locate and load the map search module.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import GeoJsonReader
+import MapSearch
+
+def is_point_in_poly(lon, lat, poly):
+    """Point in polygon, one vertex at a time, the way the original search did it."""
+    inside = False
+    j = len(poly) - 1
+    for i in range(len(poly)):
+        if (poly[i][1] > lat) != (poly[j][1] > lat) and lon < (poly[j][0] - poly[i][0]) * (lat - poly[i][1]) / (poly[j][1] - poly[i][1]) + poly[i][0]:
+            inside = not inside
+        j = i
+    return inside
+
+class LinearMapSearch(object):
+    """The original approach: parse the GeoJSON and test every polygon of every region until one contains the point."""
+
+    def __init__(self, file_names):
+        self.layers = []
+        for file_name in file_names:
+            reader = GeoJsonReader.GeoJsonReader()
+            reader.read('file://' + file_name)
+            self.layers.append([(feature['properties']['name'], MapSearch.rings_from_geometry(feature['geometry'])) for feature in reader.data['features']])
+
+    def search_layer(self, layer, lat, lon):
+        for name, rings in layer:
+            num_rings = 0
+            for ring in rings:
+                if is_point_in_poly(lon, lat, ring):
+                    num_rings = num_rings + 1
+            if num_rings % 2 == 1:
+                return name
+        return None
+
+    def search_map(self, lat, lon):
+        description = []
+        country = self.search_layer(self.layers[0], lat, lon)
+        if country:
+            description.append(country)
+            if country == 'United States':
+                state = self.search_layer(self.layers[1], lat, lon)
+                if state:
+                    description.append(state)
+            elif country == 'Canada':
+                province = self.search_layer(self.layers[2], lat, lon)
+                if province:
+                    description.append(province)
+        return description
+
+def time_ms(func):
+    """Returns the result of calling the function and the time it took, in milliseconds."""
+    start_time = timeit.default_timer()
+    result = func()
+    return result, (timeit.default_timer() - start_time) * 1000.0
+
+def random_points(num_points):
+    """Half of the points are anywhere, the other half are in North America, which exercises the state and province maps."""
+    points = []
+    for i in range(num_points):
+        if i % 2 == 0:
+            points.append((random.uniform(-60.0, 75.0), random.uniform(-180.0, 180.0)))
+        else:
+            points.append((random.uniform(25.0, 60.0), random.uniform(-130.0, -65.0)))
+    return points
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=1000, help="Number of random points to look up", required=False)
+    parser.add_argument("--seed", type=int, default=1, help="Random seed", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    random.seed(args.seed)
+    points = random_points(args.points)
+    file_names = [ MapSearch.WORLD_MAP_FILE, MapSearch.US_STATES_MAP_FILE, MapSearch.CANADIAN_PROVINCES_MAP_FILE ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file_name = os.path.join(temp_dir, 'map_search_cache.npz')
+        linear_search, linear_load_ms = time_ms(lambda: LinearMapSearch(file_names))
+        _, build_ms = time_ms(lambda: MapSearch.MapSearch(file_names[0], file_names[1], file_names[2], cache_file_name))
+        indexed_search, cached_load_ms = time_ms(lambda: MapSearch.MapSearch(file_names[0], file_names[1], file_names[2], cache_file_name))
+        cache_size = os.path.getsize(cache_file_name)
+
+    linear_results, linear_ms = time_ms(lambda: [linear_search.search_map(lat, lon) for lat, lon in points])
+    indexed_results, indexed_ms = time_ms(lambda: [indexed_search.search_map(lat, lon) for lat, lon in points])
+
+    num_differences = sum(1 for lhs, rhs in zip(linear_results, indexed_results) if lhs != rhs)
+    if num_differences > 0:
+        print(str(num_differences) + " of the lookups do not match!")
+
+    print("Search\tLoad (ms)\tLookups per second")
+    print("Original\t" + "{:.1f}".format(linear_load_ms) + "\t" + "{:.0f}".format(len(points) / (linear_ms / 1000.0)))
+    print("Indexed, no cache\t" + "{:.1f}".format(build_ms) + "\t")
+    print("Indexed, cached\t" + "{:.1f}".format(cached_load_ms) + "\t" + "{:.0f}".format(len(points) / (indexed_ms / 1000.0)))
+    print("Cache file size: " + str(cache_size) + " bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Unit tests for the packed stream encoding."""
+
+import argparse
+import inspect
+import math
+import os
+import random
+import sys
+
+import numpy as np
+from bson.binary import Binary
+
+# Locate and load modules from the main source directory.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import Keys
+import StreamCodec
+
+def make_location_samples(num_samples):
+    """Returns a location stream with full precision coordinates and fractional accuracies."""
+    samples = []
+    for i in range(num_samples):
+        sample = {}
+        sample[Keys.STREAM_SAMPLE_TIME_KEY] = 1600000000000 + i * 1000
+        sample[Keys.LOCATION_LAT_KEY] = 37.7749 + random.uniform(-0.01, 0.01)
+        sample[Keys.LOCATION_LON_KEY] = -122.4194 + random.uniform(-0.01, 0.01)
+        sample[Keys.LOCATION_ALT_KEY] = random.uniform(0.0, 100.0)
+        sample[Keys.LOCATION_HORIZONTAL_ACCURACY_KEY] = random.uniform(3.0, 49.9)
+        sample[Keys.LOCATION_VERTICAL_ACCURACY_KEY] = 10.0
+        samples.append(sample)
+    return samples
+
+def make_value_samples(num_samples, make_value):
+    """Returns a time/value stream in the stream store's sample format."""
+    return [{ Keys.STREAM_SAMPLE_TIME_KEY: 1600000000000 + i * 1000, Keys.STREAM_SAMPLE_VALUE_KEY: make_value(i) } for i in range(num_samples)]
+
+def check_round_trip(stream_name, samples):
+    """Packs and unpacks the samples, then checks that every value came back unchanged."""
+    packed = StreamCodec.pack_samples(stream_name, samples)
+    assert packed is not None, stream_name + ": samples could not be packed"
+    assert packed[Keys.STREAM_PACKED_COUNT_KEY] == len(samples)
+
+    unpacked = StreamCodec.unpack(stream_name, packed).to_samples()
+    assert len(unpacked) == len(samples)
+    for original, decoded in zip(samples, unpacked):
+        assert original.keys() == decoded.keys()
+        for name in original:
+            assert decoded[name] == original[name], "{}: {} changed from {!r} to {!r}".format(stream_name, name, original[name], decoded[name])
+            assert math.copysign(1.0, decoded[name]) == math.copysign(1.0, original[name])
+    return packed
+
+def run_unit_tests():
+    """Entry point for the unit tests."""
+
+    # Full precision floats must not be narrowed.
+    packed = check_round_trip(Keys.APP_LOCATIONS_KEY, make_location_samples(500))
+    assert packed[Keys.STREAM_PACKED_DTYPES_KEY][Keys.LOCATION_HORIZONTAL_ACCURACY_KEY] == StreamCodec.FULL_COLUMN_DTYPE
+    check_round_trip(Keys.APP_POWER_KEY, make_value_samples(500, lambda i: random.uniform(100.0, 400.0)))
+    check_round_trip(Keys.APP_ACCELEROMETER_KEY, [{ Keys.STREAM_SAMPLE_TIME_KEY: i, Keys.ACCELEROMETER_AXIS_NAME_X: random.gauss(0.0, 1.0), Keys.ACCELEROMETER_AXIS_NAME_Y: random.gauss(0.0, 1.0), Keys.ACCELEROMETER_AXIS_NAME_Z: -0.0 } for i in range(500)])
+
+    # Columns whose values all fit a smaller type are stored in it.
+    packed = check_round_trip(Keys.APP_HEART_RATE_KEY, make_value_samples(500, lambda i: 100 + i % 80))
+    assert packed[Keys.STREAM_PACKED_DTYPES_KEY][Keys.STREAM_SAMPLE_VALUE_KEY] == '<i2'
+    packed = check_round_trip(Keys.APP_CADENCE_KEY, make_value_samples(500, lambda i: 80.5 + (i % 4) * 0.25))
+    assert packed[Keys.STREAM_PACKED_DTYPES_KEY][Keys.STREAM_SAMPLE_VALUE_KEY] == '<f4'
+
+    # Out of order samples come back sorted.
+    samples = make_value_samples(100, lambda i: float(i) / 3.0)
+    random.shuffle(samples)
+    packed = StreamCodec.pack_samples(Keys.APP_POWER_KEY, samples)
+    unpacked = StreamCodec.unpack(Keys.APP_POWER_KEY, packed).to_samples()
+    assert unpacked == sorted(samples, key=lambda sample: sample[Keys.STREAM_SAMPLE_TIME_KEY])
+
+    # Chunks packed before the column types were stored are still readable.
+    legacy = StreamCodec.pack_samples(Keys.APP_HEART_RATE_KEY, make_value_samples(10, lambda i: 120.5))
+    del legacy[Keys.STREAM_PACKED_DTYPES_KEY]
+    legacy[Keys.STREAM_PACKED_COLUMNS_KEY][Keys.STREAM_SAMPLE_VALUE_KEY] = Binary(np.full(10, 120.5, dtype='<f4').tobytes())
+    assert StreamCodec.unpack(Keys.APP_HEART_RATE_KEY, legacy).values().tolist() == [120.5] * 10
+
+    print("Stream codec tests passed.")
+    return True
+
+def main():
+    """Starts the tests."""
+
+    # Parse the command line arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, action="store", default=0, help="Random number generator seed", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    random.seed(args.seed)
+    run_unit_tests()
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,7 @@ import traceback
 import ApiTester
 import CsvToJson
 import ImportTester
+import StreamCodecTester
 import WorkoutPlanTester
 
 # Locate and load the config module.
@@ -49,6 +50,9 @@ def do_api_tests(url, username, password, realname):
 def do_importer_tests(test_files_dir_name):
     ImportTester.run_unit_tests(test_files_dir_name)
 
+def do_stream_codec_tests():
+    StreamCodecTester.run_unit_tests()
+
 def do_workout_plan_tests(config):
     testdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
     csv_file_name = os.path.join(testdir, "WorkoutTrainingInputs.csv")
@@ -81,6 +85,8 @@ def main():
     try:
         print("API Tests:")
         do_api_tests(args.url, args.username, args.password, args.realname)
+        print("Stream Codec Tests:")
+        do_stream_codec_tests()
         print("Importer Tests:")
         do_importer_tests(args.importdir)
         print("Workout Plan Tests:")
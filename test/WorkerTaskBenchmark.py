@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# 
+# # MIT License
+# 
+# Copyright (c) 2022 Mike Simms
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Measures the fixed cost of an analysis task, using a trivial activity (one that no longer exists, so the task only has to find that out)."""
+"""Compares building a new DataMgr and UserMgr for every task, which is what the tasks used to do, with using the worker process's"""
+"""shared context. Needs a database, and a celery installation, but not a broker, since the tasks are called directly."""
+
+import argparse
+import inspect
+import os
+import sys
+import timeit
+import uuid
+
+# Locate and load the worker modules.
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import ActivityAnalyzer
+import AnalysisScheduler
+import Config
+import DataMgr
+import UserMgr
+import WorkerContext
+
+def run_with_new_managers(activity_id, user_id, config):
+    """The task as it used to be: new managers, and therefore new database connections, every time."""
+    root_dir = os.path.dirname(os.path.abspath(ActivityAnalyzer.__file__))
+    data_mgr = DataMgr.DataMgr(config=config, root_url="file://" + root_dir, analysis_scheduler=AnalysisScheduler.AnalysisScheduler(), import_scheduler=None)
+    user_mgr = UserMgr.UserMgr(config=config, session_mgr=None)
+    analyzer = ActivityAnalyzer.ActivityAnalyzer(None, uuid.uuid4(), data_mgr, user_mgr)
+    if analyzer.load_activity(activity_id, user_id, 1):
+        analyzer.perform_analysis()
+
+def run_with_worker_context(activity_id, user_id):
+    """The task as it is now."""
+    ActivityAnalyzer.analyze_activity(activity_id, user_id, 1, uuid.uuid4())
+
+def time_per_task_ms(func, num_tasks):
+    """Returns the average time, in milliseconds, for one call of the function."""
+    start_time = timeit.default_timer()
+    for _ in range(num_tasks):
+        func()
+    return (timeit.default_timer() - start_time) * 1000.0 / num_tasks
+
+def main():
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=50, help="Number of tasks to run each way", required=False)
+
+    try:
+        args = parser.parse_args()
+    except IOError as e:
+        parser.error(e)
+        sys.exit(1)
+
+    config = Config.Config() # Same as the workers, which use the defaults
+    activity_id = str(uuid.uuid4())
+    user_id = uuid.uuid4().hex
+
+    # Set up the context, as the process init hook does.
+    init_ms = time_per_task_ms(WorkerContext.init_worker_context, 1)
+    new_managers_ms = time_per_task_ms(lambda: run_with_new_managers(activity_id, user_id, config), args.tasks)
+    worker_context_ms = time_per_task_ms(lambda: run_with_worker_context(activity_id, user_id), args.tasks)
+    WorkerContext.shutdown_worker_context()
+
+    print("Worker process setup (once per process): " + "{:.1f}".format(init_ms) + " ms")
+    print("Task overhead, new managers per task: " + "{:.2f}".format(new_managers_ms) + " ms")
+    print("Task overhead, shared worker context: " + "{:.2f}".format(worker_context_ms) + " ms")
+
+if __name__ == "__main__":
+    main()